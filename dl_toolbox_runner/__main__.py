@@ -4,6 +4,8 @@ import datetime
 import dl_toolbox_runner
 from dl_toolbox_runner.main import Runner
 from dl_toolbox_runner.utils.file_utils import abs_file_path, round_datetime
+from dl_toolbox_runner.utils.layout import migrate_layout, output_file_key, toolbox_conf_key
+from dl_toolbox_runner.utils.profiling import MODES, get_profiler
 
 def main():
     """command line entry point for the dl_toolbox_runner package. Type 'python3 -m dl_toolbox_runner -h' for more info"""
@@ -30,6 +32,14 @@ def main():
                         help='round the end_time to the nearest x minute. Note that this is NOT the averaging time which is defined in the main config file.')
     parser.add_argument('--instrument_id', type=str, default=None,
                         help='instrument_id to process (e.g. "PAYWL")')
+    parser.add_argument('--profile', nargs='?', const='cprofile', choices=MODES, default=None,
+                        help='profile all stages of this run (cprofile if no mode given) and write the profiles to '
+                             'profile_dir of the main config, regardless of the profile_* settings there')
+    parser.add_argument('--failure_report', action='store_true',
+                        help='print the files and batches quarantined in the failure ledger of the main config and exit')
+    parser.add_argument('--migrate_layout', action='store_true',
+                        help='move the files of flat output_dir and toolbox_confdir to the partitions of output_partition '
+                             'and toolbox_conf_partition of the main config and exit')
     
     args = parser.parse_args()
 
@@ -49,6 +59,24 @@ def main():
 
     # Initialize the Runner
     x = Runner(kwargs['main_conf'], single_process=kwargs['single_process'])
+
+    if args.profile:
+        x.conf.update({'profile_mode': args.profile, 'profile_sample_rate': 1, 'profile_stages': None})
+        x.profiler = get_profiler(x.conf)
+
+    if args.failure_report:
+        if x.failures is None:
+            print('No failure_ledger configured in the main config')
+        else:
+            print(x.failures.report())
+        return
+
+    if args.migrate_layout:
+        n_outputs = migrate_layout(x.conf['output_dir'], x.conf.get('output_partition'),
+                                   lambda file: output_file_key(file, x.conf['output_file_prefix']))
+        n_confs = migrate_layout(x.conf['toolbox_confdir'], x.conf.get('toolbox_conf_partition'), toolbox_conf_key)
+        print(f'Moved {n_outputs} output files and {n_confs} toolbox config files to their partitions')
+        return
     
     # Find the latest "round" time (e.g. 13:00, 13:10, 13:20, 13:30) and use this as date_end
     date_end = round_datetime(datetime.datetime.now() - datetime.timedelta(minutes=10), round_to_minutes=kwargs['round_to_minutes'])
@@ -0,0 +1,185 @@
+import fcntl
+import os
+import re
+import tempfile
+import threading
+from queue import Queue
+
+import pandas as pd
+import xarray as xr
+
+from dl_toolbox_runner.log import logger
+
+try:
+    import netCDF4
+except ImportError:  # daily files are then rewritten on each merge
+    netCDF4 = None
+
+_STOP = object()  # sentinel stopping the worker thread
+LOCK_FILE = '.daily.lock'  # in daily_dir, locked while merging into any daily file of the directory
+TIME_ENCODING = {'units': 'seconds since 1970-01-01 00:00:00', 'calendar': 'standard', 'dtype': 'float64'}
+
+
+class DailyAggregator(object):
+    """Append the L2 output files of single retrieval windows to daily files per instrument, in a background thread
+
+    Window files are named <prefix><instrument_id>_<YYYYmmddHHMM>.nc as written by the DL toolbox. Their content is
+    merged into <prefix><instrument_id>_<YYYYmmdd>.nc in daily_dir along the time dimension, sorted by time and with
+    later windows replacing earlier data at identical times (e.g. when reprocessing). Windows later than the data of
+    the daily file are appended in place along its unlimited time dimension (requires netCDF4), otherwise (e.g. when
+    reprocessing or if variables or heights change) the daily file is rewritten and replaced atomically. daily_dir is
+    locked while merging, such that concurrent retrieval processes can append to the same daily file. Windows
+    submitted while the worker is busy are merged together.
+
+    Args:
+        daily_dir: directory of the daily files
+        prefix: file name prefix of the window files before the instrument id (output_file_prefix of the main config)
+        remove_windows (optional): remove the window files once merged. Defaults to False
+    """
+
+    def __init__(self, daily_dir, prefix, remove_windows=False):
+        self.daily_dir = daily_dir
+        self.prefix = prefix
+        self.remove_windows = remove_windows
+        self.pattern = re.compile(re.escape(prefix) + r'(?P<instrument_id>[A-Za-z0-9]{5})_(?P<date>\d{8})\d*\.nc$')
+        self.queue = Queue()
+        self.worker = None
+        self._lock = threading.Lock()  # submit may be called from several threads (see Runner.run_pipelined)
+
+    def daily_file(self, window_file):
+        """path to the daily file of window_file, None if window_file is not named like a window output"""
+        match = self.pattern.match(os.path.basename(window_file))
+        if match is None:
+            return None
+        return os.path.join(self.daily_dir, f"{self.prefix}{match['instrument_id']}_{match['date']}.nc")
+
+    def submit(self, window_files):
+        """queue window files for merging into their daily files and return immediately"""
+        with self._lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.work, name='daily_aggregator', daemon=True)
+                self.worker.start()
+            for file in window_files:
+                self.queue.put(file)
+
+    def close(self):
+        """wait for all submitted windows to be merged and stop the worker"""
+        with self._lock:
+            if self.worker is not None and self.worker.is_alive():
+                self.queue.put(_STOP)
+                self.worker.join()
+
+    def work(self):
+        while True:
+            files = [self.queue.get()]
+            while not self.queue.empty():  # merge the backlog with one rewrite per daily file
+                files.append(self.queue.get())
+            stop = _STOP in files
+            by_day = {}
+            for file in files:
+                if file is _STOP:
+                    continue
+                daily_file = self.daily_file(file)
+                if daily_file is None:
+                    logger.warning(f'{file} is not named like a window output file, not aggregated')
+                    continue
+                by_day.setdefault(daily_file, []).append(file)
+            for daily_file, window_files in by_day.items():
+                try:
+                    self.merge(daily_file, window_files)
+                except Exception as e:
+                    logger.error(f'Could not append {len(window_files)} windows to {daily_file}: {e}')
+            if stop:
+                return
+
+    def merge(self, daily_file, window_files):
+        """merge window_files into daily_file"""
+        os.makedirs(self.daily_dir, exist_ok=True)
+        with open(os.path.join(self.daily_dir, LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            ds = combine([load_dataset(file) for file in sorted(window_files)])
+            if not os.path.exists(daily_file):
+                self.write(daily_file, ds)
+            elif not self.append(daily_file, ds):
+                self.write(daily_file, combine([load_dataset(daily_file), ds]))
+        logger.info(f'Appended {len(window_files)} windows to {daily_file}')
+        if self.remove_windows:
+            for file in window_files:
+                os.remove(file)
+
+    def write(self, daily_file, ds):
+        """write ds to daily_file, replacing it atomically"""
+        fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(daily_file) + '.', suffix='.part', dir=self.daily_dir)
+        os.close(fd)
+        try:
+            # times as float seconds, such that later windows can be appended without loss of precision
+            encoding = {name: dict(TIME_ENCODING) for name, var in ds.variables.items() if var.dtype.kind == 'M'}
+            ds.to_netcdf(tmp_file, unlimited_dims=['time'], encoding=encoding)
+            os.chmod(tmp_file, 0o644)  # readable like the window files, mkstemp creates it private
+            os.replace(tmp_file, daily_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def append(self, daily_file, ds):
+        """append ds in place to daily_file along time. False (nothing written) if it must be rewritten instead"""
+        if netCDF4 is None:
+            return False
+        with xr.open_dataset(daily_file) as daily:
+            if len(daily.time) and ds.get_index('time')[0] <= daily.get_index('time')[-1]:
+                return False  # not later than the daily data, sorting and replacing needed
+        with netCDF4.Dataset(daily_file, 'a') as nc:
+            if not appendable(nc, ds):
+                return False
+            start = len(nc.dimensions['time'])
+            for name, var in ds.variables.items():
+                if 'time' not in var.dims:
+                    continue
+                values = var.values
+                if values.dtype.kind == 'M':
+                    values = netCDF4.date2num(pd.DatetimeIndex(values.ravel()).to_pydatetime(), nc[name].units,
+                                              getattr(nc[name], 'calendar', 'standard')).reshape(values.shape)
+                index = tuple(slice(start, start + len(ds.time)) if dim == 'time' else slice(None) for dim in var.dims)
+                nc[name][index] = values
+        return True
+
+
+def appendable(nc, ds):
+    """True if all time dependent variables of ds can be appended to the open netCDF4 dataset nc without conversion"""
+    if 'time' not in nc.dimensions or not nc.dimensions['time'].isunlimited():
+        return False
+    for name, var in ds.variables.items():
+        if 'time' not in var.dims:
+            continue
+        if name not in nc.variables or nc[name].dimensions != var.dims:
+            return False
+        if any(len(nc.dimensions[dim]) != size for dim, size in var.sizes.items() if dim != 'time'):
+            return False
+        target = nc[name]
+        if var.dtype.kind == 'M':
+            if target.dtype.kind != 'f' or not hasattr(target, 'units'):  # integer times may not hold later windows
+                return False
+        elif var.dtype.kind not in 'biuf' or (var.dtype.kind == 'f' and target.dtype.kind != 'f'):
+            return False
+    return True
+
+
+def combine(datasets):
+    """concatenate datasets along time, sorted by time and keeping the last of identical times"""
+    ds = xr.concat(datasets, dim='time', data_vars='minimal', coords='minimal', compat='override', join='outer',
+                   combine_attrs='override')
+    return ds.isel(time=~ds.get_index('time').duplicated(keep='last')).sortby('time')
+
+
+def load_dataset(file):
+    """load file to memory and close it"""
+    with xr.open_dataset(file) as ds:
+        return ds.load()
+
+
+def get_daily_aggregator(conf):
+    """get the daily aggregator configured in the main config dictionary conf, None if no aggregate_dir configured"""
+    if not conf.get('aggregate_dir'):
+        return None
+    return DailyAggregator(conf['aggregate_dir'], conf['output_file_prefix'],
+                           remove_windows=conf.get('aggregate_remove_windows', False))
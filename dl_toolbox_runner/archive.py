@@ -0,0 +1,146 @@
+import datetime
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+import pandas as pd
+
+from dl_toolbox_runner.errors import DLConfigError
+from dl_toolbox_runner.log import logger
+from dl_toolbox_runner.utils.compression import COMPRESSION_EXTS, is_compressed
+from dl_toolbox_runner.utils.input_backend import is_url
+from dl_toolbox_runner.utils.layout import partition_dir
+
+MODES = ['move', 'link']
+LEDGER_FILE = 'pending.json'
+
+
+class Archiver(object):
+    '''
+    Move input files out of the watched input directory into a date-partitioned archive once they have been processed
+
+    Files of successfully retrieved batches are recorded as pending with the end of their latest window. They are
+    archived once grace_min minutes have passed since, such that later (e.g. overlapping or delayed) windows can still
+    use them. The pending files are kept in a json ledger in archive_dir, shared under a file lock by the processes
+    recording them (e.g. the retrievals of the realtime watcher).
+
+    Args:
+        archive_dir: root directory of the archive. Must not be within the input directory
+        partition (optional): partitioning scheme of the archive (see partition_dir). Defaults to
+            '{instrument_id}/{YYYY}/{MM}/{DD}'
+        grace_min (optional): time in minutes after the end of the last window of a file before archiving. Defaults to 60
+        mode (optional): 'move' (rename, copying across file systems) or 'link' (hard link into the archive and
+            unlink from the input directory, never copying). Defaults to 'move'
+        compress (optional): compression extension ('.gz', '.bz2' or '.xz') to compress files with on the way.
+            Already compressed files are archived as they are. Defaults to None, i.e. no compression
+    '''
+
+    def __init__(self, archive_dir, partition='{instrument_id}/{YYYY}/{MM}/{DD}', grace_min=60, mode='move',
+                 compress=None):
+        if mode not in MODES:
+            raise DLConfigError(f"unknown archive mode '{mode}', known are: {', '.join(MODES)}")
+        if compress is not None and compress not in COMPRESSION_EXTS:
+            raise DLConfigError(f"unknown archive compression '{compress}', known are: {', '.join(COMPRESSION_EXTS)}")
+        self.archive_dir = str(archive_dir)
+        self.partition = partition
+        self.grace = datetime.timedelta(minutes=grace_min)
+        self.mode = mode
+        self.compress = compress
+        self.ledger_file = os.path.join(self.archive_dir, LEDGER_FILE)
+
+    @contextmanager
+    def pending(self):
+        """lock the ledger of pending files and yield its entries, which are written back on exit"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with open(self.ledger_file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = {}
+            if os.path.exists(self.ledger_file):
+                with open(self.ledger_file) as f:
+                    entries = json.load(f)
+            yield entries
+            tmp_file = self.ledger_file + '.part'
+            with open(tmp_file, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_file, self.ledger_file)
+
+    def record(self, batches):
+        """record the input files of successfully retrieved batches as pending for archival"""
+        with self.pending() as entries:
+            for batch in batches:
+                window_end = pd.Timestamp(batch['retrieval_end_time'] if batch.get('retrieval_end_time') is not None
+                                          else batch['batch_end_time'])
+                window_start = batch.get('retrieval_start_time')
+                date = pd.Timestamp(window_start if window_start is not None else batch['batch_start_time'])
+                for file in batch.get('source_files', batch['files']):
+                    if is_url(file):  # only files on the local (or network) file system can be archived
+                        continue
+                    file_date, done = date, window_end
+                    entry = entries.get(str(file))
+                    if entry is not None:  # file of several windows, archived by the date of the first one
+                        file_date = min(file_date, pd.Timestamp(entry['date']))
+                        done = max(done, pd.Timestamp(entry['done']))
+                    entries[str(file)] = {'instrument_id': batch['instrument_id'], 'date': file_date.isoformat(),
+                                          'done': done.isoformat()}
+
+    def archive_due(self, now=None):
+        """archive the pending files whose grace period has passed. Returns the number of archived files"""
+        now = pd.Timestamp(now or datetime.datetime.now())
+        n_archived = 0
+        with self.pending() as entries:
+            for file, entry in list(entries.items()):
+                if pd.Timestamp(entry['done']) + self.grace > now:
+                    continue
+                if os.path.exists(file):
+                    try:
+                        self.archive(file, entry['instrument_id'], pd.Timestamp(entry['date']))
+                    except OSError as e:
+                        logger.error(f'Could not archive {file}: {e}')
+                        continue
+                    n_archived += 1
+                del entries[file]
+        if n_archived:
+            logger.info(f'Archived {n_archived} input files to {self.archive_dir}')
+        return n_archived
+
+    def archive(self, file, instrument_id, date):
+        """move file to its partition of the archive, compressing it if configured. Returns the archived path"""
+        target_dir = partition_dir(self.archive_dir, self.partition, instrument_id, date, create=True)
+        target = os.path.join(target_dir, os.path.basename(file))
+        if self.compress is not None and not is_compressed(file):
+            target += self.compress
+            fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(target) + '.', suffix='.part', dir=target_dir)
+            try:
+                with open(file, 'rb') as src, os.fdopen(fd, 'wb') as raw, COMPRESSION_EXTS[self.compress](raw, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, length=2**20)
+                shutil.copystat(file, tmp_path)
+                os.replace(tmp_path, target)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            os.remove(file)
+        elif self.mode == 'link':
+            if os.path.exists(target):
+                os.remove(target)  # e.g. left by an interrupted run
+            os.link(file, target)
+            os.remove(file)
+        else:
+            shutil.move(file, target)
+        logger.debug(f'Archived {file} to {target}')
+        return target
+
+
+def get_archiver(conf):
+    """get the archiver configured in the main config dictionary conf, None if no archive_dir configured"""
+    if not conf.get('archive_dir'):
+        return None
+    if not is_url(conf['input_dir']):
+        input_dir = os.path.realpath(conf['input_dir'])
+        if os.path.commonpath([input_dir, os.path.realpath(conf['archive_dir'])]) == input_dir:
+            raise DLConfigError('archive_dir must not be within input_dir, archived files would be processed again')
+    return Archiver(conf['archive_dir'], partition=conf.get('archive_partition', '{instrument_id}/{YYYY}/{MM}/{DD}'),
+                    grace_min=conf.get('archive_grace_min', 60), mode=conf.get('archive_mode', 'move'),
+                    compress=conf.get('archive_compress'))
@@ -4,6 +4,8 @@ import pandas as pd
 
 from dl_toolbox_runner.errors import MissingConfig
 from dl_toolbox_runner.utils.config_utils import get_conf
+from dl_toolbox_runner.utils.halo_cache import get_halo_cache
+from dl_toolbox_runner.utils.layout import partition_dir
 from dl_toolbox_runner.utils.file_utils import abs_file_path, get_config_path, get_insttype, dict_to_file, open_sweep_group, read_halo
 from dl_toolbox_runner.log import logger
 
@@ -17,10 +19,12 @@ class Configurator(object):
     Args:
         datafile: filename of the data file to be processed
         configfile: filename of the configuration file generated by running this class
+        output_date (optional): date selecting the partition of output_dir for the L2 output (see output_partition in
+            the main config), e.g. the start of the retrieval window. Defaults to None, i.e. the date of datafile
     """
 
     def __init__(self, instrument_id, scan_type, datafile, configfile, main_config, file_default_config='dl_toolbox_runner/config/default_config.yaml',
-                 file_conf_param_match='dl_toolbox_runner/config/conf_match.yaml'):
+                 file_conf_param_match='dl_toolbox_runner/config/conf_match.yaml', output_date=None):
 
         self.conf = get_conf(abs_file_path(file_default_config))  # init with defaults from file, update later in code
         self.instrument_id = instrument_id
@@ -30,6 +34,7 @@ class Configurator(object):
         self.main_config = main_config
         self.conf_param_match = get_conf(abs_file_path(file_conf_param_match))
         self.date = None  # datetime.datetime object for timesteamp of datafile
+        self.output_date = output_date
 
     def run(self):
         logger.info('Treating: '+self.instrument_id)
@@ -64,16 +69,22 @@ class Configurator(object):
             raise MissingConfig(f"Error during configuration writing: {e}")
         logger.info('Config file for '+self.conf['NC_instrument_id']+f' written to {self.configfile}')
 
+    def output_dir(self):
+        """directory for the L2 output in output_dir of the main config, partitioned by instrument and date if configured"""
+        return partition_dir(self.main_config['output_dir'], self.main_config.get('output_partition'), self.instrument_id,
+                             self.output_date if self.output_date is not None else self.date, create=True)
+
     def from_datafile(self):
         '''
         Extracting configurations from the raw file
         '''              
         if self.conf['inst_type'] == 'windcube':      
             # Some parameters needs to be read in the filename / file
-            ds = xr.open_dataset(self.datafile)      
+            with xr.open_dataset(self.datafile) as ds:  # root group only holds metadata, load it and close the file
+                ds = ds.load()
             
             # From filename:
-            self.conf['NC_L2_path'] = self.main_config['output_dir']
+            self.conf['NC_L2_path'] = self.output_dir()
             self.conf['NC_L2_basename'] = self.main_config['output_file_prefix'] + self.conf['NC_instrument_id'] + '_'
 
             # General variables
@@ -95,7 +106,8 @@ class Configurator(object):
             # Name of the sweep group (always different in Windcube files)
             group_name = ds.sweep_group_name.data[0]
             
-            ds_sweep = open_sweep_group(self.datafile, group_name)
+            ds_sweep = open_sweep_group(self.datafile, group_name,
+                                        variables=['range_gate_length', 'gate_index', 'ray_accumulation_time', 'azimuth'])
             
             self.conf['range_gate_length'] = float(ds_sweep.range_gate_length.data)
             self.conf['number_of_gates'] = len(ds_sweep.gate_index.data)
@@ -171,7 +183,7 @@ class Configurator(object):
         elif self.conf['inst_type'] == 'halo':
             # For HALO instruments
             # From filename:
-            self.conf['NC_L2_path'] = self.main_config['output_dir']
+            self.conf['NC_L2_path'] = self.output_dir()
             self.conf['NC_L2_basename'] = self.main_config['output_file_prefix'] + self.conf['NC_instrument_id'] + '_'
            
             # For halo instrument, lon-lat-alt are not in the file
@@ -186,7 +198,7 @@ class Configurator(object):
             self.conf['system_altitude'] = dl.altitude.values[0]
 
             # Some parameters needs to be read in the filename / file
-            mheader, time_ds = read_halo(abs_file_path(self.datafile))
+            mheader, time_ds = read_halo(abs_file_path(self.datafile), cache=get_halo_cache(self.main_config))
                             
             self.conf['range_gate_length'] = float(mheader['Range gate length (m)'])
             self.conf['number_of_gates'] = int(mheader['Number of gates'])
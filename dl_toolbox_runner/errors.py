@@ -25,6 +25,9 @@ class DLTestError(DLError):
 class LogicError(DLError):
     """Raised if there is an error in the retrieval logic orchestration"""
 
+class ToolboxRunError(DLError):
+    """Raised if a run of the DL toolbox fails, e.g. by exceeding its time or memory budget"""
+
 ###############################
 class MissingConfig(DLConfigError):
     """Raised if a mandatory entry of the config file is missing"""
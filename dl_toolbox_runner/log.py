@@ -1,6 +1,12 @@
+import atexit
+import copy
 import datetime as dt
 import os
-from logging import DEBUG, FileHandler, Formatter, StreamHandler, getLogger
+import threading
+import time
+from logging import DEBUG, INFO, FileHandler, Filter, Formatter, StreamHandler, getLogger
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 from sys import stdout
 
 from dl_toolbox_runner.utils.config_utils import get_log_config
@@ -45,6 +51,65 @@ except Exception as e:  # noqa E841
     )
 
 
+class RateLimitFilter(Filter):
+    """Filter limiting the number of records per call site (file and line) and time interval
+
+    Only records up to INFO level are limited, warnings and errors always pass. Records suppressed within an interval
+    are counted and the count is set as attribute 'suppressed' of the first record of the same call site passing in a
+    later interval. The record itself is left unchanged for other handlers, SuppressedCountFormatter appends the count
+    to the message.
+
+    Args:
+        interval: length of the time interval in seconds
+        burst: maximum number of records per call site passed within one interval
+    """
+
+    def __init__(self, interval=10, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._sites = {}  # (pathname, lineno) -> [interval start, count passed, count suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > INFO:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.setdefault(key, [now, 0, 0])
+            if now - site[0] >= self.interval:
+                suppressed = site[2]
+                site[:] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if site[1] >= self.burst:
+                site[2] += 1
+                return False
+            site[1] += 1
+        return True
+
+
+class SuppressedCountFormatter(Formatter):
+    """Formatter appending the count of records suppressed by RateLimitFilter to the message of a copy of the record
+
+    Args:
+        formatter: formatter used for the actual formatting
+    """
+
+    def __init__(self, formatter):
+        super().__init__()
+        self.formatter = formatter
+
+    def format(self, record):
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            record = copy.copy(record)
+            record.msg = f'{record.getMessage()} [{suppressed} similar messages suppressed]'
+            record.args = None
+        return self.formatter.format(record)
+
+
 # general settings
 logger = get_logger(conf['logger_name'])
 logger.setLevel(DEBUG)  # set to the lowest possible level, using handler-specific levels for output
@@ -55,7 +120,7 @@ console_handler = StreamHandler(stdout)
 console_formatter = formatter
 console_handler.setFormatter(console_formatter)
 console_handler.setLevel(conf['loglevel_stdout'])
-logger.addHandler(console_handler)
+handlers = [console_handler]
 
 
 # logging to file
@@ -68,4 +133,31 @@ if conf['write_logfile']:
     file_handler_formatter = formatter
     file_handler.setFormatter(file_handler_formatter)
     file_handler.setLevel(conf['loglevel_file'])
-    logger.addHandler(file_handler)
+    handlers.append(file_handler)
+
+
+# repeated progress messages are only limited on the console, the log file keeps all records
+if conf.get('log_rate_limit_interval'):
+    console_handler.addFilter(RateLimitFilter(conf['log_rate_limit_interval'], conf.get('log_rate_limit_burst', 5)))
+    console_handler.setFormatter(SuppressedCountFormatter(console_formatter))
+
+
+# attach handlers, either directly or through a queue emptied by a background thread (log_queue: True)
+if conf.get('log_queue', True):
+    queue_handler = QueueHandler(SimpleQueue())
+    log_listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    logger.addHandler(queue_handler)
+
+    def _log_directly():
+        """forked processes (e.g. retrieval workers) do not inherit the listener thread and may end with os._exit
+        without running atexit, hence they write their records directly to the handlers instead of queueing them"""
+        logger.removeHandler(queue_handler)
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    os.register_at_fork(after_in_child=_log_directly)
+else:
+    for handler in handlers:
+        logger.addHandler(handler)
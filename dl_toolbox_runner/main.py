@@ -1,19 +1,35 @@
 import glob
 import os
 import re
+import shutil
 import time
 import datetime
-from random import randint
+import json
+from contextlib import nullcontext
 
 import pandas as pd
 
 from hpl2netCDF_client.hpl2netCDF_client import hpl2netCDFClient
 
+from dl_toolbox_runner.aggregate import get_daily_aggregator
+from dl_toolbox_runner.archive import get_archiver
 from dl_toolbox_runner.configure import Configurator
-from dl_toolbox_runner.errors import DLConfigError
+from dl_toolbox_runner.errors import DLConfigError, ToolboxRunError
 from dl_toolbox_runner.log import logger
-from dl_toolbox_runner.utils.config_utils import get_main_config
-from dl_toolbox_runner.utils.file_utils import abs_file_path, find_file_time_windcube, get_insttype, get_instrument_id_and_scan_type, create_batch, round_datetime, read_halo
+from dl_toolbox_runner.notify import get_notifier
+from dl_toolbox_runner.utils.batch_planner import coalesce_windows, files_to_table, plan_batches
+from dl_toolbox_runner.utils.compression import get_decompression_cache, is_compressed, open_raw
+from dl_toolbox_runner.utils.config_utils import check_windows, get_main_config
+from dl_toolbox_runner.utils.failure_ledger import batch_fingerprint, batch_key, file_fingerprint, get_failure_ledger
+from dl_toolbox_runner.utils.file_metadata import get_file_metadata_cache
+from dl_toolbox_runner.utils.file_utils import abs_file_path, find_file_time_halo, find_file_time_windcube, get_insttype, get_instrument_id_and_scan_type, round_datetime, read_halo
+from dl_toolbox_runner.utils.halo_cache import get_halo_cache
+from dl_toolbox_runner.utils.input_backend import get_input_backend
+from dl_toolbox_runner.utils.layout import partition_dir
+from dl_toolbox_runner.utils.pipeline import StagedExecutor
+from dl_toolbox_runner.utils.profiling import get_profiler
+from dl_toolbox_runner.utils.resources import run_with_limits
+from dl_toolbox_runner.utils.system_data import get_system_data_store
     
 class Runner(object):
     """Runner to execute (multiple) run(s) of DL-toolbox with config associated to data files
@@ -30,20 +46,36 @@ class Runner(object):
         else:
             logger.error("The argument 'conf' must be a conf dictionary or a path pointing to a config file")
             raise DLConfigError("The argument 'conf' must be a conf dictionary or a path pointing to a config file")
+        check_windows(self.conf)  # also for dictionaries not read by get_main_config
 
         self.retrieval_batches = []  # list of dicts with keys 'date', 'files' and 'conf' #EDIT: added 'instrument_id' and 'scan_type'
         self.single_process = single_process  # if True, create one batch per file, if False, group files with same instrument_id and scan_type
+        self.backend = get_input_backend(self.conf)  # local file system or object store, depending on input_dir
+        self.decompressed = get_decompression_cache(self.conf)  # decompressed copies of compressed raw files
+        self.system_data = get_system_data_store(self.conf)  # ingested system/environmental data, None if not configured
+        self.aggregator = get_daily_aggregator(self.conf)  # daily files from window outputs, None if not configured
+        self.notifier = get_notifier(self.conf)  # completion events for downstream consumers, None if not configured
+        self.halo_cache = get_halo_cache(self.conf)  # decoded HALO files, None if not configured
+        self.file_metadata = get_file_metadata_cache(self.conf)  # file times of previous runs, None if not configured
+        self.failures = get_failure_ledger(self.conf)  # failed files and batches skipped until retry, None if not configured
+        self.archiver = get_archiver(self.conf)  # archive of consumed input files, None if not configured
+        self.profiler = get_profiler(self.conf)  # profiles of sampled stages, None if not configured
         # TODO harmonise file naming with mwr_l12l2 retrieval_batches is called retrieval_dict there
     
     def run(self, dry_run=False, instrument_id=None, date_end=None):
+        if self.conf.get('pipeline'):
+            self.run_pipelined(dry_run=dry_run, instrument_id=instrument_id, date_end=date_end)
+            return
         start = time.time()
         logger.info('######################################################')
         logger.info('Starting retrieval process at '+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))        
         logger.info('######################################################')
         logger.info('Searching for files to process')
         self.find_files(instrument_id=instrument_id)
+        self.ingest_system_data()
         logger.info('Grouping files to batches')
         self.batch_files(single_process=self.single_process, date_end=date_end)
+        self.retrieval_batches = self.skip_failed_batches(self.retrieval_batches)
         logger.info('Assigning config files to batches')
         self.assign_conf()
         logger.info(f'Time taken to write the config files: {time.time()-start:.1f} seconds')
@@ -60,8 +92,8 @@ class Runner(object):
         logger.info('Starting retrieval process at '+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))        
         logger.info('######################################################')
         logger.info('From batch files created by watchdog:')
-        print(retrieval_batches)
-        self.retrieval_batches = retrieval_batches
+        logger.debug(retrieval_batches)
+        self.retrieval_batches = self.skip_failed_batches(retrieval_batches)
         #self.batch_files(single_process=self.single_process, date_end=date_end)
         logger.info('Assigning config files to batches')
         self.assign_conf()
@@ -77,15 +109,33 @@ class Runner(object):
         """find files and group them to batches for processing"""
         if instrument_id:
             logger.info(f'Searching files for instrument {instrument_id}')
-            self.files = glob.glob(os.path.join(self.conf['input_dir'], self.conf['input_file_prefix'] + f'{instrument_id}*'))
+            self.files = self.backend.list_files(self.conf['input_dir'], self.conf['input_file_prefix'] + f'{instrument_id}*')
         else:
             logger.info('Searching all files in input directory')
-            self.files = glob.glob(os.path.join(self.conf['input_dir'], self.conf['input_file_prefix'] + '*'))
+            self.files = self.backend.list_files(self.conf['input_dir'], self.conf['input_file_prefix'] + '*')
 
         if not self.files:
             logger.info(f'Found no files to process in {self.conf["input_dir"]}. Will exit now')
             exit()
         
+    def ingest_system_data(self):
+        """add the rows appended to the system data files in self.files since the last run to the system data store"""
+        if self.system_data is None:
+            return
+        n_rows = 0
+        for file in self.files:
+            if get_insttype(file, base_filename='DWL_raw_XXXWL_', return_date=False) != 'system_data':
+                continue
+            try:
+                local_file = self.backend.local_path(file)  # a new copy with each change if staged or on S3
+                rows = self.system_data.ingest(local_file, save_state=False, source=None if local_file == file else file)
+            except Exception as e:
+                logger.error(f'Could not ingest system data file {file}: {e}')
+                continue
+            n_rows += 0 if rows is None else len(rows)
+        self.system_data.save_state()
+        logger.info(f'Ingested {n_rows} new rows of system data')
+
     def batch_files(self, single_process=True, date_end=None):
         '''
         group files to batches for processing
@@ -94,124 +144,495 @@ class Runner(object):
         
         single_process: bool: if True, create one batch per file, if False, group files with same instrument_id and scan_type
         '''
-        if self.conf['max_age']: #TODO: here we should have a case for when max_age is None
+        date_start, date_end = self.retrieval_period(date_end)
+        
+        file_dicts = []
+        for file in self.files:
+            # All information for a given file are stored in a dictionary. The grouping to batches is done afterwards
+            # for all files at once on a table built from these dictionaries
+            file_dict = self.get_file_dict(file, date_start, date_end)
+            if file_dict is not None:
+                file_dicts.append(file_dict)
+
+        # group files with same instrument_id, scan_type and scan_id (or one batch per file if single_process)
+        self.retrieval_batches.extend(plan_batches(files_to_table(file_dicts), single_process=single_process,
+                                                   retrieval_start_time=date_start, retrieval_end_time=date_end))
+        if self.file_metadata is not None:
+            self.file_metadata.save()
+
+        if self.retrieval_batches:
+            logger.info(f'Found {len(self.retrieval_batches)} batches of files to process')
+        else:
+            logger.critical(f'Found no files to process in {self.conf["input_dir"]}. Will exit now')
+            exit()
+
+    def retrieval_period(self, date_end=None):
+        """get start and end of the period of files to process from retrieval_window_min or max_age of the main config"""
+        max_age = self.conf.get('retrieval_window_min') or self.conf['max_age']
+        if max_age: #TODO: here we should have a case for when max_age is None
             if date_end:
-                date_start = date_end - datetime.timedelta(minutes=self.conf['max_age'])
+                date_start = date_end - datetime.timedelta(minutes=max_age)
                 # check if file date is between date_end - max_age and date_end
                 logger.info(f'Finding files between {date_start} and {date_end}')
-            elif self.conf['max_age']:
+            else:
                 # check if file date is within now and max_age
-                date_start = datetime.datetime.now() - datetime.timedelta(minutes=self.conf['max_age'])
+                date_start = datetime.datetime.now() - datetime.timedelta(minutes=max_age)
                 date_end = datetime.datetime.now()
                 logger.info(f'Keeping files between {date_start} and {date_end}')
         else:
             date_start = None
             logger.error('No max_age defined in the config file, processing all')
-            pass
-        
-        for file in self.files:
-            # All information for a given file are stored in a dictionary and some of these information are used to create or update a batch of files
-            file_dict = {}
-            file_dict['file'] = file
-            inst_type = get_insttype(file, base_filename='DWL_raw_XXXWL_', return_date=False)
-            
-            if inst_type == 'system_data':
-                logger.info(f'File {file} is system data and will be skipped')
-                continue
-            
-            # find instrument_id and scan_type for each file
-            instrument_id, scan_type, scan_id, scan_resolution, file_datetime = get_instrument_id_and_scan_type(file, inst_type, prefix=self.conf['input_file_prefix'])
-            print('Configuration of the file is instrument_id:', instrument_id, '/ scan type', scan_type, '/ scan_id:', scan_id, '/ scan_resolution:', scan_resolution, '/ file_datetime:', file_datetime)
-            
-            if (date_start is not None) and (date_end is not None):
-                if file_datetime < date_start or file_datetime > date_end:
-                    continue
-                else:
-                    if inst_type == 'windcube':
-                        #We need to open the files and check the full time_bounds                   
-                        file_start_time, file_end_time = find_file_time_windcube(file)
-                        # if file_start_time < date_start or file_end_time > date_end:
-                        #     continue
-                        # else:
-                        #     pass
-                    else:
-                        mheader, time_ds = read_halo(file)
-                        file_start_time, file_end_time = pd.to_datetime(time_ds.values[0]), pd.to_datetime(time_ds.values[-1])
-                        pass
+        return date_start, date_end
+
+    def file_scan(self, file, date_start=None, date_end=None):
+        """get (inst_type, instrument_id, scan_type, scan_id, scan_resolution) of file from its name only
+
+        Returns None for system data and for files with a file name date outside date_start and date_end
+        """
+        inst_type = get_insttype(file, base_filename='DWL_raw_XXXWL_', return_date=False)
+
+        if inst_type == 'system_data':
+            logger.info(f'File {file} is system data and will be skipped')
+            return None
+
+        # find instrument_id and scan_type for each file
+        instrument_id, scan_type, scan_id, scan_resolution, file_datetime = get_instrument_id_and_scan_type(file, inst_type, prefix=self.conf['input_file_prefix'])
+        logger.debug(f'Configuration of the file is instrument_id: {instrument_id} / scan type {scan_type} / scan_id: {scan_id} / scan_resolution: {scan_resolution} / file_datetime: {file_datetime}')
+
+        if (date_start is not None) and (date_end is not None):
+            if file_datetime < date_start or file_datetime > date_end:
+                return None
+        return inst_type, instrument_id, scan_type, scan_id, scan_resolution
+
+    def get_file_dict(self, file, date_start=None, date_end=None):
+        """get the file dictionary of file as used for planning batches, or None if file is not to be processed
+
+        Files which failed to be read before are skipped until they change or their backoff expires (see FailureLedger)
+        """
+        fingerprint = file_fingerprint(file) if self.failures is not None else None
+        if self.failures is not None and self.failures.skip(file, fingerprint):
+            logger.debug(f'Skipping {file} which failed before')
+            return None
+        try:
+            scan = self.file_scan(file, date_start, date_end)
+            if scan is None:
+                return None
+            inst_type, instrument_id, scan_type, scan_id, scan_resolution = scan
+
+            file_start_time, file_end_time = self.file_times(file, inst_type)
+        except Exception as e:
+            logger.error(f'Could not read {file}: {e}')
+            self.record_failed_file(file, e, fingerprint)
+            return None
+        if file_start_time is None:
+            self.record_failed_file(file, 'could not read file times', fingerprint)
+            return None
+        if self.failures is not None:
+            self.failures.record_success(file)
+
+        # Build the file dictionary (length and mid time are computed for all files at once in files_to_table)
+        return {'file': file,
+                'instrument_id': instrument_id,
+                'scan_type': scan_type,
+                'scan_id': scan_id,
+                'scan_resolution': scan_resolution,
+                'file_start_time': file_start_time,
+                'file_end_time': file_end_time}
+
+    def record_failed_file(self, file, error, fingerprint=None):
+        """record a file which could not be read in the failure ledger, if configured"""
+        if self.failures is None:
+            return
+        attempts = self.failures.record_failure(file, error, fingerprint)
+        if attempts == self.failures.quarantine_attempts:
+            logger.warning(f'{file} failed {attempts} times and is quarantined, see --failure_report')
+
+    def skip_failed_batches(self, batches):
+        """batches without recent failures of identical input (see FailureLedger). Call before configuring batches"""
+        if self.failures is None:
+            return batches
+        for batch in batches:  # before files are replaced by local copies in configure_batch
+            batch['fingerprint'] = batch_fingerprint(batch)
+        kept = [batch for batch in batches if not self.failures.skip(batch_key(batch), batch['fingerprint'])]
+        if len(kept) < len(batches):
+            logger.info(f'Skipping {len(batches) - len(kept)} batches which failed before with the same files')
+        return kept
+
+    def record_batches(self, batches, error=None):
+        """record the outcome of a toolbox run for batches in the failure ledger, if configured"""
+        if self.failures is None:
+            return
+        for batch in batches:
+            if error is None:
+                self.failures.record_success(batch_key(batch))
             else:
-                pass
-            
-            # Build the file dictionary
-            file_dict['instrument_id'] = instrument_id
-            file_dict['scan_type'] = scan_type
-            file_dict['scan_id'] = scan_id
-            file_dict['scan_resolution'] = scan_resolution
-            file_dict['file_start_time'] = file_start_time
-            file_dict['file_end_time'] = file_end_time
-            file_dict['file_length'] = (file_end_time - file_start_time).total_seconds()
-            file_dict['file_mid_time'] = file_start_time + datetime.timedelta(seconds=file_dict['file_length']/2)
-            
-            if single_process:
-                self.retrieval_batches.append(create_batch(file_dict, date_start, date_end))
-            else: 
-                # As a first test, we can implement this based on the filename only
-                # check if instrument_id and scan_type already exist in one of the batch
-                if any((d['instrument_id'] == file_dict['instrument_id']) & (d['scan_type'] == file_dict['scan_type']) & (d['scan_id'] == file_dict['scan_id']) for d in self.retrieval_batches): 
-                    # if so, add the file to the list of files from the correct batch
-                    for batch in self.retrieval_batches:
-                        if (batch['instrument_id'] == file_dict['instrument_id']) & (batch['scan_type'] == file_dict['scan_type']) & (batch['scan_id'] == file_dict['scan_id']):
-                            # if both instrument_id and scan_type match, add the file to the batch
-                            batch['files'].append(file)
-                            # in addition, we need to update a few other parameters
-                            batch['batch_start_time'] = min(batch['batch_start_time'], file_start_time)
-                            batch['batch_end_time'] = max(batch['batch_end_time'], file_end_time)
-                            batch['batch_length_sec'] = batch['batch_length_sec'] + (file_end_time - file_start_time).total_seconds()
-                else:
-                    # otherwise, create a new batch
-                    self.retrieval_batches.append(create_batch(file_dict, date_start, date_end))
+                self.failures.record_failure(batch_key(batch), error, batch.get('fingerprint'))
 
-        if self.retrieval_batches:
-            logger.info(f'Found {len(self.retrieval_batches)} batches of files to process')
+    def file_times(self, file, inst_type):
+        """get start and end time of the data in file, from the file metadata cache if configured and file is unchanged"""
+        if self.file_metadata is None:
+            with self.profiled('read', os.path.basename(file)):
+                return self.read_file_times(file, inst_type)
+        times = self.file_metadata.get(file)
+        if times is None:
+            with self.profiled('read', os.path.basename(file)):
+                times = self.read_file_times(file, inst_type)
+            if times[0] is not None:
+                self.file_metadata.put(file, *times)
+        return times
+
+    def read_file_times(self, file, inst_type):
+        """read start and end time of the data in file, reading as little of the file as possible"""
+        if inst_type == 'windcube':
+            if is_compressed(file):
+                # NetCDF can't be read from a stream. Decompress once, the copy is reused for config and toolbox
+                return find_file_time_windcube(self.local_file(file))
+            if self.backend.is_remote:
+                # only read the parts of the remote file holding the time information
+                with self.backend.open(file) as fileobj:
+                    return find_file_time_windcube(fileobj)
+            #We need to open the files and check the full time_bounds
+            return find_file_time_windcube(self.backend.local_path(file))  # staged copy on network file systems
         else:
-            logger.critical(f'Found no files to process in {self.conf["input_dir"]}. Will exit now')
-            exit()
+            if self.backend.is_remote:
+                with self.backend.open(file) as fileobj:
+                    return find_file_time_halo(open_raw(file, fileobj=fileobj))
+            if is_compressed(file):
+                return find_file_time_halo(self.backend.local_path(file))  # streaming decompression of header and rays
+            mheader, time_ds = read_halo(self.backend.local_path(file), cache=self.halo_cache)
+            return pd.to_datetime(time_ds.values[0]), pd.to_datetime(time_ds.values[-1])
+
+    def local_file(self, file):
+        """get a local, uncompressed copy of file for readers and the DL toolbox. Plain local files are used as they are"""
+        return self.decompressed.path(self.backend.local_path(file))
+
+    def release_inputs(self, batches):
+        '''
+        Release the local copies of input files (see StagingBackend) of batches done, unless needed by later windows
+
+        A file is still needed if its data reaches beyond the start of the next window, i.e. retrieval_stride_min (or
+        the window length) after the start of the window of the batch. Copies of growing files made for the batch
+        (see RealTimeWatcher.snapshot_tailed_files) are removed.
+        '''
+        for batch in batches:
+            for snapshot in batch.get('snapshots', []):
+                shutil.rmtree(os.path.dirname(snapshot), ignore_errors=True)
+            start, end = batch['retrieval_start_time'], batch['retrieval_end_time']
+            stride = None
+            if start is not None and end is not None:
+                stride = datetime.timedelta(minutes=self.conf['retrieval_stride_min']) if self.conf.get('retrieval_stride_min') else end - start
+            files = batch.get('source_files', batch['files'])
+            for file, file_end in zip(files, batch.get('file_end_times') or [None] * len(files)):
+                if stride is None or file_end is None or file_end <= start + stride:
+                    self.backend.release(file)
 
     def assign_conf(self):
         """assign a config file for the DL-toolbox run and a date to each bunch of files in self.retrieval_batches"""
 
         for ind, batch in enumerate(self.retrieval_batches):
-            # create a config file for the DL-toolbox run of this batch
             logger.info(f'Creating config file for batch {ind+1} containing {len(batch["files"])} files')
-            conf_num = randint(0,99)
-            filename_conf = self.conf['toolbox_conf_prefix'] + f'{conf_num:03d}' + self.conf['toolbox_conf_ext']
-            batch['conf'] = os.path.join(self.conf['toolbox_confdir'], filename_conf)
-            tmp_conf = Configurator(batch['instrument_id'], batch['scan_type'], batch['files'][0], batch['conf'], self.conf)  # use first file in batch as reference
+            self.configure_batch(batch)
+
+    def configure_batch(self, batch):
+        """write the config file for the DL-toolbox run of batch and assign 'conf' and 'date' to it"""
+        # remote and compressed files are fetched/decompressed once to a local cache, from where they are read for
+        # config and toolbox
+        batch.setdefault('source_files', list(batch['files']))  # for releasing staged copies, see release_inputs
+        batch['files'] = [self.local_file(file) for file in batch['files']]
+        # create a config file for the DL-toolbox run of this batch. Names are unique per scan and window, such that
+        # batches in flight, which may be configured concurrently (see run_pipelined) or by other processes, never share
+        # one. Configs and outputs are partitioned by instrument and date of the window (see partition_dir)
+        window_time = batch_window_time(batch)
+        filename_conf = self.conf['toolbox_conf_prefix'] + batch_id(batch) + self.conf['toolbox_conf_ext']
+        conf_dir = partition_dir(self.conf['toolbox_confdir'], self.conf.get('toolbox_conf_partition'),
+                                 batch['instrument_id'], window_time, create=True)
+        batch['conf'] = os.path.join(conf_dir, filename_conf)
+        tmp_conf = Configurator(batch['instrument_id'], batch['scan_type'], batch['files'][0], batch['conf'], self.conf,
+                                output_date=window_time)  # use first file in batch as reference
+        with self.profiled('configure', batch_id(batch)):
             tmp_conf.run()
-            batch['date'] = tmp_conf.date.replace(hour=0, minute=0, second=0, microsecond=0)  # floor to the day
+        batch['date'] = tmp_conf.date.replace(hour=0, minute=0, second=0, microsecond=0)  # floor to the day
+
+    def run_pipelined(self, dry_run=False, instrument_id=None, date_end=None):
+        '''
+        Process files with the scan, configure and retrieve stages running concurrently (see StagedExecutor)
+
+        Files are grouped by scan using their names only. Each group is then read for its time information and planned
+        to batches, and each batch is configured and handed to the DL toolbox as soon as it is ready, instead of
+        waiting for all files to be read and all config files to be written as in run(). Number of workers per stage
+        and queue size are set in 'pipeline' of the main config. Windows are not coalesced in this mode, each batch is
+        retrieved by its own toolbox invocation as soon as it is configured, i.e. coalesce_windows is ignored.
+        '''
+        start = time.time()
+        pipe_conf = self.conf.get('pipeline') or {}
+        logger.info('######################################################')
+        logger.info('Starting pipelined retrieval process at '+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        logger.info('######################################################')
+        self.find_files(instrument_id=instrument_id)
+        self.ingest_system_data()
+        date_start, date_end = self.retrieval_period(date_end)
+
+        groups = {}  # files per scan, in order of appearance
+        for file in self.files:
+            scan = self.file_scan(file, date_start, date_end)
+            if scan is not None:
+                groups.setdefault(scan[1:4], []).append(file)
+        logger.info(f'Found {len(groups)} scans to process')
+
+        def scan(files):
+            file_dicts = [self.get_file_dict(file) for file in files]  # already filtered by date in file_scan
+            return self.skip_failed_batches(plan_batches(files_to_table([fd for fd in file_dicts if fd is not None]),
+                                                         single_process=self.single_process,
+                                                         retrieval_start_time=date_start, retrieval_end_time=date_end))
+
+        def configure(batch):
+            self.configure_batch(batch)
+            return [batch]
+
+        def retrieve(batch):
+            if not dry_run:
+                tl_time = time.time()
+                try:
+                    self.run_toolbox_limited([batch], start_method='forkserver')  # never fork the threads of the stages
+                except Exception as e:
+                    self.record_batches([batch], e)
+                    raise
+                finally:
+                    self.release_inputs([batch])
+                logger.info(f'Time taken for batch {batch["conf"]}: {time.time()-tl_time :.1f} seconds')
+                self.aggregate([batch], since=tl_time)
+                self.publish([batch], since=tl_time)
+                self.record_batches([batch])
+                self.archive_inputs([batch])
+            return [batch]
+
+        def on_error(stage, item, err):
+            logger.error(f'Error in stage {stage}: {err}')
+            logger.error('Will continue with next batch')
+
+        executor = StagedExecutor([('scan', scan, pipe_conf.get('scan_workers', 4)),
+                                   ('configure', configure, pipe_conf.get('configure_workers', 2)),
+                                   ('retrieve', retrieve, pipe_conf.get('retrieve_workers', 1))],
+                                  queue_size=pipe_conf.get('queue_size', 8), on_error=on_error)
+        self.retrieval_batches = executor.run(groups.values())
+        if self.file_metadata is not None:
+            self.file_metadata.save()
+        if self.aggregator is not None:
+            self.aggregator.close()
+        if self.archiver is not None and not dry_run:
+            self.archiver.archive_due()
+        logger.info(f'Processed {len(self.retrieval_batches)} batches in {time.time()-start:.1f} seconds')
 
     def run_toolbox(self, parallel=False):
-        """run the DL toolbox code on all entries of self.retrieval_batches"""
+        """run the DL toolbox code on all entries of self.retrieval_batches
+
+        With coalesce_windows > 1 in the main config, up to this number of batches of consecutive windows with identical
+        toolbox configuration are run with one single toolbox invocation (see coalesce_windows in batch_planner). If such
+        a run fails, the windows retrieved before the failure still count as retrieved (see retrieve_group)
+        """
         if parallel:  # run multiple DL toolboxes in parallel
             raise NotImplementedError('parallel runs of DL_toolbox are not yet implemented')
         else:  # execute multiple runs of DL toolbox in sequence
-            for batch in self.retrieval_batches:
+            groups = coalesce_windows(self.retrieval_batches, self.conf.get('coalesce_windows') or 1,
+                                      conf_key=toolbox_conf_content, stride_min=self.conf.get('retrieval_stride_min'))
+            for group in groups:
                 try:
                     logger.info('######################################################')
-                    logger.info(f'Running DL-toolbox with {len(batch["files"])} files on {batch["date"]}')
+                    logger.info(f'Running DL-toolbox with {sum(len(batch["files"]) for batch in group)} files '
+                                f'in {len(group)} window(s) on {group[0]["date"]}')
                     tl_time = time.time()
-                    self.run_toolbox_single(batch, cmd_opt_args=('DWL_raw_XXXWL_', False, batch['retrieval_end_time'], False))
+                    retrieved = self.retrieve_group(group)
                     logger.info(f'Time taken for this batch: {time.time()-tl_time :.1f} seconds')
+                    self.aggregate(retrieved, since=tl_time)
+                    self.publish(retrieved, since=tl_time)
+                    self.record_batches(retrieved)
+                    self.archive_inputs(retrieved)
                 except Exception as e:
-                    logger.error(f'Error in batch {batch["conf"]}: {e}')
+                    self.record_batches(group, e)
+                    logger.error(f'Error in batch {group[0]["conf"]}: {e}')
                     logger.error('Will continue with next batch')
+                self.release_inputs(group)
+            if self.aggregator is not None:
+                self.aggregator.close()  # wait for the last windows to be appended
+            if self.archiver is not None:
+                self.archiver.archive_due()
                     
+    def retrieve_group(self, group):
+        """run the DL toolbox on a group of batches (see run_toolbox_limited) and return the batches retrieved
+
+        The windows of a group are retrieved one after the other. If the run fails after writing the outputs of its first
+        windows, these are returned and only the remaining windows are recorded as failed. Raises if no window was retrieved
+        """
+        start = time.time()
+        try:
+            self.run_toolbox_limited(group)
+        except Exception as e:
+            retrieved = self.completed_windows(group, since=start)
+            if not retrieved:
+                raise
+            self.record_batches(group[len(retrieved):], e)
+            logger.error(f'Error in batch {group[0]["conf"]} after retrieving {len(retrieved)} of {len(group)} windows: {e}')
+            return retrieved
+        return group
+
+    def completed_windows(self, group, since):
+        """the leading batches of a group (in run order) with outputs of their window written from time since on"""
+        if len(group) < 2:  # outputs of a single window are not matched by name, the failed run counts
+            return []
+        # same instrument and date for the whole group, allowing for file system timestamps lagging behind time.time()
+        outputs = self.find_outputs(group[0], since=since - 1)
+        completed = []
+        for batch in group:
+            if not self.window_outputs(batch, outputs):
+                break
+            completed.append(batch)
+        return completed
+
+    def run_toolbox_limited(self, batches, cmd='lvl2_from_filelist', start_method='fork'):
+        """do one run of DL toolbox on a group of batches within the time and memory budget set in the main config
+
+        Without any of toolbox_timeout_sec, toolbox_max_rss_mb or toolbox_max_address_space_mb in the config, the toolbox
+        runs in the current process. Otherwise it runs in a child process which is killed if exceeding its budget. The
+        timeout applies per batch. Failed runs are recorded (see record_failed_batch) and raise a ToolboxRunError with
+        the exception and traceback of the toolbox, if any. The child is started with start_method (see run_with_limits),
+        which must not be 'fork' if other threads are running, as in run_pipelined.
+        """
+        limits = {'timeout': self.conf.get('toolbox_timeout_sec'),
+                  'max_rss_mb': self.conf.get('toolbox_max_rss_mb'),
+                  'max_address_space_mb': self.conf.get('toolbox_max_address_space_mb')}
+        if not any(limits.values()):
+            self.run_toolbox_profiled(batches, cmd)
+            return
+
+        if limits['timeout']:
+            limits['timeout'] *= len(batches)
+        if start_method == 'fork':
+            status, duration, error = run_with_limits(self.run_toolbox_profiled, (batches, cmd), **limits)
+        else:  # child starts from a fresh interpreter, needs picklable target and arguments
+            status, duration, error = run_with_limits(run_toolbox_process, (batches, cmd, self.conf),
+                                                      start_method=start_method, **limits)
+        if status != 'ok':
+            for batch in batches:
+                self.record_failed_batch(batch, status, duration, error)
+            message = f"DL toolbox run ended with status '{status}' after {duration:.1f} seconds"
+            raise ToolboxRunError(message + (f': {error}' if error else ''))
+
+    def run_toolbox_profiled(self, batches, cmd='lvl2_from_filelist'):
+        """run_toolbox_group, profiled if the toolbox stage is sampled (see profiling). Runs in the toolbox process"""
+        with self.profiled('toolbox', batch_id(batches[0])):
+            self.run_toolbox_group(batches, cmd)
+
+    def profiled(self, stage, name):
+        """context profiling stage for the batch or file name if configured (see Profiler.profile), else doing nothing"""
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.profile(stage, name)
+
+    def find_outputs(self, batch, since=None):
+        """list the L2 window files written to output_dir for the instrument of batch, optionally only from time since on"""
+        output_dir = partition_dir(self.conf['output_dir'], self.conf.get('output_partition'), batch['instrument_id'],
+                                   batch_window_time(batch))
+        pattern = os.path.join(output_dir, f"{self.conf['output_file_prefix']}{batch['instrument_id']}_*.nc")
+        return sorted(file for file in glob.glob(pattern) if since is None or os.path.getmtime(file) >= since)
+
+    def window_outputs(self, batch, outputs=None):
+        """the L2 files of the retrieval window of batch among outputs (default all outputs of its instrument and date)"""
+        stamp = pd.Timestamp(batch['retrieval_end_time']).strftime('%Y%m%d%H%M')
+        return [file for file in (self.find_outputs(batch) if outputs is None else outputs) if stamp in os.path.basename(file)]
+
+    def aggregate(self, batches, since):
+        """hand the outputs written for batches from time since on to the daily aggregator, if configured"""
+        if self.aggregator is None:
+            return
+        outputs = set()
+        for batch in batches:
+            outputs.update(self.find_outputs(batch, since=since))
+        self.aggregator.submit(sorted(outputs))
+
+    def publish(self, batches, since):
+        """publish a completion event per batch with the outputs written from time since on, if configured (see notify)"""
+        if self.notifier is None:
+            return
+        finished = time.time()
+        for batch in batches:
+            outputs = self.find_outputs(batch, since=since)
+            if len(batches) > 1:  # windows of a group are written by the same run, match outputs by window end
+                outputs = self.window_outputs(batch, outputs) or outputs
+            self.notifier.publish({
+                'event': 'retrieval_done',
+                'instrument_id': batch['instrument_id'],
+                'scan_type': batch['scan_type'],
+                'scan_id': batch['scan_id'],
+                'window_start': batch['retrieval_start_time'],
+                'window_end': batch['retrieval_end_time'],
+                'outputs': outputs,
+                'n_files': len(batch['files']),
+                'started': datetime.datetime.fromtimestamp(since),
+                'finished': datetime.datetime.fromtimestamp(finished),
+                'duration_sec': round(finished - since, 1),
+            })
+
+    def archive_inputs(self, batches):
+        """mark the input files of successfully retrieved batches for archival, if configured (see archive)"""
+        if self.archiver is None:
+            return
+        try:
+            self.archiver.record(batches)
+        except Exception as e:  # archival must never fail a retrieval
+            logger.error(f'Could not record input files for archival: {e}')
+
+    def record_failed_batch(self, batch, reason, duration, error=None):
+        """append batch metadata of a failed toolbox run as json line to toolbox_failure_log of the main config
+
+        error is the text of the exception raised by the toolbox with its traceback, if any (see run_with_limits)
+        """
+        logger.error(f"DL toolbox run for {batch['instrument_id']} {batch['scan_type']} "
+                     f"({batch['retrieval_start_time']} - {batch['retrieval_end_time']}) failed: {reason}"
+                     + (f'\n{error}' if error else ''))
+        if not self.conf.get('toolbox_failure_log'):
+            return
+        record = {'time': datetime.datetime.now(), 'reason': reason, 'error': error, 'duration_sec': round(duration, 1)}
+        record.update({key: batch.get(key) for key in ['instrument_id', 'scan_type', 'scan_id', 'retrieval_start_time',
+                                                       'retrieval_end_time', 'batch_length_sec', 'conf', 'files']})
+        with open(self.conf['toolbox_failure_log'], 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
     @staticmethod
-    def run_toolbox_single(batch, cmd='lvl2_from_filelist', cmd_opt_args=('DWL_raw_XXXWL_', False, None, False)):
-        """do one run of DL toolbox on a single batch of files"""
-        
-        proc_dl = hpl2netCDFClient(batch['conf'], cmd, batch['date'])
+    def run_toolbox_group(batches, cmd='lvl2_from_filelist'):
+        """do one run of DL toolbox on a group of batches sharing the same config, e.g. from coalesce_windows
+
+        The toolbox client is set up once for the group, each batch still gets its own call and output file. The toolbox
+        only takes a list of files and reads them itself, hence files shared by several windows are passed whole to each
+        call and decoded again by it, selecting the data of the window ending at retrieval_end_time
+        """
+        proc_dl = hpl2netCDFClient(batches[0]['conf'], cmd, batches[0]['date'])
         cmd_func = getattr(proc_dl, cmd)
-        cmd_func(batch['files'], *cmd_opt_args)
+        for batch in batches:
+            cmd_func(batch['files'], 'DWL_raw_XXXWL_', False, batch['retrieval_end_time'], False)
+
+
+def batch_window_time(batch):
+    """start of the retrieval window of batch, or of its data if processing without window"""
+    return batch['retrieval_start_time'] if batch.get('retrieval_start_time') is not None else batch['batch_start_time']
+
+
+def batch_id(batch):
+    """identifier of batch from its scan and window start, e.g. for naming its toolbox config and profile files"""
+    return (f"{batch['instrument_id']}_{batch['scan_type']}_{batch['scan_id']}_"
+            + pd.Timestamp(batch_window_time(batch)).strftime('%Y%m%d%H%M'))
+
+
+def run_toolbox_process(batches, cmd, conf):
+    """Runner.run_toolbox_profiled for toolbox child processes not started by fork, profiling as configured in conf"""
+    profiler = get_profiler(conf)
+    with nullcontext() if profiler is None else profiler.profile('toolbox', batch_id(batches[0])):
+        Runner.run_toolbox_group(batches, cmd)
+
+
+def toolbox_conf_content(batch):
+    """content of the DL toolbox config file of batch, for comparing configs of different batches"""
+    with open(batch['conf'], 'rb') as f:
+        return f.read()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+import errno
+import json
+import os
+import socket
+
+from dl_toolbox_runner.errors import DLConfigError
+from dl_toolbox_runner.log import logger
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+
+
+class FileSink(object):
+    """Append events as json lines to a file, which consumers can follow (e.g. tail -f) instead of listing output_dir"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, message):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, message)  # one write per event, such that lines of concurrent processes do not interleave
+        finally:
+            os.close(fd)
+
+
+class UnixSocketSink(object):
+    """Send events as datagrams to a Unix socket bound by the consumer. Events are dropped if nobody listens"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, message):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            try:
+                sock.sendto(message, self.path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                logger.debug(f'No consumer listening on {self.path}, event dropped')
+
+
+class FifoSink(object):
+    """Write events to a named pipe (created if missing). Events are dropped if no consumer has it open for reading"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, message):
+        if not os.path.exists(self.path):
+            os.mkfifo(self.path)
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno == errno.ENXIO:  # no reader
+                logger.debug(f'No consumer reading {self.path}, event dropped')
+                return
+            raise
+        try:
+            os.write(fd, message)
+        finally:
+            os.close(fd)
+
+
+# sink types usable in 'notify' of the main config, see register_sink
+SINKS = {'file': FileSink, 'unix_socket': UnixSocketSink, 'fifo': FifoSink}
+
+
+def register_sink(name, factory):
+    """make a sink type available to the 'notify' entries of the main config
+
+    Args:
+        name: value of 'type' in the config entries
+        factory: called with the other keys of the config entry as keyword arguments, returns an object with a method
+            send(message) taking the event as json line (bytes)
+    """
+    SINKS[name] = factory
+
+
+class Notifier(object):
+    """Publish events to a list of sinks. Failing sinks are logged but never interrupt the retrieval"""
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def publish(self, event):
+        message = (json.dumps(event, default=str) + '\n').encode()
+        for sink in self.sinks:
+            try:
+                sink.send(message)
+            except Exception as e:
+                logger.error(f'Could not publish event to {type(sink).__name__}: {e}')
+
+
+def get_notifier(conf):
+    """get the notifier for the sinks listed in 'notify' of the main config dictionary conf, None if not configured
+
+    Each entry of 'notify' is a dictionary with 'type' (default 'file', see SINKS) and the arguments of the sink
+    """
+    if not conf.get('notify'):
+        return None
+    sinks = []
+    for entry in conf['notify']:
+        entry = dict(entry)
+        sink_type = entry.pop('type', 'file')
+        if sink_type not in SINKS:
+            raise DLConfigError(f"unknown notification sink type '{sink_type}', known are: {', '.join(SINKS)}")
+        if 'path' in entry:
+            entry['path'] = str(abs_file_path(entry['path']))
+        sinks.append(SINKS[sink_type](**entry))
+    return Notifier(sinks)
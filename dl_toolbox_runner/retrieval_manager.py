@@ -1,41 +1,101 @@
 # Observer and retrieval manager for Doppler Lidar data
+import fnmatch
 import os
+import shutil
 import sys
+import tempfile
 import time
 import datetime
 import pandas as pd
-from threading import Thread
+from collections import deque
+from threading import Event, Lock, Thread
 from pathlib import Path
 from queue import Queue
-from multiprocessing import Pool
+from multiprocessing import Process
 
 #from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers.polling import PollingObserver
 
 from dl_toolbox_runner.main import Runner
-from dl_toolbox_runner.errors import LogicError, DLFileError
-from dl_toolbox_runner.utils.file_utils import abs_file_path, round_datetime, find_file_time_windcube, get_instrument_id_and_scan_type, create_batch, get_insttype, read_halo
+from dl_toolbox_runner.status import StatusServer
+from dl_toolbox_runner.errors import DLFileError, FilenameError
+from dl_toolbox_runner.utils.readiness import ReadinessTracker, is_temp_name
+from dl_toolbox_runner.utils.resources import resource_usage
+from dl_toolbox_runner.utils.scan_schedule import ScanSchedule
+from dl_toolbox_runner.utils.batch_planner import iter_windows
+from dl_toolbox_runner.utils.failure_ledger import file_fingerprint
+from dl_toolbox_runner.utils.halo_tail import HaloTailReader
+from dl_toolbox_runner.utils.pipeline import StagedExecutor
+from dl_toolbox_runner.utils.file_utils import abs_file_path, round_datetime, find_file_time_windcube, get_instrument_id_and_scan_type, create_batch, add_to_batch, update_in_batch, get_insttype, read_halo
 from dl_toolbox_runner.log import logger
 
 class RealTimeWatcher(FileSystemEventHandler):
     
     # Class to manage the file system events and start the wind retrieval
-    def __init__(self, queue, file_prefix):
+    def __init__(self, queue, file_prefix, conf=None, now=None):
+        # conf: main config file or dictionary, defaults to dl_toolbox_runner/config/main_config.yaml
+        # now: function returning the current time, e.g. an accelerated clock for simulations (see simulate.py)
         logger.info('Initializing RealTimeWatcher')
-        self.x = Runner(abs_file_path('dl_toolbox_runner/config/main_config.yaml'), single_process=False)
+        self.x = Runner(conf or abs_file_path('dl_toolbox_runner/config/main_config.yaml'), single_process=False)
         self.file_prefix = file_prefix
+        self.now = now or datetime.datetime.now
 
         self.retrieval_batches = [] # list of dictionary to store the file batches
-        self.retrieval_time = 10 # Time window for the retrieval in minutes
+        # windows whose batch has been dispatched, expired or retrieved before, (scan key, window start) -> window end.
+        # Files arriving late for them do not open a new batch (see add_to_batches)
+        self.closed_windows = {}
+        # Time window for the retrieval in minutes and time between the starts of consecutive windows. With a stride
+        # shorter than the window, windows overlap and each file feeds several of them (see add_to_batches)
+        self.retrieval_time = self.x.conf.get('retrieval_window_min') or 10
+        self.retrieval_stride = self.x.conf.get('retrieval_stride_min') or self.retrieval_time
         
         #self.date_start = round_datetime(datetime.datetime.now() + datetime.timedelta(minutes=10), round_to_minutes=10)
         #self.date_end = self.date_start + datetime.timedelta(minutes=10)
         
         self.threshold = 0.6 # % Threshold for the batch length to trigger the retrieval
         self.max_batch_age = 40 # Time in minutes after which a batch is considered too old and deleted
+
+        # at startup, the files which arrived while the watcher was down are ingested before live events, see
+        # ingest_backlog. Files found there and reported again by events (or by several events) are ingested once
+        self.backlog_horizon = self.x.conf.get('backlog_horizon_min', self.max_batch_age)  # 0 to disable
+        self.backlog_workers = self.x.conf.get('backlog_workers') or 8  # threads reading the backlog files
+        self.seen = {}  # path -> (fingerprint, time.monotonic() of ingestion) of the files ingested
+        self.seeded = Event()  # cleared while the backlog is ingested, process_ready_files waits for it
+        self.seeded.set()
+        
+        # learn the file cadence of each scan to dispatch windows as soon as all expected files are there. Threshold and
+        # delay above are only used for scans without regular schedule
+        self.use_schedule = True
+        self.schedule = ScanSchedule()
         
         self.queue = queue
+
+        # files are read once no event occurred and size and mtime did not change during settle_time (in seconds)
+        self.settle_time = 5
+        self.readiness = ReadinessTracker(settle_sec=self.settle_time)
+
+        # with halo_tail in the main config, HALO .hpl files are read while growing and their new rays are fed to the
+        # windows as they arrive (see tail_growing_files), instead of waiting for the file to be complete
+        self.halo_tail = bool(self.x.conf.get('halo_tail'))
+        self.tail_idle_sec = self.x.conf.get('halo_tail_idle_sec') or 900  # stop following a file not growing any more
+        self.tail_events = deque()  # files to follow, from the observer thread
+        self.tailed = {}  # path -> state of a followed file, updated by the reader thread only
+        self.tail_lock = Lock()  # guards tailed, whose keys are also looked up by the observer and status threads
+        # batches dispatched while files are still followed get a copy of their complete rays from this directory
+        self.snapshot_dir = self.x.conf.get('halo_tail_snapshot_dir') or os.path.join(tempfile.gettempdir(), 'dl_halo_snapshots')
+
+        self.resource_report_interval = 600  # Time in seconds between reports of open files and memory in the log
+        self.last_resource_report = time.monotonic()
+
+        # counters and state reported by status(), see StatusServer
+        self.started = time.monotonic()
+        self.counts = {'files_ingested': 0, 'ingest_errors': 0, 'batches_dispatched': 0, 'batches_expired': 0,
+                       'rays_tailed': 0}
+        self.dispatch_latencies = deque(maxlen=100)  # seconds from the end of the retrieval window to the dispatch
+        self.workers = {}  # name -> thread, for reporting worker health
+        self.reader_heartbeat = None  # last loop of process_ready_files
+        self.load_state = {'in_flight': 0, 'retrievals_started': 0, 'retrievals_failed': 0, 'heartbeat': None}
             
     def check_and_process_batch(self, batch, threshold=0.6, max_batch_age=40, delay=10):
         '''
@@ -52,29 +112,161 @@ class RealTimeWatcher(FileSystemEventHandler):
         1 if the batch is not ready for retrieval
         
         '''
-        if batch['batch_creation_time'] < datetime.datetime.now() - datetime.timedelta(minutes=max_batch_age):
+        if batch['batch_creation_time'] < self.now() - datetime.timedelta(minutes=max_batch_age):
             logger.warning('Batch is too old, removing it from the batch list !')
-            print(batch)
-            self.retrieval_batches.remove(batch)
+            logger.debug(batch)
+            self.close_batch(batch)
+            self.counts['batches_expired'] += 1
             return 0
         
         # Check that there is enough measurement time AND leave a margin of 10 minutes in case new files would be added to the batch
         # TODO: In addition, we need to add a check for the batch time to be mostly covering the retrieval time
         # this avoids e.g. a batch starting at 00:02 and ending at 00:12 to be retrieved between 00:10 and 00:20
         # time_not_in_batch = (batch['batch_end_time'] - batch['retrieval_end_time']).total_seconds() + (batch['batch_start_time'] - batch['retrieval_start_time']).total_seconds()
-        if (batch['batch_length_sec'] > threshold*self.retrieval_time*60) & (batch['retrieval_end_time'] < datetime.datetime.now() - datetime.timedelta(minutes=delay)):
+        scan_key = (batch['instrument_id'], batch['scan_type'], batch['scan_id'])
+        window_complete = self.use_schedule and self.schedule.window_complete(scan_key, batch)
+        if window_complete:
+            logger.info('All files expected from the learned scan schedule are in the batch, no need to wait')
+        if window_complete or ((batch['batch_length_sec'] > threshold*self.retrieval_time*60) & (batch['retrieval_end_time'] < self.now() - datetime.timedelta(minutes=delay))):
             # Add batch to the the queue for retrieval
+            self.snapshot_tailed_files(batch)
             self.queue.put(batch)
+            self.counts['batches_dispatched'] += 1
+            self.dispatch_latencies.append((self.now() - batch['retrieval_end_time']).total_seconds())
             logger.info(f"Adding batch to queue with size: {self.queue.qsize()}")
             # remove the batch from the list
-            self.retrieval_batches.remove(batch)
+            self.close_batch(batch)
             logger.info('Added batch to queue and removing it, number of batches remaining: ' + str(len(self.retrieval_batches)))
             return 0
         else:
             #self.retrieval_batches.append(batch)
             return 1
     
+    def close_batch(self, batch):
+        # Remove batch from the open batches, its window is not to be opened again by files arriving later
+        self.retrieval_batches.remove(batch)
+        key = (batch['instrument_id'], batch['scan_type'], batch['scan_id'], batch['retrieval_start_time'])
+        self.closed_windows[key] = batch['retrieval_end_time']
+
+    def snapshot_tailed_files(self, batch):
+        # Files of batch which are still followed are being written. The retrieval gets a copy of their header and
+        # complete rays instead (see HaloTailReader.copy_complete_rays), removed after the run by Runner.release_inputs
+        for ind, file in enumerate(batch['files']):
+            with self.tail_lock:
+                tail = self.tailed.get(file)
+            if tail is None:
+                continue
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            snapshot = tail['reader'].copy_complete_rays(tempfile.mkdtemp(dir=self.snapshot_dir))
+            batch.setdefault('source_files', list(batch['files']))  # originals, e.g. for archival
+            batch['files'][ind] = snapshot
+            batch.setdefault('snapshots', []).append(snapshot)
+            logger.info(f"Dispatching complete rays of growing file {Path(file).name} up to {tail['reader'].end_time}")
+
     def on_created(self, event):
+        # Files are only read once completely written, see process_ready_files, except growing HALO files
+        if event.is_directory:
+            return
+        if self.is_tailed_file(event.src_path):
+            self.tail_events.append(event.src_path)
+        else:
+            self.readiness.touch(event.src_path)
+
+    def on_moved(self, event):
+        # Files are often written under a temporary name and renamed once complete (e.g. rsync, scp)
+        if event.is_directory:
+            return
+        if self.is_tailed_file(event.dest_path):
+            self.readiness.discard(event.src_path)
+            self.tail_events.append(event.dest_path)
+        else:
+            self.readiness.moved(event.src_path, event.dest_path)
+
+    def is_tailed_file(self, path):
+        # True for the files read while growing: uncompressed HALO files, if halo_tail is set in the main config
+        if not self.halo_tail or not path.endswith('.hpl') or is_temp_name(path):
+            return False
+        try:
+            return get_insttype(path, base_filename='DWL_raw_XXXWL_', return_date=False) == 'halo'
+        except FilenameError:
+            return False
+
+    def process_ready_files(self, poll_interval=1):
+        # Ingest files once they are ready (no more events and no change of size and mtime during settle_time)
+        # Runs in its own thread, which is the only one modifying retrieval_batches
+        self.seeded.wait()  # events collected meanwhile are processed once the backlog is in
+        while True:
+            self.reader_heartbeat = self.now()
+            for file in self.readiness.ready():
+                with self.x.profiled('ingest', Path(file).name):  # if sampled, see profile_* in the main config
+                    self.ingest_file(file)
+            if self.halo_tail:
+                self.tail_growing_files()
+            time.sleep(poll_interval)
+
+    def tail_growing_files(self):
+        # Read the rays appended to the followed HALO files since the last call and feed them to the windows. Files are
+        # followed from their creation (or first modification) until they did not grow for tail_idle_sec
+        while self.tail_events:
+            path = self.tail_events.popleft()
+            with self.tail_lock:
+                if path not in self.tailed:
+                    logger.info(f'Following growing file {path}')
+                    self.tailed[path] = {'reader': HaloTailReader(path), 'file_dict': None, 'windows': set(),
+                                         'last_growth': time.monotonic()}
+        with self.tail_lock:
+            tailed = list(self.tailed.items())
+        for path, tail in tailed:
+            try:
+                times = tail['reader'].read_new()
+                if times:
+                    tail['last_growth'] = time.monotonic()
+                    self.ingest_rays(path, tail, times)
+            except Exception as error:
+                self.counts['ingest_errors'] += 1
+                logger.error(f'{str(error)}, no longer following {path}')
+                with self.tail_lock:
+                    del self.tailed[path]
+                continue
+            if time.monotonic() - tail['last_growth'] > self.tail_idle_sec or not os.path.exists(path):
+                logger.info(f'{path} did not grow for {self.tail_idle_sec} seconds, no longer following it')
+                with self.tail_lock:
+                    del self.tailed[path]
+
+    def ingest_rays(self, path, tail, times):
+        # Extend the file to the rays just read and add it to the windows they fall in. Batches of windows the file
+        # was added to before only get its longer time slice
+        reader = tail['reader']
+        file_dict = tail['file_dict']
+        if file_dict is None:
+            instrument_id, scan_type, scan_id, scan_resolution, _ = get_instrument_id_and_scan_type(path, 'halo', prefix=self.file_prefix)
+            file_dict = tail['file_dict'] = {'file': path, 'instrument_id': instrument_id, 'scan_type': scan_type,
+                                             'scan_id': scan_id, 'scan_resolution': scan_resolution,
+                                             'file_start_time': reader.start_time}
+        since = file_dict.get('file_end_time', reader.start_time)
+        file_dict['file_end_time'] = reader.end_time
+        file_dict['file_length'] = (reader.end_time - reader.start_time).total_seconds()
+        file_dict['file_mid_time'] = reader.start_time + datetime.timedelta(seconds=file_dict['file_length']/2)
+        logger.debug(f'{len(times)} new rays in {Path(path).name} up to {reader.end_time}')
+        self.add_to_batches(file_dict, since=since, windows=tail['windows'])
+        self.counts['rays_tailed'] += len(times)
+        for batch in list(self.retrieval_batches):  # iterate over a copy as processed batches get removed
+            # no need to wait for a window once all its files are followed and have rays beyond its end
+            with self.tail_lock:
+                ends = [(self.tailed[file]['file_dict'] or {}).get('file_end_time') if file in self.tailed else None for file in batch['files']]
+            passed = None not in ends and min(ends) > batch['retrieval_end_time']
+            self.check_and_process_batch(batch, threshold=self.threshold, max_batch_age=self.max_batch_age, delay=0 if passed else 15)
+        self.report_resources()
+
+    def ingest_file(self, file):
+        fingerprint = file_fingerprint(file)
+        if self.seen.get(file, (None,))[0] == fingerprint:
+            logger.debug(f'{file} has been ingested before, skipping it')
+            return
+        # files which failed before are skipped until they change or their backoff expires (see FailureLedger)
+        if self.x.failures is not None and self.x.failures.skip(file, fingerprint):
+            logger.info(f'Skipping {file} which failed before')
+            return
         try:
             # When a file is created, collect the path and store it
             # Start retrieval only when sufficient files are available for each measurement type
@@ -82,31 +274,30 @@ class RealTimeWatcher(FileSystemEventHandler):
             # {'instrument_id':instrument_id, 'scan_type':scan_type, 'files':[file1, file2, ...], 'file_start_time':start_time, 'file_end_time':end_time, 'file_length':length}
             file_dict = {}
             # file here must be the full path !
-            file = event.src_path
             filename = Path(file).name
             inst_type = get_insttype(file, base_filename='DWL_raw_XXXWL_', return_date=False)
             
+            if inst_type == 'system_data':
+                self.ingest_system_data(file)
+                return
+
             # TODO: at the moment, scan_id is not defined for Halo and is set to default 0 (=instrument number)
             instrument_id, scan_type, scan_id, scan_resolution, file_datetime = get_instrument_id_and_scan_type(file, inst_type, prefix=self.file_prefix)            
             
-            if inst_type == 'system_data':
-                logger.info(f'File {file} is system data and will be skipped')
-                return
-            elif inst_type == 'windcube':
-                file_start_time, file_end_time = find_file_time_windcube(file)
-            elif inst_type == 'halo':
+            if inst_type in ['windcube', 'halo']:
                 logger.info(f'Reading: {file}')
-                mheader, time_ds = read_halo(file)
-                file_start_time, file_end_time = pd.to_datetime(time_ds.values[0]), pd.to_datetime(time_ds.values[-1])
+                file_start_time, file_end_time = self.x.file_times(file, inst_type)  # handles compressed files
             else:
                 logger.error(f": {file} is not of a known instrument type")
                 raise DLFileError
             
             if file_start_time is None:
                 logger.error(f"Problem while reading: {file}")
+                self.counts['ingest_errors'] += 1
+                self.x.record_failed_file(file, 'could not read file times', fingerprint)
                 return
             
-            print('####################')
+            logger.debug('####################')
             logger.info(f'file: {filename} from: {file_start_time} to: {file_end_time}')
 
             # Build file dictionary:
@@ -117,113 +308,266 @@ class RealTimeWatcher(FileSystemEventHandler):
             file_dict['scan_resolution'] = scan_resolution
             file_dict['file_start_time'] = file_start_time
             file_dict['file_end_time'] = file_end_time
-            file_dict['file_length'] = (file_end_time - file_start_time).total_seconds()
-            file_dict['file_mid_time'] = file_start_time + datetime.timedelta(seconds=file_dict['file_length']/2)
-            # As a first test, we can implement this based on the filename only
-            # check if instrument_id and scan_type already exist in one of the batch
-            # batch dictionary is formatted as: {'files': [file], 'instrument_id': instrument_id, 'scan_type': scan_type}
-            
-            if any((d['instrument_id'] == instrument_id) & (d['scan_type'] == scan_type) & (d['scan_id'] == scan_id) for d in self.retrieval_batches):
-                new_batch = 0
-                # if so, add the file to the list of files from the correct batch
-                # WARNING: 2 (or more) batches for same types and instrument can co-exist if the files are not in the same time window
-                # Need to check if the file fits in the time window of each batch
-                for batch in self.retrieval_batches:
-                    if (batch['instrument_id'] == instrument_id) & (batch['scan_type'] == scan_type) & (batch['scan_id'] == scan_id):
-                        # if both instrument_id and scan_type match, 
-                        # Check the time window of the batch
-                        # add the file to the batch if it fits in the time window
-                        if (file_end_time < batch['retrieval_start_time']):
-                            logger.info('File end time is before batch retrieval start time, ignoring file')
-                            #print('File end time: ', file_end_time, 'Batch retrieval start time: ', batch['retrieval_start_time'])
-                            new_batch = 0
-                            continue
-                        elif (file_start_time > batch['retrieval_end_time']):
-                            new_batch = 1
-                            continue
-                        elif (file_start_time > batch['retrieval_start_time']) & (file_end_time < batch['retrieval_end_time']):
-                            # Case when the files are completely withing the retrieval time window
-                            logger.info('File added to existing batch for ' + instrument_id + ' and scan type: ' + scan_type + ' with retrieval time border: ' + str(batch['retrieval_start_time']) + '' + str(batch['retrieval_end_time']))
-                            # Add file to batch and update the batch_end_time
-                            batch['files'].append(file)
-                            batch['batch_length_sec'] += file_dict['file_length']
-                        
-                            if file_start_time < batch['batch_start_time']:
-                                batch['batch_start_time'] = file_start_time
-                            if file_end_time > batch['batch_end_time']:
-                                batch['batch_end_time'] = file_end_time
-                            
-                            # When the batch_end_time becomes bigger thant date_end, do the retrieval for this batch and empty file list
-                            #if (batch['batch_start_time'] < self.date_start) & (batch['batch_end_time'] > self.date_end):
-                            #check = self.check_and_process_batch(batch, threshold=self.threshold, max_batch_age=self.max_batch_age)
-                            new_batch = 0
-                            continue
-                        elif (file_start_time > batch['retrieval_start_time']) or (file_end_time < batch['retrieval_end_time']):
-                            logger.info('Part of the file is in the time window but not all --> we try adding it now')                            
-                            batch['files'].append(file)
-                            if file_start_time < batch['batch_start_time']:
-                                batch['batch_start_time'] = file_start_time
-                            if file_end_time > batch['batch_end_time']:
-                                batch['batch_end_time'] = file_end_time
-                            batch['batch_length_sec'] += file_dict['file_length'] # (batch['batch_end_time'] - batch['batch_start_time']).total_seconds()
-                            new_batch = 0
-                            continue
-                            #new_batch = 0
-                            #continue
-                        else:
-                            logger.error('Error in the code, recheck the logic')
-                            raise LogicError('Error in the code, recheck the logic')
-                    else:
-                        continue
-
-                if new_batch:
-                    # This should only create a new batch after having check all existing batches and make sure in all cases
-                    # that the start_time of the file was bigger than the retrieval_end_time
-                    # To define the retrieval_start_time, we need to use the middle time of the file and round it to the nearest 10 minutes, 
-                    # if using only the file_end_time, we end up with wrong retrieval time
-                    retrieval_start_time = round_datetime(file_dict['file_mid_time'], round_to_minutes=self.retrieval_time)
-                    retrieval_end_time = retrieval_start_time + datetime.timedelta(minutes=self.retrieval_time)
-                    batch = create_batch(file_dict, retrieval_start_time, retrieval_end_time)
-                    self.retrieval_batches.append(batch)
-                    logger.info('New batch created for ID '+file_dict['instrument_id']+' and scan type: '+file_dict['scan_type']+' from file, with retrieval border:'+ str(retrieval_start_time)+' and '+str(retrieval_end_time))
-            else:
-                #TODO: for some instruments, we should create 2 batches with 1 single file (if contains more than 15 min measurement...)
-                retrieval_start_time = round_datetime(file_dict['file_mid_time'], round_to_minutes=self.retrieval_time)
-                retrieval_end_time = retrieval_start_time + datetime.timedelta(minutes=self.retrieval_time)
-                batch = create_batch(file_dict, retrieval_start_time, retrieval_end_time)
-                self.retrieval_batches.append(batch)
-                logger.info('New batch created for ID '+file_dict['instrument_id']+' and scan type: '+file_dict['scan_type']+' from file, with retrieval border:'+ str(retrieval_start_time)+' and '+str(retrieval_end_time))
-                #check = self.check_and_process_batch(batch, threshold=self.threshold, max_batch_age=self.max_batch_age)
-            
-            for batch in self.retrieval_batches:
+            self.add_file(file_dict, fingerprint)
+
+            for batch in list(self.retrieval_batches):  # iterate over a copy as processed batches get removed
                 check = self.check_and_process_batch(batch, threshold=self.threshold, max_batch_age=self.max_batch_age, delay=15)
             logger.info(f'Number of batches: {len(self.retrieval_batches)}')
+            self.report_resources()
         except Exception as error:
+            self.counts['ingest_errors'] += 1
+            self.x.record_failed_file(file, error, fingerprint)
             logger.error(f"{str(error)}, Ignoring this file...")
             return     
         
+    def add_file(self, file_dict, fingerprint=None):
+        # Complete the file dictionary with length and mid time, learn the scan schedule from it and add the file to
+        # the batches of its windows
+        file_dict['file_length'] = (file_dict['file_end_time'] - file_dict['file_start_time']).total_seconds()
+        file_dict['file_mid_time'] = file_dict['file_start_time'] + datetime.timedelta(seconds=file_dict['file_length']/2)
+        self.schedule.add_file((file_dict['instrument_id'], file_dict['scan_type'], file_dict['scan_id']),
+                               file_dict['file_start_time'], file_dict['file_end_time'])
+        self.add_to_batches(file_dict)
+        self.seen[file_dict['file']] = (fingerprint, time.monotonic())
+        self.counts['files_ingested'] += 1
+
+    def ingest_backlog(self, watch_path):
+        # Ingest the files which arrived while the watcher was down: files below watch_path modified within the last
+        # backlog_horizon minutes are read in parallel and added to the batches before live events are processed. The
+        # observer is to be started before, such that no file falls in between. Windows with L2 outputs written
+        # already (e.g. before a restart) are not retrieved again
+        self.seeded.clear()
+        try:
+            if not self.backlog_horizon:
+                return
+            start = time.monotonic()
+            files = []
+            for file in self.find_backlog(watch_path, time.time() - self.backlog_horizon*60):
+                if self.is_tailed_file(file):
+                    self.tail_events.append(file)  # followed from the start by the reader thread
+                    continue
+                try:
+                    system_data = get_insttype(file, return_date=False) == 'system_data'
+                except FilenameError:
+                    continue
+                if system_data:
+                    self.ingest_system_data(file)
+                else:
+                    files.append(file)
+            logger.info(f'Ingesting backlog of {len(files)} files modified within the last {self.backlog_horizon} minutes')
+
+            def read(file):
+                fingerprint = file_fingerprint(file)  # before reading, such that a file changing meanwhile is read again
+                file_dict = self.x.get_file_dict(file)  # skips files which failed before (see FailureLedger)
+                return [] if file_dict is None else [(file_dict, fingerprint)]
+
+            def on_error(stage, file, error):
+                self.counts['ingest_errors'] += 1
+                logger.error(f'Could not read {file}: {error}')
+
+            results = StagedExecutor([('read', read, self.backlog_workers)], on_error=on_error).run(files)
+            for file_dict, fingerprint in sorted(results, key=lambda result: result[0]['file_start_time']):
+                self.add_file(file_dict, fingerprint)
+            for batch in list(self.retrieval_batches):
+                if self.x.window_outputs(batch):
+                    logger.info(f"Window {batch['retrieval_start_time']} - {batch['retrieval_end_time']} of "
+                                f"{batch['instrument_id']} has been retrieved before, not retrieving it again")
+                    self.close_batch(batch)
+            for batch in list(self.retrieval_batches):
+                self.check_and_process_batch(batch, threshold=self.threshold, max_batch_age=self.max_batch_age, delay=15)
+            logger.info(f'Ingested backlog of {len(results)} files in {time.monotonic() - start:.1f} seconds, '
+                        f'{len(self.retrieval_batches)} batches waiting')
+        finally:
+            self.seeded.set()
+
+    def find_backlog(self, directory, since):
+        # files below directory (watched recursively) with the input file prefix, modified after since (epoch seconds)
+        files = []
+        for root, dirs, names in os.walk(directory):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in names:
+                if not fnmatch.fnmatch(name, self.file_prefix + '*') or is_temp_name(name):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) >= since:
+                        files.append(path)
+                except OSError:  # removed meanwhile
+                    continue
+        return sorted(files)
+
+    def add_to_batches(self, file_dict, since=None, windows=None):
+        # Add the file to the batch of every retrieval window it overlaps, creating batches as needed. Long files (e.g.
+        # HALO stare files) thus feed several windows, each batch only counting the time slice of the file within its
+        # window (see create_batch). Times are read once per file, all windows share it.
+        # For growing files (see ingest_rays), only the windows from time since on are visited. windows is the set of
+        # the starts of the windows the file was added to before, whose batches only get the file's longer time slice
+        key = (file_dict['instrument_id'], file_dict['scan_type'], file_dict['scan_id'])
+        batches = [batch for batch in self.retrieval_batches if (batch['instrument_id'], batch['scan_type'], batch['scan_id']) == key]
+        for retrieval_start_time, retrieval_end_time in iter_windows(since or file_dict['file_start_time'], file_dict['file_end_time'], self.retrieval_time, self.retrieval_stride):
+            batch = next((batch for batch in batches if batch['retrieval_start_time'] == retrieval_start_time), None)
+            if key + (retrieval_start_time,) in self.closed_windows:
+                logger.info('Retrieval window ending at ' + str(retrieval_end_time) + ' has already been dispatched or dropped, ignoring this part of the file')
+                continue
+            if windows is not None:
+                if retrieval_start_time in windows:
+                    if batch is not None and file_dict['file'] in batch['files']:
+                        update_in_batch(batch, file_dict)
+                    else:
+                        logger.info('Retrieval window ending at ' + str(retrieval_end_time) + ' has already been dispatched or dropped, ignoring the new rays within it')
+                    continue
+                windows.add(retrieval_start_time)
+            if batch is not None:
+                add_to_batch(batch, file_dict)
+                logger.info('File added to existing batch for ' + file_dict['instrument_id'] + ' and scan type: ' + file_dict['scan_type'] + ' with retrieval time border: ' + str(retrieval_start_time) + ' ' + str(retrieval_end_time))
+            elif any(batch['retrieval_start_time'] >= retrieval_end_time for batch in batches):
+                # window has already been dispatched or dropped, later windows are open
+                logger.info('Retrieval window ending at ' + str(retrieval_end_time) + ' is older than the open batches, ignoring this part of the file')
+            else:
+                batch = create_batch(file_dict, retrieval_start_time, retrieval_end_time)
+                batch['batch_creation_time'] = self.now()
+                self.retrieval_batches.append(batch)
+                batches.append(batch)
+                logger.info('New batch created for ID '+file_dict['instrument_id']+' and scan type: '+file_dict['scan_type']+' from file, with retrieval border:'+ str(retrieval_start_time)+' and '+str(retrieval_end_time))
+
+    def report_resources(self):
+        # Log resource usage every resource_report_interval seconds to spot leaks of this long-running process
+        if time.monotonic() - self.last_resource_report < self.resource_report_interval:
+            return
+        self.last_resource_report = time.monotonic()
+        if self.x.file_metadata is not None:
+            self.x.file_metadata.save()
+        for file, (_, ingested) in list(self.seen.items()):  # files too old for any open batch
+            if time.monotonic() - ingested > 2 * self.max_batch_age * 60:
+                del self.seen[file]
+        horizon = self.now() - datetime.timedelta(minutes=2 * max(self.max_batch_age, self.backlog_horizon or 0))
+        for key, retrieval_end_time in list(self.closed_windows.items()):
+            if retrieval_end_time < horizon:
+                del self.closed_windows[key]
+        if os.path.isdir(self.snapshot_dir):  # snapshots of batches never run, e.g. skipped as failed before
+            for entry in os.scandir(self.snapshot_dir):
+                if time.time() - entry.stat().st_mtime > 2 * self.max_batch_age * 60:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+        usage = resource_usage()
+        logger.info(f"Resource usage: {usage['open_fds']} open files, {usage['rss_mb']} MB resident memory, "
+                    f"{usage['cached_datasets']} cached datasets, {usage['threads']} threads, "
+                    f"{len(self.retrieval_batches)} batches waiting")
+
+    def status(self):
+        # Snapshot of the watcher state for the status endpoint. Called from the status server threads, hence only
+        # copies of the shared containers are iterated
+        now = self.now()
+        batches = {}
+        for batch in list(self.retrieval_batches):
+            batches.setdefault(batch['instrument_id'], []).append({
+                'scan_type': batch['scan_type'],
+                'scan_id': batch['scan_id'],
+                'retrieval_start_time': batch['retrieval_start_time'].isoformat(),
+                'retrieval_end_time': batch['retrieval_end_time'].isoformat(),
+                'n_files': len(batch['files']),
+                'fill_ratio': round(batch['batch_length_sec'] / (self.retrieval_time*60), 3),
+                'age_sec': round((now - batch['batch_creation_time']).total_seconds(), 1),
+            })
+        latencies = sorted(self.dispatch_latencies)
+        workers = {name: {'alive': thread.is_alive()} for name, thread in self.workers.items()}
+        for name, heartbeat in [('reader', self.reader_heartbeat), ('queue_worker', self.load_state['heartbeat'])]:
+            if name in workers:
+                workers[name]['last_heartbeat_sec'] = None if heartbeat is None else round((now - heartbeat).total_seconds(), 1)
+        return {
+            'time': now.isoformat(),
+            'uptime_sec': round(time.monotonic() - self.started),
+            'batches': batches,
+            'n_batches': sum(len(b) for b in batches.values()),
+            'pending_files': len(self.readiness),
+            'tailed_files': self.n_tailed(),
+            'seeding_backlog': not self.seeded.is_set(),
+            'queue_depth': self.queue.qsize(),
+            'in_flight_retrievals': self.load_state['in_flight'],
+            'dispatch_latency_sec': {
+                'recent': list(self.dispatch_latencies)[-10:],
+                'median': latencies[len(latencies)//2] if latencies else None,
+                'max': latencies[-1] if latencies else None,
+            },
+            'counts': self.counts | {k: self.load_state[k] for k in ['retrievals_started', 'retrievals_failed']},
+            'workers': workers,
+            'resources': resource_usage(),
+        }
+
+    def n_tailed(self):
+        # number of followed files, e.g. for the status endpoint
+        with self.tail_lock:
+            return len(self.tailed)
+
     def on_modified(self, event):
-        # Files should not get modified
+        # Files should not get modified, except while being written and for system data files which grow continuously
+        if event.is_directory:
+            return
+        if self.is_tailed_file(event.src_path):
+            with self.tail_lock:
+                followed = event.src_path in self.tailed
+            if not followed:  # e.g. growing since before the watcher was started
+                self.tail_events.append(event.src_path)
+            return
+        try:
+            system_data = get_insttype(event.src_path, return_date=False) == 'system_data'
+        except FilenameError:
+            system_data = False
+        if event.src_path in self.readiness or system_data:
+            self.readiness.touch(event.src_path)
+            return
         logger.critical(f'event type: {event.event_type}  path : {event.src_path}')
         pass
+
+    def ingest_system_data(self, file):
+        # only the rows appended since the last event are parsed and stored (see SystemDataStore)
+        if self.x.system_data is None:
+            logger.info(f'File {file} is system data and will be skipped')
+            return
+        try:
+            rows = self.x.system_data.ingest(file)
+        except Exception as error:
+            logger.error(f'Could not ingest system data file {file}: {error}')
+            return
+        logger.debug(f'Ingested {0 if rows is None else len(rows)} new rows of system data from {file}')
     
-def process_load_queue(queue):
+def process_load_queue(queue, max_windows=1, state=None, now=datetime.datetime.now):
+    # Each retrieval runs in its own (non-daemonic) process, which may itself start a child process for running the
+    # toolbox within its time and memory budget (see Runner.run_toolbox_limited)
+    # Up to max_windows batches waiting in the queue are handed to the same retrieval, such that consecutive windows
+    # (e.g. after an outage) can be coalesced to a single toolbox invocation (see Runner.run_toolbox)
+    # state (optional): dictionary updated with the number of retrievals in flight, started and failed and a heartbeat
+    # for the status endpoint (see RealTimeWatcher.load_state)
+    state = {'in_flight': 0, 'retrievals_started': 0, 'retrievals_failed': 0} if state is None else state
+    processes = []
     while True:
+        state['heartbeat'] = now()
+        for proc in [p for p in processes if not p.is_alive()]:  # reap finished retrievals
+            proc.join()
+            if proc.exitcode != 0:
+                state['retrievals_failed'] += 1
+            processes.remove(proc)
+        state['in_flight'] = len(processes)
         if not queue.empty():
-            batch = queue.get()
-            pool = Pool(processes=1)
-            pool.apply_async(run_retrieval, (batch,))   
+            batches = [queue.get()]
+            while len(batches) < max_windows and not queue.empty():
+                batches.append(queue.get())
+            proc = Process(target=run_retrieval, args=(batches,))
+            proc.start()
+            processes.append(proc)
+            state['retrievals_started'] += 1
+            state['in_flight'] = len(processes)
         else:
             time.sleep(1)
             
-def run_retrieval(batch):
+def run_retrieval(batches):
     time.sleep(2)
     try:
-        print('####################################################################################')
-        logger.info('Retrieval triggered for ID: ' + batch['instrument_id'] + ' and scan type: ' + batch['scan_type'])
-        logger.info('Retrieval batch time border: ' + str(batch['batch_start_time']) + ' ; ' + str(batch['batch_end_time']))
+        logger.debug('####################################################################################')
+        for batch in batches:
+            logger.info('Retrieval triggered for ID: ' + batch['instrument_id'] + ' and scan type: ' + batch['scan_type'])
+            logger.info('Retrieval batch time border: ' + str(batch['batch_start_time']) + ' ; ' + str(batch['batch_end_time']))
         runner = Runner(abs_file_path('dl_toolbox_runner/config/main_config.yaml'), single_process=False)
-        runner.realtime_run(dry_run=False, retrieval_batches=[batch])
+        runner.realtime_run(dry_run=False, retrieval_batches=batches)
     except Exception as error:
         logger.error(f"{str(error)}, Ignoring this batch...")
         return
@@ -239,20 +583,35 @@ def start_watchdog_queue(watch_path):
     assert os.path.realpath(x.conf['input_dir']) == os.path.realpath(watch_path), f"Configured input directory {x.conf['input_dir']} does not match the one provided {watch_path}"
     
     event_handler = RealTimeWatcher(watchdog_queue, file_prefix)
+    event_handler.seeded.clear()  # live events are collected from now on, but processed after the backlog
     observer = PollingObserver()
     observer.schedule(event_handler, watch_path, recursive=True)
     observer.start()
 
-    worker = Thread(target=process_load_queue, args=(watchdog_queue,))
+    reader = Thread(target=event_handler.process_ready_files)
+    reader.daemon = True
+    reader.start()
+
+    worker = Thread(target=process_load_queue, args=(watchdog_queue, x.conf.get('coalesce_windows') or 1,
+                                                      event_handler.load_state))
     worker.daemon = True
     worker.start()
+    event_handler.workers = {'observer': observer, 'reader': reader, 'queue_worker': worker}
+
+    if x.conf.get('status_port') is not None:
+        try:
+            StatusServer(event_handler.status, host=x.conf.get('status_host', '127.0.0.1'), port=x.conf['status_port']).start()
+        except OSError as error:
+            logger.error(f"Could not start status server on port {x.conf['status_port']}: {error}")
+
+    event_handler.ingest_backlog(watch_path)  # files which arrived while the watcher was down
     
     try:
         while True:
             time.sleep(2)
     except Exception as error:
         observer.stop()
-        print(f"Error: {str(error)}")
+        logger.error(f"Error: {str(error)}")
     observer.join()
     
 if __name__ == '__main__':
@@ -0,0 +1,311 @@
+# Fleet replay simulator for load testing the realtime retrieval (RealTimeWatcher and process_load_queue)
+import argparse
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from queue import Queue
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from dl_toolbox_runner.log import logger
+from dl_toolbox_runner.retrieval_manager import RealTimeWatcher
+from dl_toolbox_runner.utils.config_utils import get_main_config
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+
+# scan schedules of the virtual instruments: time between file starts, file duration and rays per file in seconds
+SCHEDULES = {'windcube': {'period': 76, 'duration': 66, 'n_rays': 25},
+             'halo': {'period': 600, 'duration': 180, 'n_rays': 18}}
+SIM_START = datetime.datetime(2024, 1, 1)
+
+
+class SimClock(object):
+    """Clock running speed times faster than wall-clock time, starting at start_time when calling start()"""
+
+    def __init__(self, start_time=SIM_START, speed=60):
+        self.start_time = start_time
+        self.speed = speed
+        self.wall_start = None
+
+    def start(self):
+        self.wall_start = time.monotonic()
+
+    def __call__(self):
+        return self.start_time + datetime.timedelta(seconds=(time.monotonic() - self.wall_start) * self.speed)
+
+    def sleep_until(self, sim_time):
+        """wait (in wall-clock time) until the clock reaches sim_time"""
+        wait = (sim_time - self()).total_seconds() / self.speed
+        if wait > 0:
+            time.sleep(wait)
+
+
+def write_windcube_file(filename, start_time, end_time, n_rays):
+    """write a minimal WindCube NetCDF file with a sweep group holding n_rays ray times between start and end time"""
+    group_name = 'sweep_1'
+    xr.Dataset({'sweep_group_name': ('sweep', [group_name])}).to_netcdf(filename, mode='w')
+    times = pd.date_range(start_time, end_time, periods=n_rays)
+    xr.Dataset({'ray_index': ('time', np.arange(n_rays))}, coords={'time': times}).to_netcdf(filename, mode='a',
+                                                                                            group=group_name)
+
+
+def write_halo_file(filename, start_time, n_rays, ray_sec, n_gates=100):
+    """write a minimal HALO .hpl file with n_rays rays of n_gates gates each, starting at start_time"""
+    header = [f'Filename:\t{os.path.splitext(os.path.basename(filename))[0]}', 'System ID:\t142',
+              f'Number of gates:\t{n_gates}', 'Range gate length (m):\t30.0', 'Gate length (pts):\t10',
+              'Pulses/ray:\t10000', f'No. of rays in file:\t{n_rays}', 'Scan type:\tVAD', 'Focus range:\t65535',
+              f'Start time:\t{start_time:%Y%m%d %H:%M:%S}.00', 'Resolution (m/s):\t0.0382',
+              'Altitude of measurement (center of gate) = (range gate + 0.5) * Gate length',
+              'Data line 1: Decimal time (hours)  Azimuth (degrees)  Elevation (degrees) Pitch (degrees) Roll (degrees)',
+              'f9.6,1x,f6.2,1x,f6.2',
+              'Data line 2: Range Gate  Doppler (m/s)  Intensity (SNR + 1)  Beta (m-1 sr-1)',
+              'i3,1x,f6.4,1x,f8.6,1x,e12.6 - repeat for no. gates', '****']
+    start_hour = start_time.hour + start_time.minute / 60 + start_time.second / 3600
+    gates = ''.join(f'{gate:4d} -0.1234 1.012345 1.234567E-6\n' for gate in range(n_gates))
+    with open(filename, 'w') as f:
+        f.write('\n'.join(header) + '\n')
+        for ray in range(n_rays):
+            f.write(f'{start_hour + ray * ray_sec / 3600:9.6f} {360 * ray / n_rays:6.2f}  75.00  -0.25  -0.34\n')
+            f.write(gates)
+
+
+class DispatchQueue(Queue):
+    """Queue of batches ready for retrieval recording dispatch time and queue depth"""
+
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+        self.depths = []
+
+    def put(self, batch, *args, **kwargs):
+        batch['dispatch_time'] = self.clock()
+        super().put(batch, *args, **kwargs)
+        self.depths.append(self.qsize())
+
+
+class SimWatcher(RealTimeWatcher):
+    """RealTimeWatcher recording batches which expire instead of being dispatched"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expired = []
+
+    def check_and_process_batch(self, batch, *args, **kwargs):
+        check = super().check_and_process_batch(batch, *args, **kwargs)
+        if check == 0 and 'dispatch_time' not in batch:
+            self.expired.append(batch)
+        return check
+
+
+class FleetSimulator(object):
+    """Replay files of a fleet of virtual instruments into a watch directory at accelerated speed
+
+    Files of each instrument follow the scan schedule of its type (see SCHEDULES) and arrive with a random transfer
+    delay after their end. They are generated upfront and moved to the watch directory when their arrival is reached
+    on the simulation clock, then handed to a RealTimeWatcher for ingestion. The readiness delay of the watcher
+    (settle_time) is not simulated as the files arrive complete. Batches dispatched by the watcher are consumed like
+    in process_load_queue, with the DL toolbox replaced by a stub taking toolbox_latency_sec.
+
+    Args:
+        n_instruments: number of virtual instruments
+        duration_min (optional): simulated time span in minutes. Defaults to 60
+        speed (optional): acceleration of the simulation clock with respect to wall-clock time. Defaults to 60
+        toolbox_latency_sec (optional): simulated duration of one toolbox run in seconds. Defaults to 60
+        toolbox_workers (optional): maximum number of concurrent toolbox runs. Defaults to None, i.e. unlimited like
+            the processes of process_load_queue
+        halo_fraction (optional): fraction of instruments of type HALO, the others are WindCubes. Defaults to 0.25
+        transfer_delay_sec (optional): range of random delays between end and arrival of a file. Defaults to (5, 60)
+        conf (optional): main config file or dictionary. Defaults to dl_toolbox_runner/config/main_config.yaml
+        seed (optional): seed of the random schedules. Defaults to 0
+    """
+
+    def __init__(self, n_instruments, duration_min=60, speed=60, toolbox_latency_sec=60, toolbox_workers=None,
+                 halo_fraction=0.25, transfer_delay_sec=(5, 60), conf=None, seed=0):
+        self.n_instruments = n_instruments
+        self.duration_min = duration_min
+        self.speed = speed
+        self.toolbox_latency_sec = toolbox_latency_sec
+        self.toolbox_workers = toolbox_workers
+        self.halo_fraction = halo_fraction
+        self.transfer_delay_sec = transfer_delay_sec
+        self.random = random.Random(seed)
+        if conf is None or not isinstance(conf, dict):
+            conf = get_main_config(conf or abs_file_path('dl_toolbox_runner/config/main_config.yaml'))
+        self.conf = dict(conf)
+        for key in ['halo_cache_dir', 'system_data_store_dir', 'pipeline']:  # keep the simulation free of side effects
+            self.conf.pop(key, None)
+
+    def schedule(self):
+        """list of files (arrival_time, inst_type, filename, start_time, end_time) of all instruments by arrival time"""
+        files = []
+        end = SIM_START + datetime.timedelta(minutes=self.duration_min)
+        n_halo = int(round(self.halo_fraction * self.n_instruments))
+        for ind in range(self.n_instruments):
+            instrument_id = f'{ind:03d}WL'
+            inst_type = 'halo' if ind < n_halo else 'windcube'
+            sched = SCHEDULES[inst_type]
+            start = SIM_START + datetime.timedelta(seconds=self.random.uniform(0, sched['period']))
+            while start < end:
+                file_end = start + datetime.timedelta(seconds=sched['duration'])
+                if inst_type == 'halo':
+                    filename = f"{self.conf['input_file_prefix']}{instrument_id}_VAD_142_{start:%Y%m%d_%H%M%S}.hpl"
+                else:
+                    filename = f"{self.conf['input_file_prefix']}{instrument_id}_{start:%Y-%m-%d_%H-%M-%S}_dbs_303_50mTP.nc"
+                arrival = file_end + datetime.timedelta(seconds=self.random.uniform(*self.transfer_delay_sec))
+                files.append((arrival, inst_type, filename, start, file_end))
+                start += datetime.timedelta(seconds=sched['period'] + self.random.uniform(-2, 2))
+        return sorted(files)
+
+    def run(self):
+        """run the simulation and return the report dictionary (see report())"""
+        work_dir = tempfile.mkdtemp(prefix='dl_toolbox_runner_sim_')
+        staging_dir = os.path.join(work_dir, 'staging')
+        watch_dir = os.path.join(work_dir, 'watch')
+        os.makedirs(staging_dir)
+        os.makedirs(watch_dir)
+        try:
+            files = self.schedule()
+            logger.info(f'Generating {len(files)} files of {self.n_instruments} instruments')
+            for _, inst_type, filename, start, end in files:
+                sched = SCHEDULES[inst_type]
+                if inst_type == 'halo':
+                    write_halo_file(os.path.join(staging_dir, filename), start, sched['n_rays'],
+                                    sched['duration'] / sched['n_rays'])
+                else:
+                    write_windcube_file(os.path.join(staging_dir, filename), start, end, sched['n_rays'])
+            return self.replay(files, staging_dir, watch_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def replay(self, files, staging_dir, watch_dir):
+        clock = SimClock(SIM_START, self.speed)
+        queue = DispatchQueue(clock)
+        conf = dict(self.conf, input_dir=watch_dir)
+        watcher = SimWatcher(queue, conf['input_file_prefix'], conf=conf, now=clock)
+        arrivals = {}  # file path -> arrival on the simulation clock
+        handling_sec = []  # wall-clock time spent by the watcher per file
+        lags = []  # delay of the replay with respect to the arrival schedule, in simulated seconds
+        completed = []
+        stop = threading.Event()
+        consumer = threading.Thread(target=self.consume, args=(queue, completed, stop), daemon=True)
+
+        clock.start()
+        consumer.start()
+        wall_start = time.monotonic()
+        for arrival, _, filename, _, _ in files:
+            clock.sleep_until(arrival)
+            lags.append((clock() - arrival).total_seconds())
+            path = os.path.join(watch_dir, filename)
+            os.replace(os.path.join(staging_dir, filename), path)
+            arrivals[path] = arrival
+            tic = time.monotonic()
+            watcher.ingest_file(path)  # moved in complete, no need to wait for readiness
+            handling_sec.append(time.monotonic() - tic)
+        wall_replay = time.monotonic() - wall_start
+
+        # let runs of dispatched batches finish
+        while not queue.empty() or queue.unfinished_tasks:
+            time.sleep(0.01)
+        stop.set()
+        consumer.join()
+        return self.report(files, arrivals, completed, watcher, queue, handling_sec, lags, wall_replay)
+
+    def consume(self, queue, completed, stop):
+        """consume dispatched batches like process_load_queue, with a stub instead of the DL toolbox"""
+        max_windows = self.conf.get('coalesce_windows') or 1
+        slots = threading.BoundedSemaphore(self.toolbox_workers) if self.toolbox_workers else None
+
+        def run_stub(batches):
+            time.sleep(self.toolbox_latency_sec / self.speed)
+            completed.extend(batches)
+            if slots is not None:
+                slots.release()
+            for _ in batches:
+                queue.task_done()
+
+        while not stop.is_set():
+            if queue.empty():
+                time.sleep(0.01)
+                continue
+            if slots is not None:
+                slots.acquire()
+            batches = [queue.get()]
+            while len(batches) < max_windows and not queue.empty():
+                batches.append(queue.get())
+            threading.Thread(target=run_stub, args=(batches,), daemon=True).start()
+
+    def report(self, files, arrivals, completed, watcher, queue, handling_sec, lags, wall_replay):
+        '''
+        Summarise a simulation run
+
+        Latencies are in simulated seconds: from the arrival of the last file of a batch to its dispatch to the queue
+        (event_to_dispatch) and from the end of the retrieval window to the end of the toolbox run (window_to_done)
+        '''
+        dispatched = [batch for batch in completed if 'dispatch_time' in batch]
+        event_to_dispatch = [(batch['dispatch_time'] - max(arrivals[f] for f in batch['files'])).total_seconds()
+                             for batch in dispatched]
+        sim_hours = self.duration_min / 60
+
+        def percentiles(values):
+            if not values:
+                return {}
+            return {f'p{p}': float(np.percentile(values, p)) for p in (50, 90, 99)} | {'max': float(np.max(values))}
+
+        return {
+            'n_instruments': self.n_instruments,
+            'n_files': len(files),
+            'batches_dispatched': len(dispatched),
+            'batches_expired': len(watcher.expired),
+            'batches_pending': len(watcher.retrieval_batches),
+            'event_to_dispatch_sec': percentiles(event_to_dispatch),
+            'queue_depth_max': max(queue.depths, default=0),
+            'queue_depth_mean': float(np.mean(queue.depths)) if queue.depths else 0.,
+            'files_per_wall_sec': len(files) / wall_replay if wall_replay else float('nan'),
+            'batches_per_sim_hour': len(dispatched) / sim_hours,
+            'handling_ms': percentiles([1000 * sec for sec in handling_sec]),
+            'replay_lag_sec': percentiles(lags),
+        }
+
+
+def format_report(report):
+    """one line summary of a report of FleetSimulator.run()"""
+    latency = report['event_to_dispatch_sec']
+    return (f"{report['n_instruments']:5d} instruments | {report['n_files']:6d} files | "
+            f"dispatched {report['batches_dispatched']:5d} | expired {report['batches_expired']:4d} | "
+            f"pending {report['batches_pending']:4d} | latency p50/p90/p99 "
+            f"{latency.get('p50', np.nan):6.0f}/{latency.get('p90', np.nan):6.0f}/{latency.get('p99', np.nan):6.0f} s | "
+            f"queue max {report['queue_depth_max']:3d} | {report['files_per_wall_sec']:7.1f} files/s | "
+            f"handling p99 {report['handling_ms'].get('p99', np.nan):6.1f} ms | "
+            f"max lag {report['replay_lag_sec'].get('max', np.nan):6.0f} s")
+
+
+def main():
+    """command line entry point. Type 'python3 -m dl_toolbox_runner.simulate -h' for more info"""
+    parser = argparse.ArgumentParser(prog='python3 -m dl_toolbox_runner.simulate',
+                                     description='Load test the realtime retrieval with a simulated fleet of instruments')
+    parser.add_argument('--instruments', nargs='+', type=int, default=[1, 10, 50],
+                        help='numbers of virtual instruments, one simulation is run per number')
+    parser.add_argument('--duration_min', type=float, default=60, help='simulated time span in minutes')
+    parser.add_argument('--speed', type=float, default=60, help='acceleration of the simulation clock')
+    parser.add_argument('--latency_sec', type=float, default=60, help='simulated duration of a DL toolbox run')
+    parser.add_argument('--workers', type=int, default=None, help='maximum number of concurrent DL toolbox runs')
+    parser.add_argument('--halo_fraction', type=float, default=0.25, help='fraction of HALO instruments')
+    parser.add_argument('--main_conf', default=None, help='path to the main configuration file')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logger.setLevel('WARNING')  # the watcher logs each file, which would dominate the timing
+    for n_instruments in args.instruments:
+        sim = FleetSimulator(n_instruments, duration_min=args.duration_min, speed=args.speed,
+                             toolbox_latency_sec=args.latency_sec, toolbox_workers=args.workers,
+                             halo_fraction=args.halo_fraction, conf=args.main_conf, seed=args.seed)
+        print(format_report(sim.run()))
+
+
+if __name__ == '__main__':
+    main()
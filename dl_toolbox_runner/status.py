@@ -0,0 +1,58 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dl_toolbox_runner.log import logger
+
+
+class StatusServer(object):
+    """Serve the status of a running process as json over HTTP, e.g. for scraping by monitoring
+
+    GET / or /status returns get_status() as json. The server runs in a background thread.
+
+    Args:
+        get_status: function returning a json serialisable dictionary
+        host (optional): address to listen on. Defaults to '127.0.0.1', i.e. local access only
+        port (optional): port to listen on. Defaults to 8765, 0 picks a free port (see self.port after start())
+    """
+
+    def __init__(self, get_status, host='127.0.0.1', port=8765):
+        self.get_status = get_status
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self):
+        get_status = self.get_status
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/status'):
+                    self.send_error(404)
+                    return
+                try:
+                    body = json.dumps(get_status(), default=str).encode()
+                except Exception as e:
+                    logger.error(f'Could not get status: {e}')
+                    self.send_error(500, str(e))
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # no log line per request
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever, name='status_server', daemon=True)
+        thread.start()
+        logger.info(f'Serving status on http://{self.host}:{self.port}/status')
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
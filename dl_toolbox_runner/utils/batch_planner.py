@@ -0,0 +1,172 @@
+import datetime
+
+import pandas as pd
+
+# columns of the file table, one row per file. Matches the keys of the file_dict used by create_batch()
+FILE_COLUMNS = ['file', 'instrument_id', 'scan_type', 'scan_id', 'scan_resolution',
+                'file_start_time', 'file_end_time', 'file_length', 'file_mid_time']
+BATCH_KEYS = ['instrument_id', 'scan_type', 'scan_id']
+
+
+def iter_windows(start, end, window_min, stride_min=None):
+    '''
+    Yield (window_start, window_end) of all retrieval windows overlapping the period from start to end
+
+    Windows are window_min minutes long and start every stride_min minutes counted from midnight. Windows only touching
+    the period at its start or end do not overlap it. A period of zero length overlaps the window(s) containing it.
+
+    Args:
+        start: start of the period, datetime or pandas.Timestamp
+        end: end of the period
+        window_min: length of the windows in minutes
+        stride_min (optional): time between the starts of consecutive windows in minutes. Defaults to window_min, i.e.
+            adjacent windows
+    '''
+    window = datetime.timedelta(minutes=window_min)
+    stride = datetime.timedelta(minutes=stride_min or window_min)
+    midnight = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    window_start = midnight + ((start - window - midnight) // stride + 1) * stride  # first window ending after start
+    while window_start < end or (start == end and window_start <= start):
+        yield window_start, window_start + window
+        window_start += stride
+
+
+def files_to_table(file_dicts):
+    """turn a list of file dictionaries (as used by create_batch) into a columnar table of file metadata"""
+    table = pd.DataFrame.from_records(file_dicts, columns=FILE_COLUMNS)
+    if table.empty:
+        return table
+    for key in ['scan_id', 'scan_resolution']:  # keep python ints and None (e.g. halo) instead of casting to float
+        table[key] = pd.Series([file_dict[key] for file_dict in file_dicts], index=table.index, dtype=object)
+    table['file_start_time'] = pd.to_datetime(table['file_start_time'])
+    table['file_end_time'] = pd.to_datetime(table['file_end_time'])
+    table['file_length'] = (table['file_end_time'] - table['file_start_time']).dt.total_seconds()
+    table['file_mid_time'] = table['file_start_time'] + (table['file_end_time'] - table['file_start_time']) / 2
+    return table
+
+
+def plan_batches(files, single_process=False, retrieval_start_time=None, retrieval_end_time=None):
+    '''
+    Group a table of file metadata to retrieval batches in one vectorized pass
+
+    The batches are identical to the ones obtained by appending the files one by one with create_batch(), i.e. files
+    are grouped by instrument_id, scan_type and scan_id and keep the order in which they appear in the table. All
+    batches share the retrieval window of the run, splitting files to consecutive windows is done by the realtime
+    watcher (see RealTimeWatcher.add_to_batches).
+
+    Args:
+        files: pandas.DataFrame with one row per file and the columns listed in FILE_COLUMNS (see files_to_table)
+        single_process: if True, create one batch per file
+        retrieval_start_time: start of the retrieval window common to all batches
+        retrieval_end_time: end of the retrieval window common to all batches
+
+    Returns:
+        list of batch dictionaries in the format of create_batch(). The batch length only counts the time slices of the
+        files within the retrieval window
+    '''
+    if files.empty:
+        return []
+
+    files = files.copy()
+    files['retrieval_start_time'] = pd.Series([retrieval_start_time] * len(files), index=files.index, dtype=object)
+    files['retrieval_end_time'] = pd.Series([retrieval_end_time] * len(files), index=files.index, dtype=object)
+
+    # part of each file within its retrieval window
+    files['slice_start_time'] = files['file_start_time']
+    if retrieval_start_time is not None:
+        files['slice_start_time'] = files['file_start_time'].where(files['file_start_time'] > retrieval_start_time,
+                                                                   retrieval_start_time)
+    files['slice_end_time'] = files['file_end_time']
+    if retrieval_end_time is not None:
+        files['slice_end_time'] = files['file_end_time'].where(files['file_end_time'] < retrieval_end_time,
+                                                               retrieval_end_time)
+    files['slice_length'] = (files['slice_end_time'] - files['slice_start_time']).dt.total_seconds().clip(lower=0)
+
+    if single_process:  # no grouping needed, each file makes its own batch
+        first = files
+        agg = pd.DataFrame({'files': [[file] for file in files['file']],
+                            'batch_start_time': files['file_start_time'],
+                            'batch_end_time': files['file_end_time'],
+                            'batch_length_sec': files['slice_length'],
+                            'file_end_times': [[end] for end in files['file_end_time']]})
+    else:
+        grouped = files.groupby([files[key] for key in BATCH_KEYS], sort=False, dropna=False)
+        agg = grouped.agg(files=('file', list),
+                          batch_start_time=('file_start_time', 'min'),
+                          batch_end_time=('file_end_time', 'max'),
+                          batch_length_sec=('slice_length', 'sum'),
+                          file_end_times=('file_end_time', list))
+        # groups are ordered by first appearance, hence the first row of each group aligns with the aggregated rows
+        first = grouped.head(1)
+
+    batch_creation_time = datetime.datetime.now()
+    batches = []
+    for row, aggregated in zip(first.itertuples(index=False), agg.itertuples(index=False)):
+        batches.append({
+            'files': aggregated.files,
+            'instrument_id': row.instrument_id,
+            'scan_type': row.scan_type,
+            'scan_id': row.scan_id,
+            'scan_resolution': row.scan_resolution,
+            'batch_start_time': aggregated.batch_start_time,
+            'batch_end_time': aggregated.batch_end_time,
+            'batch_length_sec': aggregated.batch_length_sec,
+            'file_end_times': aggregated.file_end_times,
+            'retrieval_start_time': row.retrieval_start_time,
+            'retrieval_end_time': row.retrieval_end_time,
+            'batch_creation_time': batch_creation_time,
+        })
+    return batches
+
+
+def coalesce_windows(batches, max_windows=1, conf_key=None, stride_min=None):
+    '''
+    Group batches of consecutive retrieval windows which can be handed to a single DL toolbox invocation
+
+    Batches are coalesced if they are of the same instrument_id, scan_type, scan_id and date, if the retrieval window of
+    each starts one stride after the one of the previous batch and if their toolbox configuration is identical.
+
+    Args:
+        batches: list of batch dictionaries, with 'date' (and 'conf') assigned
+        max_windows (optional): maximum number of batches per group. Defaults to 1, i.e. no coalescing
+        conf_key (optional): function returning a comparable representation of the toolbox configuration of a batch
+            (e.g. the contents of its config file). Defaults to None, i.e. the configurations are not compared
+        stride_min (optional): time between the starts of consecutive windows in minutes (see iter_windows). Defaults
+            to None, i.e. adjacent windows, each starting where the previous one ends
+
+    Returns:
+        list of lists of batches, sorted by time within a group. Groups are ordered by their first batch in batches
+    '''
+    position = {id(batch): ind for ind, batch in enumerate(batches)}
+    groups = []
+    order = sorted(range(len(batches)), key=lambda ind: _window_sort_key(batches[ind], ind))
+    for ind in order:
+        batch = batches[ind]
+        if groups and len(groups[-1]) < max_windows and _is_next_window(groups[-1][-1], batch, conf_key, stride_min):
+            groups[-1].append(batch)
+        else:
+            groups.append([batch])
+    return sorted(groups, key=lambda group: min(position[id(batch)] for batch in group))
+
+
+def _window_sort_key(batch, ind):
+    """sort key putting consecutive windows of the same scan next to each other"""
+    if batch.get('retrieval_start_time') is None:
+        return (1, ind)
+    return (0, str(batch['instrument_id']), str(batch['scan_type']), str(batch['scan_id']),
+            pd.Timestamp(batch['retrieval_start_time']), ind)
+
+
+def _is_next_window(previous, batch, conf_key=None, stride_min=None):
+    for key in BATCH_KEYS + ['date']:
+        if previous.get(key) != batch.get(key):
+            return False
+    if previous.get('retrieval_end_time') is None or batch.get('retrieval_start_time') is None:
+        return False
+    if stride_min:
+        next_start = pd.Timestamp(previous['retrieval_start_time']) + pd.Timedelta(minutes=stride_min)
+    else:
+        next_start = pd.Timestamp(previous['retrieval_end_time'])
+    if next_start != pd.Timestamp(batch['retrieval_start_time']):
+        return False
+    return conf_key is None or conf_key(previous) == conf_key(batch)
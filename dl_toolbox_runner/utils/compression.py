@@ -0,0 +1,99 @@
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from dl_toolbox_runner.utils.input_backend import evict_lru
+
+# file extensions of compressed raw files and the matching opener for streaming decompression
+COMPRESSION_EXTS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+COMPRESSED_FILE_TYPES = (gzip.GzipFile, bz2.BZ2File, lzma.LZMAFile)
+
+
+def split_compression_ext(filename):
+    """split filename to the name without compression extension and the compression extension (None if none)"""
+    base, ext = os.path.splitext(str(filename))
+    if ext in COMPRESSION_EXTS:
+        return base, ext
+    return str(filename), None
+
+
+def strip_compression_ext(filename):
+    """filename without compression extension, e.g. xxx.hpl for xxx.hpl.gz"""
+    return split_compression_ext(filename)[0]
+
+
+def is_compressed(filename):
+    return split_compression_ext(filename)[1] is not None
+
+
+def open_raw(filename, mode='rb', fileobj=None):
+    '''
+    Open a raw data file for reading, decompressing on the fly if it has a compression extension
+
+    Args:
+        filename: path to the file. Its extension decides on the decompression
+        mode: 'rb' or 'rt'
+        fileobj (optional): already opened binary file object of filename (e.g. from an input backend) to read from
+    '''
+    ext = split_compression_ext(filename)[1]
+    if ext is None:
+        if fileobj is not None:
+            return fileobj
+        return open(filename, mode)
+    return COMPRESSION_EXTS[ext](filename if fileobj is None else fileobj, mode)
+
+
+class DecompressionCache(object):
+    """Local cache of decompressed copies of compressed raw files, e.g. for passing them to the DL toolbox
+
+    Each file is decompressed only once as long as it does not change and its copy is not evicted. Least recently
+    used copies are removed when the size of the cache exceeds max_mb, except copies used within the last keep_min
+    minutes, which batches in flight (possibly of other processes sharing the cache) may still read. Copies are written
+    to a unique temporary file first, hence concurrent writers of the same copy never see a partly written file.
+
+    Args:
+        cache_dir (optional): directory of the cache. Defaults to a directory in the system's temp dir
+        max_mb (optional): maximum size of the cache in MB. Defaults to None, i.e. unlimited
+        keep_min (optional): minutes after their last use during which copies are not evicted. Defaults to 60
+    """
+
+    def __init__(self, cache_dir=None, max_mb=None, keep_min=60):
+        if cache_dir is None:
+            cache_dir = os.path.join(tempfile.gettempdir(), 'dl_toolbox_runner_decompressed')
+        self.cache_dir = Path(cache_dir)
+        self.max_mb = max_mb
+        self.keep_min = keep_min
+
+    def path(self, filename):
+        """path to a decompressed copy of filename. Files without compression extension are returned as they are"""
+        if not is_compressed(filename):
+            return filename
+        stat = os.stat(filename)
+        key = hashlib.sha1(f'{os.path.abspath(filename)}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+        path = self.cache_dir / key / os.path.basename(strip_compression_ext(filename))
+        if path.exists():
+            os.utime(path)  # mark as recently used
+            return str(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=path.name + '.', suffix='.part', dir=path.parent)
+        try:
+            with open_raw(filename) as f_in, os.fdopen(fd, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out, length=2**20)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):  # decompression failed, e.g. corrupt archive
+                os.remove(tmp_path)
+        if self.max_mb is not None:
+            evict_lru(self.cache_dir, self.max_mb * 2**20, keep=path, min_age_sec=(self.keep_min or 0) * 60)
+        return str(path)
+
+
+def get_decompression_cache(conf):
+    """get the decompression cache configured in the main config dictionary conf"""
+    return DecompressionCache(conf.get('decompress_cache_dir'), conf.get('decompress_cache_max_mb'),
+                              conf.get('decompress_cache_keep_min', 60))
@@ -24,8 +24,13 @@ def check_conf(conf, mandatory_keys, miss_description):
 
 
 def to_abspath(conf, keys):
-    """transform paths corresponding to keys in conf dictionary to absolute paths and return conf dict"""
+    """transform paths corresponding to keys in conf dictionary to absolute paths and return conf dict
+
+    Urls (e.g. s3://bucket/prefix/ for input_dir) are left as they are
+    """
     for key in keys:
+        if '://' in str(conf[key]):
+            continue
         conf[key] = abs_file_path(conf[key])
     return conf
 
@@ -37,19 +42,38 @@ def check_ext(conf, keys):
             raise DLConfigError(f'Value of {key} in config file is not a valid file extension. Leading dot is missing.')
 
 
+def check_windows(conf):
+    """check that the retrieval window length and stride, if set, are whole numbers of minutes dividing 60
+
+    Windows are counted from midnight (see iter_windows in batch_planner), hence other values would give windows
+    shifting from hour to hour and runs not matching the rounded run times
+    """
+    for key in ['retrieval_window_min', 'retrieval_stride_min']:
+        value = conf.get(key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int) or value <= 0 or 60 % value:
+            raise DLConfigError(f'Value of {key} in config file must be a number of minutes dividing 60, but is {value}')
+
+
 def get_main_config(file):
     """get main configuration and check for completeness of config file"""
 
     mandatory_keys = ['max_age', 'output_dir', 'output_file_prefix', 'input_dir', 'input_file_prefix',
                       'toolbox_confdir', 'toolbox_conf_prefix', 'toolbox_conf_ext']
     paths = ['output_dir', 'input_dir', 'toolbox_confdir']
+    optional_paths = ['s3_cache_dir', 'decompress_cache_dir', 'toolbox_failure_log', 'halo_cache_dir',
+                      'system_data_store_dir', 'aggregate_dir', 'failure_ledger',
+                      'file_metadata_cache', 'input_staging_dir', 'archive_dir',
+                      'profile_dir', 'halo_tail_snapshot_dir']
     exts = ['toolbox_conf_ext']
 
     conf = get_conf(file)
     check_conf(conf, mandatory_keys,
                'of main config files but is missing in {}'.format(file))
     check_ext(conf, exts)
-    conf = to_abspath(conf, paths)
+    check_windows(conf)
+    conf = to_abspath(conf, paths + [key for key in optional_paths if conf.get(key) is not None])
 
     return conf
 
@@ -0,0 +1,159 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+class FailureLedger(object):
+    """Persistent record of input files and batches which failed, to skip them instead of retrying on every run
+
+    Each entry is stored under a key (the file path, or batch_key() of a batch) with the fingerprint of the input at
+    the time of the failure (see file_fingerprint), the error class and message and the number of attempts. A failed
+    key is skipped until its backoff expires or its fingerprint changes, e.g. when the file has been rewritten. The
+    backoff doubles with each attempt, from backoff_min up to max_backoff_min. Keys with at least quarantine_attempts
+    failures are reported as quarantined. The ledger is a json file, re-read and rewritten atomically under a file lock
+    on each change, such that several processes (e.g. the realtime watcher and its retrievals) can share it. Entries of
+    local files which do not exist any more and entries without failure for max_backoff_min are dropped on saving.
+
+    Args:
+        ledger_file: path to the json file of the ledger
+        backoff_min (optional): waiting time after the first failure in minutes. Defaults to 10
+        max_backoff_min (optional): maximum waiting time in minutes. Defaults to 1440 (one day)
+        quarantine_attempts (optional): number of failures from which on a key is reported as quarantined. Defaults to 5
+        clock (optional): function returning the current time in seconds since the epoch. Defaults to time.time
+    """
+
+    def __init__(self, ledger_file, backoff_min=10, max_backoff_min=1440, quarantine_attempts=5, clock=time.time):
+        self.ledger_file = ledger_file
+        self.backoff_min = backoff_min
+        self.max_backoff_min = max_backoff_min
+        self.quarantine_attempts = quarantine_attempts
+        self.clock = clock
+        self.entries = self.load()
+        self._lock = threading.Lock()  # batches may fail concurrently (see Runner.run_pipelined)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def skip(self, key, fingerprint=None):
+        """True if key failed before with the same fingerprint and its backoff has not expired yet"""
+        entry = self.entries.get(key)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        return self.clock() < entry['retry_after']
+
+    def record_failure(self, key, error, fingerprint=None):
+        """record a failure of key, error being an exception or a text. Returns the number of attempts"""
+        with self._lock, self.locked():
+            entry = self.entries.get(key)
+            attempts = 1 if entry is None or entry['fingerprint'] != fingerprint else entry['attempts'] + 1
+            backoff_min = min(self.backoff_min * 2**(attempts-1), self.max_backoff_min)
+            now = self.clock()
+            self.entries[key] = {
+                'fingerprint': fingerprint,
+                'error': type(error).__name__ if isinstance(error, BaseException) else 'Error',
+                'message': str(error)[:500],
+                'attempts': attempts,
+                'first_failure': entry['first_failure'] if attempts > 1 else now,
+                'last_failure': now,
+                'retry_after': now + backoff_min*60,
+            }
+            self.save()
+        return attempts
+
+    def record_success(self, key):
+        """forget previous failures of key"""
+        if key not in self.entries:
+            return
+        with self._lock, self.locked():
+            self.entries.pop(key, None)
+            self.save()
+
+    def quarantined(self):
+        """dictionary of the entries with at least quarantine_attempts failures"""
+        return {key: entry for key, entry in self.entries.items() if entry['attempts'] >= self.quarantine_attempts}
+
+    def report(self, all_entries=False):
+        """text report of the quarantined keys (or of all failed keys), most attempts first"""
+        entries = self.entries if all_entries else self.quarantined()
+        if not entries:
+            return 'No quarantined files or batches' if not all_entries else 'No failed files or batches'
+        lines = []
+        for key, entry in sorted(entries.items(), key=lambda item: (-item[1]['attempts'], item[0])):
+            last_failure = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['last_failure']))
+            retry_after = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['retry_after']))
+            lines.append(f"{key}: {entry['attempts']} attempts, last {last_failure}, retry after {retry_after}, "
+                         f"{entry['error']}: {entry['message']}")
+        return '\n'.join(lines)
+
+    def load(self):
+        """read the entries of the ledger from its json file"""
+        if not os.path.exists(self.ledger_file):
+            return {}
+        with open(self.ledger_file) as f:
+            return json.load(f)
+
+    @contextmanager
+    def locked(self):
+        """lock the ledger file against changes by other processes and update the entries from it"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.ledger_file)), exist_ok=True)
+        with open(self.ledger_file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.entries = self.load()
+            yield
+
+    def save(self):
+        """write the ledger to its json file, dropping entries of removed files and entries not failing any more"""
+        self.prune()
+        directory = os.path.dirname(os.path.abspath(self.ledger_file))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(self.ledger_file) + '.', suffix='.part', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.entries, f, indent=1)
+            os.chmod(tmp_file, 0o644)  # mkstemp creates it private
+            os.replace(tmp_file, self.ledger_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def prune(self):
+        """drop the entries of local files not existing any more and the entries of keys not failing for max_backoff_min"""
+        expired = self.clock() - self.max_backoff_min*60
+        self.entries = {key: entry for key, entry in self.entries.items()
+                        if entry['last_failure'] >= expired and (key.startswith('batch:') or '://' in key
+                                                                 or os.path.exists(key))}
+
+
+def file_fingerprint(path):
+    """fingerprint of a file from size and modification time, changing when the file is rewritten. None if not local"""
+    try:
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+
+def batch_key(batch):
+    """ledger key of a batch from its scan and retrieval window"""
+    return (f"batch:{batch['instrument_id']}_{batch['scan_type']}_{batch['scan_id']}_"
+            f"{batch['retrieval_start_time']}_{batch['retrieval_end_time']}")
+
+
+def batch_fingerprint(batch):
+    """fingerprint of a batch from the fingerprints of its files, changing when files are added or rewritten"""
+    files = sorted((str(file), file_fingerprint(file)) for file in batch['files'])
+    return hashlib.sha1(json.dumps(files).encode()).hexdigest()
+
+
+def get_failure_ledger(conf):
+    """get the failure ledger configured in the main config dictionary conf, None if no failure_ledger configured"""
+    if not conf.get('failure_ledger'):
+        return None
+    return FailureLedger(conf['failure_ledger'], backoff_min=conf.get('failure_backoff_min', 10),
+                         max_backoff_min=conf.get('failure_max_backoff_min', 1440),
+                         quarantine_attempts=conf.get('failure_quarantine_attempts', 5))
@@ -0,0 +1,69 @@
+import json
+import os
+import threading
+
+import pandas as pd
+
+from dl_toolbox_runner.utils.failure_ledger import file_fingerprint
+
+
+class FileMetadataCache(object):
+    """Persistent cache of the start and end time of the data in input files, to read each file only once
+
+    With overlapping retrieval windows (retrieval_window_min longer than retrieval_stride_min), consecutive runs see
+    mostly the same files. Their times are taken from this cache as long as the file did not change (see
+    file_fingerprint), such that each run only reads the files which arrived since the previous one. Files without
+    fingerprint (e.g. in object stores) are assumed not to change. The oldest entries are dropped beyond max_entries.
+
+    Args:
+        cache_file: path to the json file of the cache
+        max_entries (optional): maximum number of files in the cache. Defaults to 20000
+    """
+
+    def __init__(self, cache_file, max_entries=20000):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.entries = {}  # path -> [fingerprint, start time, end time], in order of insertion
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                self.entries = json.load(f)
+        self.dirty = False
+        self._lock = threading.Lock()  # files are read by several threads in Runner.run_pipelined
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, file):
+        """(start time, end time) of file as pandas.Timestamp, None if not cached or file changed since"""
+        entry = self.entries.get(str(file))
+        if entry is None or entry[0] != file_fingerprint(file):
+            return None
+        return pd.Timestamp(entry[1]), pd.Timestamp(entry[2])
+
+    def put(self, file, start_time, end_time):
+        with self._lock:
+            self.entries.pop(str(file), None)
+            self.entries[str(file)] = [file_fingerprint(file), pd.Timestamp(start_time).isoformat(),
+                                       pd.Timestamp(end_time).isoformat()]
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            self.dirty = True
+
+    def save(self):
+        """write the cache to its json file if it changed"""
+        with self._lock:
+            if not self.dirty:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            tmp_file = self.cache_file + '.part'
+            with open(tmp_file, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_file, self.cache_file)
+            self.dirty = False
+
+
+def get_file_metadata_cache(conf):
+    """get the file metadata cache configured in the main config dictionary conf, None if no file_metadata_cache"""
+    if not conf.get('file_metadata_cache'):
+        return None
+    return FileMetadataCache(conf['file_metadata_cache'], max_entries=conf.get('file_metadata_cache_max_entries', 20000))
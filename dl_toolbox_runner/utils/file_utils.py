@@ -1,4 +1,5 @@
 import os
+from logging import getLogger
 from pathlib import Path
 import warnings  # cannot import logger as it would create circular import with abs_file_path, hence use warnings here
 import datetime
@@ -10,6 +11,10 @@ from hpl2netCDF_client.hpl_files.hpl_files import hpl_files
 
 import dl_toolbox_runner
 from dl_toolbox_runner.errors import FilenameError
+from dl_toolbox_runner.utils.compression import COMPRESSED_FILE_TYPES, open_raw, strip_compression_ext
+
+# child of the package logger configured in dl_toolbox_runner.log (not importable here, see above)
+logger = getLogger(__name__)
 
 def abs_file_path(*file_path):
     """
@@ -66,7 +71,7 @@ def dict_to_file(data, file, sep, header=None, remove_brackets=False, remove_par
 def get_insttype(filename, base_filename='DWL_raw_XXXWL_', return_date=False):
     inst_types_exts = {'windcube': ['.nc'], 'halo': ['.hpl']}  # rely on preserved order of dict (>= python 3.6)
 
-    files = [os.path.basename(filename)]
+    files = [os.path.basename(strip_compression_ext(filename))]  # compressed files are typed by their inner extension
     # First check to avoid passing system data further:
     if os.path.splitext(files[0])[-1] in ['.csv', '.txt']:
         return 'system_data'
@@ -89,25 +94,36 @@ def get_insttype(filename, base_filename='DWL_raw_XXXWL_', return_date=False):
     msg = f'filename pattern does not correspond to any of the known instrument types ({list(inst_types_exts.keys())})'
     raise FilenameError(msg)
 
-def open_sweep_group(filename, group_name):
+def rewind(filename):
+    """seek file objects back to the start before opening them (again) with xarray. Paths are left untouched"""
+    if hasattr(filename, 'seek'):
+        filename.seek(0)
+
+
+def open_sweep_group(filename, group_name, variables=None):
     # From the Sweep group:
+    # The returned dataset is loaded to memory and the file is closed, only variables are loaded if given (e.g. ['time'])
     try: 
-        ds_sweep = xr.open_dataset(filename, group=group_name)
+        rewind(filename)
+        with xr.open_dataset(filename, group=group_name) as ds:
+            ds_sweep = (ds[variables] if variables else ds).load()
     except ValueError:
-        ds_sweep = rewrite_time_reference_units(filename, group=group_name)
+        ds_sweep = rewrite_time_reference_units(filename, group=group_name, variables=variables)
     except Exception as e:
         warnings.warn("No valid time reference found in the file")
     
     return ds_sweep
                 
-def rewrite_time_reference_units(filename, group='Sweep'):
+def rewrite_time_reference_units(filename, group='Sweep', variables=None):
     '''
     Rewrite the time reference of the dataset to the standard reference
     This is sometimes necessary as the time reference is not always correctly set, especially it seems that some files 
     have the time_reference variable in the group Sweep whereas some have it in the main group.
     '''
     # Open the ds without time decoding
-    ds_recoded = xr.open_dataset(filename, group=group, decode_times=False)
+    rewind(filename)
+    with xr.open_dataset(filename, group=group, decode_times=False) as ds:
+        ds_recoded = (ds[list(variables) + ['time_reference']] if variables else ds).load()
     
     encoding = str(ds_recoded.time_reference.data)
     new_encoding = ds_recoded.time.units.replace('time_reference', encoding)
@@ -129,7 +145,7 @@ def get_instrument_id_and_scan_type(filepath, inst_type, prefix):
         # find instrument_id, scan_type file_datetime and scan ID and resolution for a windcube file
         
         # Extract the filename from file (filepath) to avoid bug with the path (e.g. a DBS file in a VAD folder...)
-        file = os.path.basename(filepath)
+        file = os.path.basename(strip_compression_ext(filepath))
         
         file_components = file.split('_')
         resolution_part = file_components[-1].rsplit('.',1)[0]
@@ -163,7 +179,7 @@ def get_instrument_id_and_scan_type(filepath, inst_type, prefix):
     elif inst_type == 'halo':
         # find instrument_id, scan_type file_datetime and scan ID and resolution for a halo file
         # Extract the filename from file (filepath) to avoid bug with the path (e.g. a DBS file in a VAD folder...)
-        file = os.path.basename(filepath)
+        file = os.path.basename(strip_compression_ext(filepath))
         
         file_components = file.split('_')
         
@@ -186,121 +202,137 @@ def get_instrument_id_and_scan_type(filepath, inst_type, prefix):
     else:
         raise ValueError("Instrument type: "+ inst_type +" not yet supported !")
 
-def read_halo(filename):
+def read_halo(filename, cache=None):
+    '''
+    Read header and time of the rays of a HALO .hpl file
+
+    Args:
+        filename: path to the file
+        cache (optional): HaloCache (see halo_cache.py) to load the decoded file from, or to store it to after parsing.
+            Defaults to None, i.e. the file is parsed on each call
+
+    Returns:
+        header dictionary and pandas.Series of the times of the rays
+    '''
+    decoded = cache.load(filename) if cache is not None else None
+    if decoded is None:
+        decoded = parse_halo(filename)
+        if cache is not None:
+            cache.store(filename, *decoded)
+    mheader, mbeam, mdata = decoded
+    return mheader, pd.to_timedelta(pd.DataFrame(mbeam)['time'], unit = 'h') +pd.to_datetime(datetime.datetime.strptime(mheader['Start time'], '%Y%m%d %H:%M:%S.%f').date())
+
+
+def parse_halo(filename):
+    """parse a HALO .hpl file to header dictionary, beam table (time and angles per ray) and gate data per ray"""
     # This function is copy pasted from the DL_toolbox from M. Kayser
     # In principle we only need to read the header to get the information about the file and fill the config file
-    # Check if filename is a string:
-    if isinstance(filename, str):
-        filename = Path(filename)
-    if not filename.exists():
-        print("ERROR: Oops, file doesn't exist!")
-        
-    with filename.open() as infile:
-        header_info = True
-        mheader = {}
-        for line in infile:
-            if line.startswith("****"):
-                header_info = False
-                ## Adjust header in order to extract data formats more easily
-                ## 1st for 'Data line 1' , i.e. time of beam etc.
-                tmp = [x.split() for x in mheader['Data line 1'].split('  ')]
-                if len(tmp) > 3:
-                    tmp.append(" ".join([tmp[2][2],tmp[2][3]]))
-                    tmp.append(" ".join([tmp[2][4],tmp[2][5]]))
-                tmp[0] = " ".join(tmp[0])
-                tmp[1] = " ".join(tmp[1])
-                tmp[2] = " ".join([tmp[2][0],tmp[2][1]])
-                mheader['Data line 1'] = tmp
-                tmp = mheader['Data line 1 (format)'].split(',1x,')
-                tmp.append(tmp[-1])
-                tmp.append(tmp[-1])
-                mheader['Data line 1 (format)'] = tmp
-                ## Adjust header in order to extract data formats more easily
-                ## 2st for 'Data line 2' , i.e. actual data
-                tmp = [x.split() for x in mheader['Data line 2'].split('  ')]
-                tmp[0] = " ".join(tmp[0])
-                tmp[1] = " ".join(tmp[1])
-                tmp[2] = " ".join(tmp[2])
-                tmp[3] = " ".join(tmp[3])
-                mheader['Data line 2'] = tmp
-                tmp = mheader['Data line 2 (format)'].split(',1x,')
-                mheader['Data line 2 (format)'] = tmp
-                ## start counter for time and range gates
-                counter_jj = 0
-                continue # stop the loop and continue with the next line
-
-            tmp = hpl_files.switch(header_info,line)
-            ## this temporary variable indicates whether the a given data line includes
-            # the spectral width or not, so 2d information can be distinguished from
-            # 1d information.
-            indicator = len(line[:10].split())
-
-            if header_info == True:
-                try:
-                    if tmp[0][0:1] == 'i':
-                        tmp_tmp = {'Data line 2 (format)': tmp[0]}
-                    else:
-                        tmp_tmp = {tmp[0]: tmp[1]}
-                except:
-                    if tmp[0][0] == 'f':
-                        tmp_tmp = {'Data line 1 (format)': tmp[0]}
-                    else:
-                        tmp_tmp = {'blank': 'nothing'}
-                mheader.update(tmp_tmp)
-            elif (header_info == False):
-                if (counter_jj == 0):
-                    n_o_rays = (len(filename.open().read().splitlines())-17)//(int(mheader['Number of gates'])+1)
-                    mbeam = np.recarray((n_o_rays,),
-                                        dtype=np.dtype([('time', 'f8')
-                                            , ('azimuth', 'f4')
-                                            ,('elevation','f4')
-                                            ,('pitch','f4')
-                                            ,('roll','f4')]))
-                    mdata = np.recarray((n_o_rays,int(mheader['Number of gates'])),
-                                        dtype=np.dtype([('range gate', 'i2')
-                                                ,('velocity', 'f4')
-                                                ,('snrp1','f4')
-                                                ,('beta','f4')
-                                                ,('dels', 'f4')]))
-                    mdata[:, :] = np.full(mdata.shape, -999.)
-
-                # store tmp in time array
-                if  (indicator==1):
-                    dt=np.dtype([('time', 'f8'), ('azimuth', 'f4'),('elevation','f4'),('pitch','f4'),('roll','f4')])
-                    if len(tmp) < 4:
-                        tmp.extend(['-999']*2)
-                    if counter_jj < n_o_rays:
-                        mbeam[counter_jj] = np.array(tuple(tmp), dtype=dt)
-                        counter_jj = counter_jj+1
-                # store tmp in range gate array        
-                elif (indicator==2):
-                    dt=np.dtype([('range gate', 'i2')
-                                , ('velocity', 'f4')
-                                ,('snrp1','f4')
-                                ,('beta','f4')
-                                ,('dels', 'f4')])
-                    ii_index = np.array(tmp[0], dtype=dt[0])
-
-                    if (len(tmp) == 4):
-                        tmp.append('-999')
-                        mdata[counter_jj-1, ii_index] = np.array(tuple(tmp), dtype=dt)
-                    elif (len(tmp) == 5):
-                        mdata[counter_jj-1, ii_index] = np.array(tuple(tmp), dtype=dt)
-    
-    #set time information
-    time_tmp= pd.to_numeric(pd.to_timedelta(pd.DataFrame(mbeam)['time'], unit = 'h')
-                        +pd.to_datetime(datetime.datetime.strptime(mheader['Start time'], '%Y%m%d %H:%M:%S.%f').date())
-                    ).values / 10**9
-    time_ds= [ x+(datetime.timedelta(days=1)).total_seconds()
-            if time_tmp[0]-x>0 else x
-            for x in time_tmp
-            ]
-    return mheader, pd.to_timedelta(pd.DataFrame(mbeam)['time'], unit = 'h') +pd.to_datetime(datetime.datetime.strptime(mheader['Start time'], '%Y%m%d %H:%M:%S.%f').date())#, mbeam #, mdata, time_ds
+    # The file is read with a single open and sequential read (each open or stat is a round trip on network file
+    # systems), the number of lines is needed to size the arrays
+    with open_raw(filename, 'rt') as infile:  # compressed files are decompressed on the fly
+        lines = infile.read().splitlines(keepends=True)
+    header_info = True
+    mheader = {}
+    for line in lines:
+        if line.startswith("****"):
+            header_info = False
+            ## Adjust header in order to extract data formats more easily
+            ## 1st for 'Data line 1' , i.e. time of beam etc.
+            tmp = [x.split() for x in mheader['Data line 1'].split('  ')]
+            if len(tmp) > 3:
+                tmp.append(" ".join([tmp[2][2],tmp[2][3]]))
+                tmp.append(" ".join([tmp[2][4],tmp[2][5]]))
+            tmp[0] = " ".join(tmp[0])
+            tmp[1] = " ".join(tmp[1])
+            tmp[2] = " ".join([tmp[2][0],tmp[2][1]])
+            mheader['Data line 1'] = tmp
+            tmp = mheader['Data line 1 (format)'].split(',1x,')
+            tmp.append(tmp[-1])
+            tmp.append(tmp[-1])
+            mheader['Data line 1 (format)'] = tmp
+            ## Adjust header in order to extract data formats more easily
+            ## 2st for 'Data line 2' , i.e. actual data
+            tmp = [x.split() for x in mheader['Data line 2'].split('  ')]
+            tmp[0] = " ".join(tmp[0])
+            tmp[1] = " ".join(tmp[1])
+            tmp[2] = " ".join(tmp[2])
+            tmp[3] = " ".join(tmp[3])
+            mheader['Data line 2'] = tmp
+            tmp = mheader['Data line 2 (format)'].split(',1x,')
+            mheader['Data line 2 (format)'] = tmp
+            ## start counter for time and range gates
+            counter_jj = 0
+            continue # stop the loop and continue with the next line
+
+        tmp = hpl_files.switch(header_info,line)
+        ## this temporary variable indicates whether the a given data line includes
+        # the spectral width or not, so 2d information can be distinguished from
+        # 1d information.
+        indicator = len(line[:10].split())
+
+        if header_info == True:
+            try:
+                if tmp[0][0:1] == 'i':
+                    tmp_tmp = {'Data line 2 (format)': tmp[0]}
+                else:
+                    tmp_tmp = {tmp[0]: tmp[1]}
+            except:
+                if tmp[0][0] == 'f':
+                    tmp_tmp = {'Data line 1 (format)': tmp[0]}
+                else:
+                    tmp_tmp = {'blank': 'nothing'}
+            mheader.update(tmp_tmp)
+        elif (header_info == False):
+            if (counter_jj == 0):
+                n_o_rays = (len(lines)-17)//(int(mheader['Number of gates'])+1)
+                mbeam = np.recarray((n_o_rays,),
+                                    dtype=np.dtype([('time', 'f8')
+                                        , ('azimuth', 'f4')
+                                        ,('elevation','f4')
+                                        ,('pitch','f4')
+                                        ,('roll','f4')]))
+                mdata = np.recarray((n_o_rays,int(mheader['Number of gates'])),
+                                    dtype=np.dtype([('range gate', 'i2')
+                                            ,('velocity', 'f4')
+                                            ,('snrp1','f4')
+                                            ,('beta','f4')
+                                            ,('dels', 'f4')]))
+                mdata[:, :] = np.full(mdata.shape, -999.)
+
+            # store tmp in time array
+            if  (indicator==1):
+                dt=np.dtype([('time', 'f8'), ('azimuth', 'f4'),('elevation','f4'),('pitch','f4'),('roll','f4')])
+                if len(tmp) < 4:
+                    tmp.extend(['-999']*2)
+                if counter_jj < n_o_rays:
+                    mbeam[counter_jj] = np.array(tuple(tmp), dtype=dt)
+                    counter_jj = counter_jj+1
+            # store tmp in range gate array        
+            elif (indicator==2):
+                dt=np.dtype([('range gate', 'i2')
+                            , ('velocity', 'f4')
+                            ,('snrp1','f4')
+                            ,('beta','f4')
+                            ,('dels', 'f4')])
+                ii_index = np.array(tmp[0], dtype=dt[0])
+
+                if (len(tmp) == 4):
+                    tmp.append('-999')
+                    mdata[counter_jj-1, ii_index] = np.array(tuple(tmp), dtype=dt)
+                elif (len(tmp) == 5):
+                    mdata[counter_jj-1, ii_index] = np.array(tuple(tmp), dtype=dt)
+
+    return mheader, mbeam, mdata
 
 def create_batch(file_dict, retrieval_start_time, retrieval_end_time):
     ''''
     Function to create a batch from a file dictionary
+
+    The batch length only counts the time slice of the file within the retrieval window, as a file can be shared by
+    several windows. The end times of the batch files are listed in 'file_end_times' (aligned with 'files'), e.g. to
+    tell whether a file is needed by a later window (see Runner.release_inputs)
     '''
+    time_slice = file_time_slice(file_dict, retrieval_start_time, retrieval_end_time)
     batch = {
         'files': [file_dict['file']],
         'instrument_id': file_dict['instrument_id'],
@@ -309,54 +341,145 @@ def create_batch(file_dict, retrieval_start_time, retrieval_end_time):
         'scan_resolution': file_dict['scan_resolution'],
         'batch_start_time': file_dict['file_start_time'],
         'batch_end_time':  file_dict['file_end_time'],
-        'batch_length_sec':  file_dict['file_length'],
+        'batch_length_sec':  (time_slice[1] - time_slice[0]).total_seconds(),
+        'file_end_times': [file_dict['file_end_time']],
         'retrieval_start_time': retrieval_start_time,
         'retrieval_end_time': retrieval_end_time,
         'batch_creation_time': datetime.datetime.now()
     }
     return batch
 
+def add_to_batch(batch, file_dict):
+    '''
+    Function to add a file to an existing batch, counting the time slice of the file within the retrieval window only
+    '''
+    time_slice = file_time_slice(file_dict, batch['retrieval_start_time'], batch['retrieval_end_time'])
+    batch['files'].append(file_dict['file'])
+    batch['file_end_times'].append(file_dict['file_end_time'])
+    batch['batch_length_sec'] += (time_slice[1] - time_slice[0]).total_seconds()
+    batch['batch_start_time'] = min(batch['batch_start_time'], file_dict['file_start_time'])
+    batch['batch_end_time'] = max(batch['batch_end_time'], file_dict['file_end_time'])
+
+def update_in_batch(batch, file_dict):
+    '''
+    Function to update the time slice of a file already in the batch, e.g. of a growing file (see HaloTailReader)
+    '''
+    ind = batch['files'].index(file_dict['file'])
+    old_slice = file_time_slice(file_dict | {'file_end_time': batch['file_end_times'][ind]},
+                                batch['retrieval_start_time'], batch['retrieval_end_time'])
+    time_slice = file_time_slice(file_dict, batch['retrieval_start_time'], batch['retrieval_end_time'])
+    batch['file_end_times'][ind] = file_dict['file_end_time']
+    batch['batch_length_sec'] += ((time_slice[1] - time_slice[0]) - (old_slice[1] - old_slice[0])).total_seconds()
+    batch['batch_start_time'] = min(batch['batch_start_time'], file_dict['file_start_time'])
+    batch['batch_end_time'] = max(batch['batch_end_time'], file_dict['file_end_time'])
+
+def file_time_slice(file_dict, retrieval_start_time, retrieval_end_time):
+    '''
+    Function to get (start, end) of the part of a file within the retrieval window (empty if not overlapping)
+    '''
+    start = max(file_dict['file_start_time'], retrieval_start_time)
+    end = min(file_dict['file_end_time'], retrieval_end_time)
+    return start, max(start, end)
+
 def find_file_time_windcube(filename):
     '''
     Function to extract the start and end from the file content
+
+    filename can also be a binary file object (e.g. from an input backend). Only the parts holding the root and sweep
+    group metadata and the time variable are then read (requires h5netcdf).
     '''
     try:
-        ds = xr.open_dataset(filename)
+        rewind(filename)
+        with xr.open_dataset(filename) as ds:
+            group_name = str(ds.sweep_group_name.data[0])
     except:
-        print("Could not open file: "+filename)
+        logger.error(f"Could not open file: {filename}")
         return None, None
-        
-    group_name = ds.sweep_group_name.data[0]
                     
-    ds_sweep = open_sweep_group(filename, group_name)
+    ds_sweep = open_sweep_group(filename, group_name, variables=['time'])
     start_time = pd.to_datetime(ds_sweep.time.data[0])
     end_time = pd.to_datetime(ds_sweep.time.data[-1])
     return start_time, end_time
 
+def find_file_time_halo(filename, tail_bytes=2**18):
+    '''
+    Function to extract the start and end time of a HALO file from its header, first and last ray only
+
+    This gives the same times as read_halo() without parsing the gate data in between. Compressed files are read by
+    streaming decompression, for them the whole file has to be passed to find the last ray.
+
+    filename: path or binary file object (e.g. from an input backend or open_raw)
+    tail_bytes: number of bytes read at the end of the file to find the last ray. Must hold at least one full ray
+    '''
+    if hasattr(filename, 'read'):
+        infile, close = filename, False
+        rewind(infile)
+    else:
+        infile, close = open_raw(filename, 'rb'), True
+    try:
+        start_time_header = None
+        first_ray = None
+        header_info = True
+        for line in infile:
+            line = line.decode('ascii', errors='replace')
+            if header_info:
+                if line.startswith('Start time'):
+                    start_time_header = line.split(':', 1)[1].strip()
+                elif line.startswith('****'):
+                    header_info = False
+            elif len(line[:10].split()) == 1:  # same indicator for ray (time) lines as in read_halo
+                first_ray = line
+                break
+        if start_time_header is None or first_ray is None:
+            logger.error(f'Could not find header and data in HALO file: {filename}')
+            return None, None
+
+        if isinstance(infile, COMPRESSED_FILE_TYPES):  # no seeking to the end, stream through the rest of the file
+            last_ray = first_ray
+            for line in infile:
+                if len(line[:10].split()) == 1:
+                    last_ray = line.decode('ascii', errors='replace')
+        else:
+            size = infile.seek(0, os.SEEK_END)
+            infile.seek(max(size - tail_bytes, 0))
+            tail = infile.read().decode('ascii', errors='replace').splitlines()
+            last_ray = next(line for line in reversed(tail[1:]) if len(line[:10].split()) == 1)
+    except StopIteration:
+        logger.error(f'Could not find last ray within the last {tail_bytes} bytes of HALO file: {filename}')
+        return None, None
+    finally:
+        if close:
+            infile.close()
+
+    date = pd.to_datetime(datetime.datetime.strptime(start_time_header, '%Y%m%d %H:%M:%S.%f').date())
+    start_time = date + pd.to_timedelta(float(first_ray.split()[0]), unit='h')
+    end_time = date + pd.to_timedelta(float(last_ray.split()[0]), unit='h')
+    return start_time, end_time
+
 def read_system_data(filename):
     '''
     Function to read system or environmental data from E-Profile DWLs
     '''
     if not os.path.exists(filename):
-        print("File does not exist: "+filename)
+        logger.error(f"File does not exist: {filename}")
         return None
     else:
-        print("Reading file: "+filename)
-        # Check extension to define the reading method
-        if os.path.splitext(filename)[-1] == '.csv':
+        logger.debug(f"Reading file: {filename}")
+        # Check extension to define the reading method (pandas decompresses .gz/.bz2/.xz files itself)
+        if os.path.splitext(strip_compression_ext(filename))[-1] == '.csv':
             try:
                 df = pd.read_csv(filename, delimiter=';', header=None)
             except:
-                print("Could not read file: "+filename)
+                logger.error(f"Could not read file: {filename}")
                 return None
-        elif os.path.splitext(filename)[-1] == '.txt':
+        elif os.path.splitext(strip_compression_ext(filename))[-1] == '.txt':
             try:
                 df = pd.read_table(filename, header=None)
             except:
-                print("Could not read file: "+filename)
+                logger.error(f"Could not read file: {filename}")
                 return None
         else:
-            print("File extension not supported: "+filename)
+            logger.error(f"File extension not supported: {filename}")
             return None
     return df
 
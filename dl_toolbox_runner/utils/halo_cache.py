@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from dl_toolbox_runner.utils.input_backend import evict_lru
+
+HALO_CACHE_VERSION = 1  # increase when the output of parse_halo changes to invalidate existing cache entries
+HEADER_FILE = 'header.json'
+BEAM_FILE = 'beam.npy'
+DATA_FILE = 'data.npy'
+
+
+class HaloCache(object):
+    """On-disk cache of decoded HALO .hpl files, i.e. the output of parse_halo in file_utils
+
+    Each entry is a directory holding the header as json and beam table and gate data as .npy files. The arrays are
+    loaded memory-mapped, hence repeated reads of a file only cost opening the entry. Entries are keyed by path, size
+    and modification time of the raw file, so changed files are parsed again. Least recently used entries are removed
+    when the size of the cache exceeds max_mb.
+
+    Args:
+        cache_dir: directory of the cache
+        max_mb (optional): maximum size of the cache in MB. Defaults to None, i.e. unlimited
+    """
+
+    def __init__(self, cache_dir, max_mb=None):
+        self.cache_dir = Path(cache_dir)
+        self.max_mb = max_mb
+
+    def entry_dir(self, filename):
+        """directory of the cache entry of filename"""
+        stat = os.stat(filename)
+        key = f'{os.path.abspath(filename)}:{stat.st_size}:{stat.st_mtime_ns}:{HALO_CACHE_VERSION}'
+        return self.cache_dir / hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    def load(self, filename):
+        """get (header, beam, data) of filename from the cache or None if not cached"""
+        entry = self.entry_dir(filename)
+        paths = [entry / name for name in (HEADER_FILE, BEAM_FILE, DATA_FILE)]
+        try:
+            with open(paths[0]) as f:
+                mheader = json.load(f)
+            mbeam = np.load(paths[1], mmap_mode='r').view(np.recarray)
+            mdata = np.load(paths[2], mmap_mode='r').view(np.recarray)
+        except (OSError, ValueError):  # not cached, partly evicted or incomplete
+            return None
+        for path in paths:
+            os.utime(path)  # mark as recently used
+        return mheader, mbeam, mdata
+
+    def store(self, filename, mheader, mbeam, mdata):
+        """add the decoded content of filename to the cache"""
+        entry = self.entry_dir(filename)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=entry.name + '.', suffix='.part', dir=self.cache_dir))
+        with open(tmp_dir / HEADER_FILE, 'w') as f:
+            json.dump(mheader, f)
+        np.save(tmp_dir / BEAM_FILE, np.asarray(mbeam))
+        np.save(tmp_dir / DATA_FILE, np.asarray(mdata))
+        shutil.rmtree(entry, ignore_errors=True)  # remainders of a partly evicted entry
+        try:
+            os.replace(tmp_dir, entry)
+        except OSError:  # entry stored concurrently by another process
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if self.max_mb is not None:
+            evict_lru(self.cache_dir, self.max_mb * 2**20, keep=entry / DATA_FILE)
+
+
+def get_halo_cache(conf):
+    """get the HALO cache configured in the main config dictionary conf, None if no halo_cache_dir is configured"""
+    if not conf.get('halo_cache_dir'):
+        return None
+    return HaloCache(conf['halo_cache_dir'], conf.get('halo_cache_max_mb'))
@@ -0,0 +1,121 @@
+import datetime
+import os
+from logging import getLogger
+
+import pandas as pd
+
+# child of the package logger configured in dl_toolbox_runner.log (not importable here, see file_utils)
+logger = getLogger(__name__)
+
+
+class HaloTailReader(object):
+    '''
+    Read a growing HALO .hpl file incrementally, parsing only the rays appended since the previous read
+
+    HALO instruments append each ray (a time line followed by one line per range gate) to an hourly file. The reader
+    keeps the byte offset of the data consumed so far and, on each call of read_new(), reads from there on. A ray
+    counts once all its gate lines are complete, a partly written ray or line is read again on the next call. The time
+    of the rays is computed as in read_halo(). If the file shrinks (i.e. was rewritten), it is read again from the start.
+    The first ray_offset bytes of the file hold the header and the complete rays, see copy_complete_rays.
+
+    Args:
+        filename: path to the uncompressed .hpl file
+    '''
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.reset()
+
+    def reset(self):
+        self.offset = 0  # bytes of complete lines consumed
+        self.ray_offset = 0  # bytes up to the end of the last complete ray
+        self.header = None  # header dictionary, once the header is complete
+        self.date = None  # date of the file from 'Start time' in the header
+        self.n_gates = None
+        self.n_rays = 0  # number of complete rays
+        self.start_time = None  # time of the first complete ray
+        self.end_time = None  # time of the last complete ray
+        self._ray_time = None  # time of the ray whose gate lines are being read
+        self._gates_missing = 0
+
+    def read_new(self):
+        '''
+        Parse the rays appended since the previous call
+
+        Returns:
+            list of the times (pandas.Timestamp) of the rays completed since the previous call, empty if none
+        '''
+        try:
+            size = os.path.getsize(self.filename)
+        except OSError:
+            return []
+        if size < self.offset:
+            logger.info(f'{self.filename} shrank, reading it again from the start')
+            self.reset()
+        if size == self.offset:
+            return []
+        with open(self.filename, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        end = data.rfind(b'\n') + 1  # only complete lines, the rest is read again next time
+        if end == 0:
+            return []
+        raw_lines = data[:end].split(b'\n')[:-1]
+        lines = [raw.decode('ascii', errors='replace').rstrip('\r') for raw in raw_lines]
+        start = 0
+        if self.header is None:
+            separator = next((ind for ind, line in enumerate(lines) if line.startswith('****')), None)
+            if separator is None:
+                return []  # header not complete yet
+            self.parse_header(lines[:separator])
+            start = separator + 1
+        line_end = self.offset + sum(len(raw) + 1 for raw in raw_lines[:start])  # end of the header, if just read
+        if start:
+            self.ray_offset = line_end
+        self.offset += end
+
+        times = []
+        for raw, line in zip(raw_lines[start:], lines[start:]):
+            line_end += len(raw) + 1
+            if len(line[:10].split()) == 1:  # ray (time) line, same indicator as in parse_halo
+                self._ray_time = self.date + pd.to_timedelta(float(line.split()[0]), unit='h')
+                self._gates_missing = self.n_gates
+            elif self._ray_time is not None and line.strip():
+                self._gates_missing -= 1
+            if self._ray_time is not None and self._gates_missing == 0:
+                times.append(self._ray_time)
+                self._ray_time = None
+                self.ray_offset = line_end
+        if times:
+            self.start_time = times[0] if self.start_time is None else self.start_time
+            self.end_time = times[-1]
+            self.n_rays += len(times)
+        return times
+
+    def copy_complete_rays(self, directory):
+        '''
+        Copy header and complete rays read so far to a file of the same name in directory, e.g. for handing a file still
+        being written to the DL toolbox. Rays appended meanwhile and partly written rays are left out
+
+        Returns:
+            path of the copy
+        '''
+        copy = os.path.join(directory, os.path.basename(self.filename))
+        remaining = self.ray_offset
+        with open(self.filename, 'rb') as src, open(copy, 'wb') as dst:
+            while remaining > 0:
+                chunk = src.read(min(remaining, 2**20))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                remaining -= len(chunk)
+        return copy
+
+    def parse_header(self, lines):
+        self.header = {}
+        for line in lines:
+            key, sep, value = line.partition(':')
+            if sep:
+                self.header[key.strip()] = value.strip()
+        self.n_gates = int(self.header['Number of gates'])
+        self.date = pd.to_datetime(datetime.datetime.strptime(self.header['Start time'], '%Y%m%d %H:%M:%S.%f').date())
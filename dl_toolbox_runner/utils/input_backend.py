@@ -0,0 +1,384 @@
+import fnmatch
+import glob
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from dl_toolbox_runner.errors import DLConfigError, DLFileError
+
+S3_SCHEME = 's3://'
+
+
+class LocalBackend(object):
+    """Input backend for files on a local (POSIX) file system. All paths are returned as they are"""
+
+    is_remote = False
+
+    def list_files(self, directory, pattern):
+        """list files in directory matching the glob pattern"""
+        return glob.glob(os.path.join(directory, pattern))
+
+    def open(self, path):
+        """open file for binary reading"""
+        return open(path, 'rb')
+
+    def read_range(self, path, start, length):
+        """read length bytes starting at byte start of the file"""
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return f.read(length)
+
+    def size(self, path):
+        return os.path.getsize(path)
+
+    def local_path(self, path):
+        """return a path to the file which can be passed to readers and the DL toolbox"""
+        return path
+
+    def release(self, path):
+        """tell that the local path of a file is not needed any more, e.g. once its retrieval windows are done"""
+        pass
+
+
+class StagingBackend(LocalBackend):
+    '''
+    Input backend for files on a network file system (e.g. NFS), which are copied once to a local staging directory
+
+    Directories are listed in bulk with os.scandir. Each file is copied to staging_dir on its first use with large
+    sequential reads, from where readers and the DL toolbox then work on the local copy. Staged copies are used as long
+    as size and modification time of the original (as of staging) are unchanged, and are removed by release() once
+    their windows are done. The modification time of a copy is that of its staging or last use, if staging_max_mb is
+    exceeded the least recently used copies are removed as well. Copies staged by a previous process are staged again.
+
+    Args:
+        input_dir: directory of the input files on the network file system, files are staged below staging_dir with
+            their path relative to it
+        staging_dir: local directory for the staged copies
+        buffer_size (optional): number of bytes per read when copying. Defaults to 8 MiB
+        staging_max_mb (optional): maximum size of the staging directory in MB. Defaults to None, i.e. unlimited
+    '''
+
+    def __init__(self, input_dir, staging_dir, buffer_size=2**23, staging_max_mb=None):
+        self.input_dir = os.path.abspath(input_dir)
+        self.staging_dir = Path(staging_dir)
+        self.buffer_size = buffer_size
+        self.staging_max_mb = staging_max_mb
+        self._stats = {}  # (size, mtime_ns) of the originals known from listing
+        self._staged = {}  # staged path -> (size, mtime_ns) of the original when it was staged
+
+    def list_files(self, directory, pattern):
+        """list files in directory matching the glob pattern, with one bulk directory listing"""
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if fnmatch.fnmatch(entry.name, pattern) and entry.is_file():
+                    stat = entry.stat()
+                    path = os.path.join(directory, entry.name)
+                    self._stats[path] = (stat.st_size, stat.st_mtime_ns)
+                    files.append(path)
+        return files
+
+    def staged_path(self, path):
+        """path of the staged copy of path"""
+        relative = os.path.relpath(os.path.abspath(path), self.input_dir)
+        if relative.startswith(os.pardir):  # outside of input_dir
+            relative = os.path.join('_other', hashlib.sha1(os.path.dirname(os.path.abspath(path)).encode()).hexdigest()[:12],
+                                    os.path.basename(path))
+        return self.staging_dir / relative
+
+    def local_path(self, path):
+        """return path to the staged copy of the file, copying it to the staging directory if not there yet"""
+        if self.is_staged(path):
+            return str(path)
+        staged = self.staged_path(path)
+        size, mtime_ns = self._stats.get(str(path)) or _stat(path)
+        if self._staged.get(str(staged)) == (size, mtime_ns):
+            try:
+                os.utime(staged)  # used, for evicting the least recently used copies
+                return str(staged)
+            except FileNotFoundError:  # evicted or released meanwhile
+                pass
+        staged.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=staged.name + '.', suffix='.part', dir=staged.parent)
+        try:
+            with open(path, 'rb', buffering=0) as src, os.fdopen(fd, 'wb') as dst:
+                shutil.copyfileobj(src, dst, length=self.buffer_size)
+            os.replace(tmp_path, staged)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._staged[str(staged)] = (size, mtime_ns)
+        if self.staging_max_mb is not None:
+            evict_lru(self.staging_dir, self.staging_max_mb * 2**20, keep=staged)
+        return str(staged)
+
+    def is_staged(self, path):
+        """True if path is within the staging directory"""
+        return Path(os.path.abspath(path)).is_relative_to(self.staging_dir.absolute())
+
+    def release(self, path):
+        """remove the staged copy path (or the staged copy of the original path)"""
+        staged = Path(path) if self.is_staged(path) else self.staged_path(path)
+        self._staged.pop(str(staged), None)
+        try:
+            staged.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class RangedFile(io.RawIOBase):
+    """Seekable read-only file object fetching the requested bytes of an object with ranged reads only
+
+    Bytes are fetched in aligned blocks of block_size, of which the most recently used are kept in memory. Readers
+    jumping around in the file (e.g. HDF5) hence do not fetch the same part of the file several times.
+
+    Args:
+        backend: backend providing read_range() and size()
+        path: path or url of the object in the backend
+        block_size (optional): number of bytes fetched per ranged request. Defaults to 64 KiB
+        max_blocks (optional): number of blocks kept in memory. Defaults to 64
+    """
+
+    def __init__(self, backend, path, block_size=2**16, max_blocks=64):
+        super().__init__()
+        self.backend = backend
+        self.path = path
+        self.name = path
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self._size = backend.size(path)
+        self._pos = 0
+        self._blocks = OrderedDict()  # block index -> bytes, ordered from least to most recently used
+
+    def _block(self, index):
+        if index in self._blocks:
+            self._blocks.move_to_end(index)
+        else:
+            start = index * self.block_size
+            self._blocks[index] = self.backend.read_range(self.path, start, min(self.block_size, self._size - start))
+            if len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+        return self._blocks[index]
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self._size + offset
+        else:
+            raise ValueError(f'invalid whence ({whence})')
+        return self._pos
+
+    def readinto(self, b):
+        length = min(len(b), self._size - self._pos)
+        if length <= 0:
+            return 0
+        n_read = 0
+        while n_read < length:
+            index, offset = divmod(self._pos, self.block_size)
+            data = self._block(index)[offset:offset + length - n_read]
+            b[n_read:n_read + len(data)] = data
+            n_read += len(data)
+            self._pos += len(data)
+        return n_read
+
+
+class S3Backend(object):
+    """Input backend for an S3-compatible object store. Paths are urls of the form s3://bucket/key
+
+    Metadata can be read with ranged requests through open(), while local_path() downloads the full object once to a
+    local read-through cache from where it can be passed to the DL toolbox. The ETag of each cached copy is kept next
+    to it (<copy>.etag), such that objects rewritten in the store (even with the same size) are downloaded again.
+
+    Args:
+        cache_dir: local directory for the read-through cache
+        endpoint_url (optional): url of the S3-compatible service. Defaults to None, i.e. AWS
+        max_pool_connections (optional): size of the connection pool shared by all requests. Defaults to 10
+        block_size (optional): number of bytes fetched per ranged request. Defaults to 64 KiB
+        cache_max_mb (optional): maximum size of the read-through cache in MB. Least recently used files are removed
+            when exceeded. Defaults to None, i.e. unlimited
+        client (optional): boto3 S3 client to use instead of creating a new one
+    """
+
+    is_remote = True
+
+    def __init__(self, cache_dir, endpoint_url=None, max_pool_connections=10, block_size=2**16, cache_max_mb=None,
+                 client=None):
+        if client is None:
+            try:
+                import boto3
+                from botocore.config import Config
+            except ImportError:
+                raise DLConfigError('reading input from S3 requires the boto3 package to be installed')
+            client = boto3.client('s3', endpoint_url=endpoint_url,
+                                  config=Config(max_pool_connections=max_pool_connections))
+        self.client = client
+        self.cache_dir = Path(cache_dir)
+        self.block_size = block_size
+        self.cache_max_mb = cache_max_mb
+        self._sizes = {}  # object sizes known from listing or previous requests
+        self._etags = {}  # object ETags known from listing or previous requests
+
+    @staticmethod
+    def split_url(url):
+        """split an url s3://bucket/key to bucket and key"""
+        if not url.startswith(S3_SCHEME):
+            raise DLFileError(f'{url} is not an url of the form {S3_SCHEME}bucket/key')
+        bucket, _, key = url[len(S3_SCHEME):].partition('/')
+        return bucket, key
+
+    def list_files(self, directory, pattern):
+        """list objects below url directory with a name matching the glob pattern"""
+        bucket, prefix = self.split_url(directory.rstrip('/') + '/')
+        literal = pattern.split('*')[0].split('?')[0].split('[')[0]  # restrict listing to the literal start of pattern
+        paginator = self.client.get_paginator('list_objects_v2')
+        files = []
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix + literal, Delimiter='/'):
+            for obj in page.get('Contents', []):
+                if fnmatch.fnmatchcase(obj['Key'][len(prefix):], pattern):
+                    url = f"{S3_SCHEME}{bucket}/{obj['Key']}"
+                    self._sizes[url] = obj['Size']
+                    self._etags[url] = obj['ETag']
+                    files.append(url)
+        return files
+
+    def size(self, url):
+        if url not in self._sizes:
+            self._head(url)
+        return self._sizes[url]
+
+    def etag(self, url):
+        if url not in self._etags:
+            self._head(url)
+        return self._etags[url]
+
+    def _head(self, url):
+        bucket, key = self.split_url(url)
+        response = self.client.head_object(Bucket=bucket, Key=key)
+        self._sizes[url] = response['ContentLength']
+        self._etags[url] = response['ETag']
+
+    def read_range(self, url, start, length):
+        """read length bytes starting at byte start of the object with a single ranged request"""
+        bucket, key = self.split_url(url)
+        response = self.client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{start + length - 1}')
+        return response['Body'].read()
+
+    def open(self, url):
+        """open object for binary reading. Only the parts actually read are fetched"""
+        return io.BufferedReader(RangedFile(self, url, block_size=self.block_size))
+
+    def local_path(self, url):
+        """return path to a local copy of the object, downloading it to the cache if not there yet"""
+        bucket, key = self.split_url(url)
+        path = self.cache_dir / bucket / key
+        etag_path = path.with_name(path.name + '.etag')
+        if path.exists() and etag_path.exists() and etag_path.read_text() == self.etag(url):
+            os.utime(path)  # mark as recently used
+            return str(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # unique temporary names, as several retrieval processes may download the same object concurrently
+        response = self.client.get_object(Bucket=bucket, Key=key)
+        fd, tmp_path = tempfile.mkstemp(prefix=path.name + '.', suffix='.part', dir=path.parent)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(response['Body'], f, length=self.block_size)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        fd, tmp_path = tempfile.mkstemp(prefix=etag_path.name + '.', suffix='.part', dir=path.parent)
+        with os.fdopen(fd, 'w') as f:
+            f.write(response['ETag'])
+        os.replace(tmp_path, etag_path)
+        self._sizes[url] = path.stat().st_size
+        self._etags[url] = response['ETag']
+        if self.cache_max_mb is not None:
+            evict_lru(self.cache_dir, self.cache_max_mb * 2**20, keep=path)
+        return str(path)
+
+    def release(self, path):
+        """local copies stay in the read-through cache, which is limited by cache_max_mb"""
+        pass
+
+
+def evict_lru(directory, max_bytes, keep=None, min_age_sec=None):
+    """remove least recently used (by mtime) files below directory until their total size is below max_bytes
+
+    Files and directories being written (.part) are left alone, files removed or renamed concurrently by other threads
+    or processes sharing the cache are skipped. keep is a path or a collection of paths not to remove. Files used within
+    the last min_age_sec seconds (e.g. by batches in flight) are not removed either, even if the size stays above
+    max_bytes
+    """
+    if keep is None:
+        keep = set()
+    elif isinstance(keep, (str, os.PathLike)):
+        keep = {Path(keep)}
+    else:
+        keep = {Path(path) for path in keep}
+    now = time.time()
+    stats = {}
+    for root, dirs, names in os.walk(directory):  # unlike rglob, os.walk skips directories vanishing meanwhile
+        dirs[:] = [name for name in dirs if not name.endswith('.part')]
+        for name in names:
+            if name.endswith('.part'):
+                continue
+            path = Path(root) / name
+            try:
+                stats[path] = path.stat()
+            except FileNotFoundError:
+                pass
+    total = sum(s.st_size for s in stats.values())
+    for path in sorted(stats, key=lambda p: stats[p].st_mtime):
+        if total <= max_bytes:
+            break
+        if path in keep or (min_age_sec and now - stats[path].st_mtime < min_age_sec):
+            continue
+        path.unlink(missing_ok=True)
+        total -= stats[path].st_size
+        try:
+            if path.parent != Path(directory) and not any(path.parent.iterdir()):
+                path.parent.rmdir()
+        except OSError:  # removed meanwhile or refilled by a concurrent store
+            pass
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def is_url(path):
+    """True if path is an url of a remote backend rather than a local path"""
+    return str(path).startswith(S3_SCHEME)
+
+
+def get_input_backend(conf):
+    """get the input backend matching the input_dir of the main config dictionary conf"""
+    if is_url(conf['input_dir']):
+        if 's3_cache_dir' not in conf:
+            raise DLConfigError("'s3_cache_dir' is a mandatory key of the main config if 'input_dir' is on S3")
+        return S3Backend(conf['s3_cache_dir'], endpoint_url=conf.get('s3_endpoint_url'),
+                         max_pool_connections=conf.get('s3_max_pool_connections', 10),
+                         cache_max_mb=conf.get('s3_cache_max_mb'))
+    if conf.get('input_staging_dir'):
+        return StagingBackend(conf['input_dir'], conf['input_staging_dir'],
+                              buffer_size=int(conf.get('input_staging_buffer_mb', 8) * 2**20),
+                              staging_max_mb=conf.get('input_staging_max_mb'))
+    return LocalBackend()
@@ -0,0 +1,91 @@
+import datetime
+import os
+import re
+import shutil
+from logging import getLogger
+
+import pandas as pd
+
+# child of the package logger configured in dl_toolbox_runner.log (not importable here, see file_utils)
+logger = getLogger(__name__)
+
+
+def partition_dir(base_dir, scheme, instrument_id, date, create=False):
+    '''
+    Directory below base_dir for files of instrument_id and date according to the partitioning scheme
+
+    Args:
+        base_dir: root directory, e.g. output_dir or toolbox_confdir of the main config
+        scheme: partitioning scheme with the fields {instrument_id}, {YYYY}, {MM}, {DD} and {HH}, e.g.
+            '{instrument_id}/{YYYY}/{MM}/{DD}'. None or empty for a flat layout, i.e. base_dir itself
+        instrument_id: instrument id, e.g. 'PAYWL'
+        date: datetime or pandas.Timestamp of the files
+        create (optional): create the directory if missing. Defaults to False
+
+    Returns:
+        path of the directory as str
+    '''
+    if not scheme:
+        directory = str(base_dir)
+    else:
+        date = pd.Timestamp(date)
+        directory = os.path.join(str(base_dir), scheme.format(instrument_id=instrument_id, YYYY=f'{date.year:04d}',
+                                                              MM=f'{date.month:02d}', DD=f'{date.day:02d}',
+                                                              HH=f'{date.hour:02d}'))
+    if create:
+        os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def output_file_key(filename, prefix):
+    """(instrument_id, date) from the name of an L2 output file <prefix><instrument_id>_<YYYYmmdd[HHMM]>.nc, else None"""
+    match = re.match(re.escape(prefix) + r'(?P<instrument_id>[A-Za-z0-9]{5})_(?P<date>\d{8})(?P<time>\d{4})?\d*\.nc$',
+                     os.path.basename(filename))
+    if match is None:
+        return None
+    return match['instrument_id'], pd.Timestamp(match['date'] + (match['time'] or '0000'))
+
+
+def toolbox_conf_key(filename):
+    """(instrument_id, date) of a toolbox config file from its NC_instrument_id entry and modification time, else None"""
+    try:
+        with open(filename) as f:
+            match = re.search(r'^NC_instrument_id\W+(?P<instrument_id>[A-Za-z0-9]{5})\b', f.read(), re.MULTILINE)
+    except (OSError, UnicodeDecodeError):
+        return None
+    if match is None:
+        return None
+    return match['instrument_id'], datetime.datetime.fromtimestamp(os.path.getmtime(filename))
+
+
+def migrate_layout(directory, scheme, file_key, dry_run=False):
+    '''
+    Move the files directly in a flat directory to their partitions of scheme (see partition_dir)
+
+    Files already in subdirectories are left as they are, such that the migration can be repeated or interrupted.
+
+    Args:
+        directory: flat directory, e.g. output_dir of the main config
+        scheme: partitioning scheme, e.g. '{instrument_id}/{YYYY}/{MM}/{DD}'
+        file_key: function returning (instrument_id, date) of a file path, or None for files not to be moved
+        dry_run (optional): only log the moves. Defaults to False
+
+    Returns:
+        number of files moved
+    '''
+    if not scheme:
+        return 0
+    n_moved = 0
+    with os.scandir(directory) as entries:
+        files = [entry.path for entry in entries if entry.is_file() and not entry.name.startswith('.')]
+    for file in sorted(files):
+        key = file_key(file)
+        if key is None:
+            logger.warning(f'Cannot tell instrument and date of {file}, left in place')
+            continue
+        target_dir = partition_dir(directory, scheme, *key, create=not dry_run)
+        logger.info(f'Moving {file} to {target_dir}')
+        if not dry_run:
+            shutil.move(file, os.path.join(target_dir, os.path.basename(file)))
+        n_moved += 1
+    return n_moved
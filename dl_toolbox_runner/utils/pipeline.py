@@ -0,0 +1,89 @@
+import threading
+from queue import Queue
+
+_DONE = object()  # sentinel telling a worker that no more items will come
+
+
+class StagedExecutor(object):
+    """Pass items through a sequence of stages running concurrently, each with its own workers and bounded queue
+
+    Each stage function takes one item and returns an iterable of items for the next stage (empty to drop the item,
+    several items to fan out). Items leave a stage as soon as they are processed, hence later stages start working
+    before earlier stages have finished all items. Bounded queues make fast stages wait for slow ones instead of piling
+    up items in memory.
+
+    Args:
+        stages: list of tuples (name, function, number of worker threads)
+        queue_size (optional): maximum number of items waiting in front of each stage. Defaults to 8
+        on_error (optional): function called as on_error(stage_name, item, exception) if a stage function raises. The
+            item is dropped and processing continues. Defaults to None, i.e. errors are re-raised at the end of run().
+            Exceptions raised by on_error itself and other BaseExceptions stop the processing of further items and are
+            re-raised at the end of run()
+    """
+
+    def __init__(self, stages, queue_size=8, on_error=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.on_error = on_error
+
+    def run(self, items):
+        """process all items through all stages and return the list of items output by the last stage"""
+        queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = []
+        errors = []
+        lock = threading.Lock()
+        running = [n_workers for _, _, n_workers in self.stages]  # workers still running per stage
+        aborted = threading.Event()
+
+        def put_next(ind, item):
+            if ind + 1 < len(self.stages):
+                queues[ind + 1].put(item)
+            else:
+                with lock:
+                    results.append(item)
+
+        def work(ind):
+            name, func, _ = self.stages[ind]
+            try:
+                while True:
+                    item = queues[ind].get()
+                    if item is _DONE:
+                        break
+                    if aborted.is_set():  # only drain the queue, such that earlier stages do not block
+                        continue
+                    try:
+                        try:
+                            for out in func(item):
+                                put_next(ind, out)
+                        except Exception as err:
+                            if self.on_error is None:
+                                with lock:
+                                    errors.append(err)
+                            else:
+                                self.on_error(name, item, err)
+                    except BaseException as err:  # raised by on_error or not an Exception, stop processing items
+                        with lock:
+                            errors.append(err)
+                        aborted.set()
+            finally:
+                with lock:
+                    running[ind] -= 1
+                    last_worker = running[ind] == 0
+                if last_worker and ind + 1 < len(self.stages):  # stage finished, let workers of next stage stop
+                    for _ in range(self.stages[ind + 1][2]):
+                        queues[ind + 1].put(_DONE)
+
+        threads = [threading.Thread(target=work, args=(ind,), name=f'{self.stages[ind][0]}_{n}', daemon=True)
+                   for ind in range(len(self.stages)) for n in range(self.stages[ind][2])]
+        for thread in threads:
+            thread.start()
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0][2]):
+            queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return results
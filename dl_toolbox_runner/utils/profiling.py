@@ -0,0 +1,153 @@
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from logging import getLogger
+
+from dl_toolbox_runner.errors import DLConfigError
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+
+# child of the package logger configured in dl_toolbox_runner.log (not importable here, see file_utils)
+logger = getLogger(__name__)
+
+MODES = ['cprofile', 'sampling', 'tracemalloc']
+STAGES = ['ingest', 'read', 'configure', 'toolbox']
+
+
+class Profiler(object):
+    '''
+    Profile selected stages of the processing and write one profile file per profiled batch or file
+
+    A stage is profiled with probability sample_rate, such that profiling can stay enabled in production at low
+    overhead. Profiles nested in another profile of the same thread (e.g. reading a file while ingesting it in the
+    watcher) are skipped, as are tracemalloc profiles while another one is running, tracemalloc being process wide.
+    Profile files are named <stage>_<name>_<time>.<ext> in profile_dir, name being the batch id or file name.
+
+    Modes:
+        cprofile: deterministic profile of the calls, written as .prof (read with pstats or e.g. snakeviz) and as .txt
+            with the top functions by cumulative time
+        sampling: statistical profile with pyinstrument (to be installed), written as .txt. Lower overhead than cprofile
+        tracemalloc: memory allocated during the stage and not freed at its end, by line, written as .txt
+
+    Args:
+        profile_dir: directory for the profile files
+        mode (optional): one of MODES. Defaults to 'cprofile'
+        stages (optional): stages to profile, subset of STAGES. Defaults to None, i.e. all
+        sample_rate (optional): fraction of the batches or files to profile. Defaults to 1, i.e. all
+        top (optional): number of functions or lines in the text reports. Defaults to 30
+        interval_ms (optional): sampling interval of the sampling mode in milliseconds. Defaults to 1
+        rng (optional): function returning a random number in [0, 1). Defaults to random.random
+    '''
+
+    def __init__(self, profile_dir, mode='cprofile', stages=None, sample_rate=1, top=30, interval_ms=1,
+                 rng=random.random):
+        if mode not in MODES:
+            raise DLConfigError(f"unknown profile mode '{mode}', known are: {', '.join(MODES)}")
+        unknown = set(stages or []) - set(STAGES)
+        if unknown:
+            raise DLConfigError(f"unknown profile stages {', '.join(sorted(unknown))}, known are: {', '.join(STAGES)}")
+        if mode == 'sampling':
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                raise DLConfigError("profile mode 'sampling' requires the pyinstrument package to be installed")
+        self.profile_dir = str(profile_dir)
+        self.mode = mode
+        self.stages = set(stages or STAGES)
+        self.sample_rate = sample_rate
+        self.top = top
+        self.interval_ms = interval_ms
+        self.rng = rng
+        self._active = threading.local()  # profile running in the current thread
+        self._tracemalloc_lock = threading.Lock()
+
+    def selected(self, stage):
+        """True if this run of stage is to be profiled"""
+        return stage in self.stages and self.rng() < self.sample_rate
+
+    @contextmanager
+    def profile(self, stage, name):
+        """profile the code run within the context as stage, writing the profile file for name at its end"""
+        if getattr(self._active, 'stage', None) is not None or not self.selected(stage):
+            yield
+            return
+        if self.mode == 'tracemalloc' and not self._tracemalloc_lock.acquire(blocking=False):
+            yield
+            return
+        self._active.stage = stage
+        try:
+            with getattr(self, '_profile_' + self.mode)(self.profile_path(stage, name)):
+                yield
+        finally:
+            self._active.stage = None
+            if self.mode == 'tracemalloc':
+                self._tracemalloc_lock.release()
+
+    def profile_path(self, stage, name):
+        """path of the profile file for stage and name, without extension"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = re.sub(r'[^\w.-]', '_', str(name))
+        return os.path.join(self.profile_dir, f"{stage}_{name}_{datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')}")
+
+    @contextmanager
+    def _profile_cprofile(self, path):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path + '.prof')
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(self.top)
+            self._write(path + '.txt', report.getvalue())
+
+    @contextmanager
+    def _profile_sampling(self, path):
+        from pyinstrument import Profiler as SamplingProfiler
+        profiler = SamplingProfiler(interval=self.interval_ms / 1000, async_mode='disabled')
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            self._write(path + '.txt', profiler.output_text())
+
+    @contextmanager
+    def _profile_tracemalloc(self, path):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if started:
+                tracemalloc.stop()
+            stats = after.compare_to(before, 'lineno')
+            lines = [f'Peak traced memory: {peak / 2**20:.1f} MB', f'Top {self.top} lines by allocated size:']
+            lines += [str(stat) for stat in stats[:self.top]]
+            self._write(path + '.txt', '\n'.join(lines) + '\n')
+
+    @staticmethod
+    def _write(path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+        logger.info(f'Wrote profile {path}')
+
+
+def get_profiler(conf):
+    """get the profiler configured in the main config dictionary conf, None if no profile_mode configured"""
+    if not conf.get('profile_mode'):
+        return None
+    return Profiler(conf.get('profile_dir') or abs_file_path('dl_toolbox_runner/logs/profiles'), mode=conf['profile_mode'],
+                    stages=conf.get('profile_stages'), sample_rate=conf.get('profile_sample_rate', 1),
+                    top=conf.get('profile_top', 30), interval_ms=conf.get('profile_interval_ms', 1))
@@ -0,0 +1,94 @@
+import fnmatch
+import os
+import threading
+import time
+
+# names of files which are still being written and get renamed once complete: rsync (.name.XXXXXX), scp/WinSCP
+# (.filepart), browsers and custom uploaders (.part, .tmp, .partial)
+TEMP_PATTERNS = ['.*', '*.part', '*.partial', '*.tmp', '*.filepart', '*~']
+
+
+def is_temp_name(path, temp_patterns=None):
+    """True if the file name of path matches one of temp_patterns (default TEMP_PATTERNS)"""
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(name, pattern) for pattern in (TEMP_PATTERNS if temp_patterns is None else temp_patterns))
+
+
+class ReadinessTracker(object):
+    """Collect file system events and tell which files are completely written and can be read
+
+    A file is ready once no event was seen for it during settle_sec and its size and modification time did not change
+    in between. Files with temporary names (see TEMP_PATTERNS) are never ready by themselves. When renamed from a
+    temporary to a final name, the writer has finished and the file is ready immediately. Each ready file is returned
+    once by ready(), it is tracked again on a later event.
+
+    Args:
+        settle_sec (optional): time in seconds without events and changes for a file to be ready. Defaults to 5
+        temp_patterns (optional): fnmatch patterns of temporary file names. Defaults to TEMP_PATTERNS
+        clock (optional): function returning the current time in seconds. Defaults to time.monotonic
+    """
+
+    def __init__(self, settle_sec=5, temp_patterns=None, clock=time.monotonic):
+        self.settle_sec = settle_sec
+        self.temp_patterns = TEMP_PATTERNS if temp_patterns is None else temp_patterns
+        self.clock = clock
+        self._pending = {}  # path -> (size, mtime_ns, time of last event or change)
+        self._lock = threading.Lock()  # events come from the observer thread, ready() is called from another thread
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._pending
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def touch(self, path):
+        """register a created or modified file. Temporary names are ignored"""
+        if is_temp_name(path, self.temp_patterns):
+            return
+        stat = _stat(path)
+        with self._lock:
+            self._pending[path] = stat + (self.clock(),)
+
+    def moved(self, src_path, dest_path):
+        """register a renamed file. A rename from a temporary name makes the file ready without waiting"""
+        with self._lock:
+            self._pending.pop(src_path, None)
+        if is_temp_name(dest_path, self.temp_patterns):
+            return
+        if is_temp_name(src_path, self.temp_patterns):
+            with self._lock:
+                self._pending[dest_path] = _stat(dest_path) + (self.clock() - self.settle_sec,)
+        else:
+            self.touch(dest_path)
+
+    def discard(self, path):
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def ready(self):
+        """return the files which are ready and stop tracking them. Files that disappeared are dropped"""
+        now = self.clock()
+        ready = []
+        with self._lock:
+            for path, (size, mtime, last_change) in list(self._pending.items()):
+                if now - last_change < self.settle_sec:
+                    continue
+                stat = _stat(path)
+                if stat == (None, None):
+                    del self._pending[path]
+                elif stat != (size, mtime):  # written without event (e.g. on network file systems), wait again
+                    self._pending[path] = stat + (now,)
+                else:
+                    del self._pending[path]
+                    ready.append(path)
+        return sorted(ready)
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import resource
+import threading
+import time
+import traceback
+
+# exit codes of processes started by run_with_limits
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_MEMORY = 3
+
+
+def process_rss(pid=None):
+    """resident set size of process pid (default: this process) in bytes. None if not available (non-Linux)"""
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def open_fds():
+    """number of open file descriptors of this process. None if not available (non-Linux)"""
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def resource_usage():
+    """resources held by this process, for spotting leaks in long-running processes (e.g. the realtime watcher)
+
+    Returns:
+        dictionary with number of open file descriptors ('open_fds'), resident memory in MB ('rss_mb'), number of files
+        held open in the file cache of xarray ('cached_datasets') and number of threads ('threads')
+    """
+    from xarray.backends.file_manager import FILE_CACHE
+
+    rss = process_rss()
+    return {'open_fds': open_fds(),
+            'rss_mb': None if rss is None else round(rss / 2**20, 1),
+            'cached_datasets': len(FILE_CACHE),
+            'threads': threading.active_count()}
+
+
+# maximum length of the error text sent back by the child, small enough to never fill the pipe
+MAX_ERROR_CHARS = 8000
+
+
+def _run_limited_child(func, args, max_address_space_mb, conn):
+    if max_address_space_mb:
+        limit = int(max_address_space_mb * 2**20)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        func(*args)
+    except MemoryError as exc:
+        _send_error(conn, exc)
+        os._exit(EXIT_MEMORY)
+    except BaseException as exc:
+        _send_error(conn, exc)
+        os._exit(EXIT_ERROR)
+    os._exit(EXIT_OK)
+
+
+def _send_error(conn, exc):
+    """send repr and traceback of exc to the parent, which logs them and raises them with the run status"""
+    try:
+        conn.send((repr(exc) + '\n' + traceback.format_exc())[-MAX_ERROR_CHARS:])
+    except Exception:  # e.g. no memory left, the parent still gets the exit code
+        pass
+
+
+def run_with_limits(func, args=(), timeout=None, max_rss_mb=None, max_address_space_mb=None, poll_interval=0.5,
+                    start_method='fork'):
+    '''
+    Run func(*args) in a child process with a wall-clock and memory budget
+
+    The child is killed if it runs longer than timeout or if its resident memory exceeds max_rss_mb. Additionally,
+    its address space can be limited by the operating system (max_address_space_mb), making allocations beyond the
+    limit fail with a MemoryError inside the child.
+
+    Args:
+        func: function to run. Its return value is discarded
+        args (optional): tuple of arguments for func
+        timeout (optional): maximum wall-clock time in seconds. Defaults to None, i.e. unlimited
+        max_rss_mb (optional): maximum resident memory of the child in MB. Defaults to None, i.e. unlimited
+        max_address_space_mb (optional): address space limit (RLIMIT_AS) of the child in MB. Defaults to None
+        poll_interval (optional): interval in seconds for checking time and memory of the child
+        start_method (optional): multiprocessing start method of the child. Defaults to 'fork'. Use 'forkserver' (or
+            'spawn') when other threads of the caller may hold locks (e.g. of HDF5 or logging) the child would inherit.
+            func and args must then be picklable
+
+    Returns:
+        tuple (status, duration, error) with status one of 'ok', 'error', 'memory' (any memory limit exceeded),
+        'timeout' or 'killed' (terminated by a signal from outside), duration in seconds and error the repr and
+        traceback of the exception raised by func as text, None if none
+    '''
+    ctx = multiprocessing.get_context(start_method)
+    reader, writer = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_limited_child, args=(func, args, max_address_space_mb, writer))
+    start = time.monotonic()
+    proc.start()
+    writer.close()  # only the child writes
+    status = None
+    while status is None:
+        proc.join(poll_interval)
+        if proc.exitcode is not None:
+            break
+        if timeout is not None and time.monotonic() - start > timeout:
+            status = 'timeout'
+        elif max_rss_mb is not None and (process_rss(proc.pid) or 0) > max_rss_mb * 2**20:
+            status = 'memory'
+    if status is not None:  # budget exceeded, stop child, first gently then for sure
+        proc.terminate()
+        proc.join(5)
+        if proc.is_alive():
+            proc.kill()
+            proc.join()
+    elif proc.exitcode == EXIT_OK:
+        status = 'ok'
+    elif proc.exitcode == EXIT_MEMORY:
+        status = 'memory'
+    elif proc.exitcode < 0:
+        status = 'killed'
+    else:
+        status = 'error'
+    proc.close()
+    error = None
+    try:
+        if reader.poll():
+            error = reader.recv()
+    except (EOFError, OSError):
+        pass
+    reader.close()
+    return status, time.monotonic() - start, error
@@ -0,0 +1,77 @@
+import datetime
+import math
+from collections import deque
+
+import numpy as np
+
+
+class ScanSchedule(object):
+    """Learn the cadence of the files of each scan from recent history to tell when a retrieval window is complete
+
+    Scans are identified by a key, e.g. (instrument_id, scan_type, scan_id). A scan is considered regular if the start
+    times of its recent files are evenly spaced and the files have a similar duration. For regular scans, a window is
+    complete as soon as it holds the expected number of files and the next file is expected to belong to the next window.
+
+    Args:
+        history (optional): number of most recent files per scan used for learning. Defaults to 12
+        min_files (optional): minimum number of files needed before a scan can be considered regular. Defaults to 4
+        tolerance (optional): maximum relative deviation of file spacing and duration from their median for a scan to be
+            considered regular. Defaults to 0.1
+    """
+
+    def __init__(self, history=12, min_files=4, tolerance=0.1):
+        self.history = history
+        self.min_files = min_files
+        self.tolerance = tolerance
+        self._files = {}  # key -> deque of (start_time, end_time) of the most recent files
+
+    def add_file(self, key, start_time, end_time):
+        """add a file of scan key to the history"""
+        files = self._files.setdefault(key, deque(maxlen=self.history))
+        if (start_time, end_time) not in files:
+            files.append((start_time, end_time))
+
+    def cadence(self, key):
+        """return (period, duration) of the files of scan key in seconds or None if not (yet) regular"""
+        files = sorted(self._files.get(key, []))
+        if len(files) < self.min_files:
+            return None
+        starts = np.array([(start - files[0][0]).total_seconds() for start, _ in files])
+        durations = np.array([(end - start).total_seconds() for start, end in files])
+        periods = np.diff(starts)
+        period = np.median(periods)
+        duration = np.median(durations)
+        if period <= 0:
+            return None
+        if np.any(np.abs(periods - period) > self.tolerance * period):
+            return None
+        if np.any(np.abs(durations - duration) > self.tolerance * max(duration, period)):
+            return None
+        return period, duration
+
+    def window_complete(self, key, batch):
+        '''
+        Check if the retrieval window of batch has received all files expected from the learned schedule of scan key
+
+        Files are assigned to all windows they overlap. The expected files are those of the learned period and phase (from
+        the most recent file) overlapping the window, which are up to one more than fit into the window. The window is
+        complete if it holds at least as many files and the next expected file starts at or after the end of the window,
+        i.e. does not overlap it.
+        '''
+        cadence = self.cadence(key)
+        if cadence is None:
+            return False
+        period, duration = cadence
+        if len(batch['files']) < self.expected_files(key, period, duration, batch['retrieval_start_time'],
+                                                     batch['retrieval_end_time']):
+            return False
+        next_start_time = batch['batch_end_time'] + datetime.timedelta(seconds=period - duration)
+        return next_start_time >= batch['retrieval_end_time']
+
+    def expected_files(self, key, period, duration, start_time, end_time):
+        """number of files of scan key with the given cadence overlapping the window from start_time to end_time"""
+        phase = max(self._files[key])[0]
+        # file k starts at phase + k * period and overlaps the window if it ends after its start and starts before its end
+        first = math.floor(((start_time - phase).total_seconds() - duration) / period) + 1
+        last = math.ceil((end_time - phase).total_seconds() / period) - 1
+        return max(0, last - first + 1)
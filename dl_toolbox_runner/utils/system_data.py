@@ -0,0 +1,139 @@
+import gzip
+import io
+import json
+import os
+import re
+from pathlib import Path
+
+import pandas as pd
+
+from dl_toolbox_runner.utils.compression import is_compressed, open_raw, strip_compression_ext
+
+STATE_FILE = 'offsets.json'
+DELIMITERS = {'.csv': ';', '.txt': '\t'}  # same as in read_system_data of file_utils
+
+
+def system_data_id(filename, prefix):
+    """get (instrument_id, kind) of a system data file, e.g. ('CABWL', 'environmental_data')"""
+    file = os.path.basename(strip_compression_ext(filename))
+    idx_id = file.find(prefix) + len(prefix)
+    instrument_id = file[idx_id:idx_id+5]
+    kind = re.match(r'_?([A-Za-z]+(?:_[A-Za-z]+)*)', file[idx_id+5:])
+    return instrument_id, kind.group(1).lower() if kind else 'system_data'
+
+
+class SystemDataStore(object):
+    """Incremental ingestion of growing system and environmental data files to a compact per-instrument store
+
+    The byte offset up to which each file has been ingested is kept in a state file in store_dir, hence each call only
+    reads and parses the rows appended since the previous call. Incomplete last lines are left for the next call. Files
+    which were truncated or replaced are ingested again from the start. New rows are appended as a gzip member to
+    <instrument_id>_<kind>.csv.gz in store_dir, e.g. CABWL_environmental_data.csv.gz.
+
+    Args:
+        store_dir: directory of the store and its state file
+        prefix (optional): file name prefix before the instrument id. Defaults to 'DWL_raw_'
+    """
+
+    def __init__(self, store_dir, prefix='DWL_raw_'):
+        self.store_dir = Path(store_dir)
+        self.prefix = prefix
+        self.state_file = self.store_dir / STATE_FILE
+        self.state = {}
+        if self.state_file.exists():
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+
+    def store_file(self, instrument_id, kind):
+        return self.store_dir / f'{instrument_id}_{kind}.csv.gz'
+
+    def ingest(self, filename, save_state=True, source=None):
+        '''
+        Parse the rows appended to filename since the last call and add them to the store
+
+        Args:
+            filename: path to a system data file (.csv or .txt, possibly compressed)
+            save_state (optional): write the offsets to the state file. Set to False when ingesting many files and call
+                save_state() at the end. Defaults to True
+            source (optional): path or url of the original file if filename is a local copy of it (e.g. staged or
+                downloaded, see input_backend). The offset is then kept for source and a copy renewed with a new inode
+                is not taken as replaced, only a shrinking file is ingested again from the start. Defaults to None
+
+        Returns:
+            pandas.DataFrame of the new rows, None if there are none
+        '''
+        key = os.path.abspath(filename) if source is None else str(source)
+        stat = os.stat(filename)
+        entry = self.state.get(key, {})
+        offset = entry.get('offset', 0)
+        replaced = source is None and entry.get('inode') not in (None, stat.st_ino)
+        if is_compressed(filename):  # offsets are in the decompressed stream, which can't grow in place
+            if entry.get('size') == stat.st_size and not replaced:
+                return None
+            offset = 0
+        elif stat.st_size < offset or replaced:  # truncated or rotated
+            offset = 0
+        elif stat.st_size == offset:
+            return None
+
+        with open_raw(filename, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read()
+        complete = chunk.rfind(b'\n') + 1  # only parse complete lines
+        if complete == 0 and is_compressed(filename) and chunk:
+            complete = len(chunk)  # compressed files are complete, even without trailing newline
+        self.state[key] = {'offset': offset + complete, 'size': stat.st_size, 'inode': None if source else stat.st_ino,
+                           'header': entry.get('header') if offset else None}
+        text = chunk[:complete].decode('utf-8-sig' if offset == 0 else 'utf-8', errors='replace')
+
+        ext = os.path.splitext(strip_compression_ext(filename))[-1]
+        if ext == '.csv' and offset == 0:  # csv files start with a header line
+            header, _, text = text.partition('\n')
+            self.state[key]['header'] = header.strip()
+        header = self.state[key]['header']
+        if not text.strip():
+            if save_state:
+                self.save_state()
+            return None
+
+        names = header.split(DELIMITERS[ext]) if header else None
+        rows = pd.read_csv(io.StringIO(text), sep=DELIMITERS[ext], header=None, names=names)
+        self.append(filename, text, header)
+        if save_state:
+            self.save_state()
+        return rows
+
+    def append(self, filename, text, header=None):
+        """append text rows of filename to the store file of its instrument and kind"""
+        store_file = self.store_file(*system_data_id(filename, self.prefix))
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        new_store = not store_file.exists()
+        with open(store_file, 'ab') as f, gzip.GzipFile(fileobj=f, mode='wb') as gz:  # one gzip member per call
+            if new_store and header:
+                gz.write((header + '\n').encode())
+            gz.write(text.encode())
+
+    def save_state(self):
+        """write the ingested offsets to the state file"""
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_name(STATE_FILE + '.part')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def read(self, instrument_id, kind):
+        """read all stored rows of instrument_id and kind"""
+        store_file = self.store_file(instrument_id, kind)
+        if not store_file.exists():
+            return None
+        with gzip.open(store_file, 'rt') as f:
+            first = f.readline()
+        sep = ';' if ';' in first else '\t'
+        return pd.read_csv(store_file, sep=sep, header=0 if sep == DELIMITERS['.csv'] else None)  # only csv has header
+
+
+def get_system_data_store(conf):
+    """get the system data store configured in the main config dictionary conf, None if no system_data_store_dir"""
+    if not conf.get('system_data_store_dir'):
+        return None
+    return SystemDataStore(conf['system_data_store_dir'], prefix=conf.get('input_file_prefix', 'DWL_raw_'))
@@ -0,0 +1,79 @@
+# Benchmark of plan_batches against grouping the files one by one with create_batch and add_to_batch, as batch_files
+# did before. Only the grouping is timed, reading the file metadata is not part of it.
+#
+#   python3 -m tests.benchmark_batch_planner --files 100000 --instruments 50 300
+
+import argparse
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+
+from dl_toolbox_runner.utils.batch_planner import files_to_table, plan_batches
+from dl_toolbox_runner.utils.file_utils import add_to_batch, create_batch
+
+SCANS = [('DBS_TP', 303), ('VAD', 304), ('Stare', 305), ('RHI', 306)]
+
+
+def make_file_dicts(n_files, n_instruments, seed=0):
+    """synthetic file metadata of n_files files of n_instruments instruments with 4 scans each within one hour"""
+    rng = np.random.default_rng(seed)
+    t0 = datetime.datetime(2023, 1, 1)
+    starts = np.sort(rng.uniform(0, 3600, n_files))
+    file_dicts = []
+    for start, instrument, scan in zip(starts, rng.integers(n_instruments, size=n_files),
+                                       rng.integers(len(SCANS), size=n_files)):
+        file_start_time = pd.Timestamp(t0 + datetime.timedelta(seconds=float(start)))
+        file_dicts.append({'file': f'DWL_raw_{instrument:03d}WL_{file_start_time:%Y-%m-%d_%H-%M-%S}.nc',
+                           'instrument_id': f'{instrument:03d}WL', 'scan_type': SCANS[scan][0],
+                           'scan_id': SCANS[scan][1], 'scan_resolution': 50, 'file_start_time': file_start_time,
+                           'file_end_time': file_start_time + pd.Timedelta(seconds=68)})
+    return file_dicts
+
+
+def loop_batches(file_dicts, retrieval_start_time, retrieval_end_time):
+    """group the files one by one, scanning the list of batches for the one of each file as batch_files did before"""
+    batches = []
+    for file_dict in file_dicts:
+        key = (file_dict['instrument_id'], file_dict['scan_type'], file_dict['scan_id'])
+        if any((batch['instrument_id'], batch['scan_type'], batch['scan_id']) == key for batch in batches):
+            for batch in batches:
+                if (batch['instrument_id'], batch['scan_type'], batch['scan_id']) == key:
+                    add_to_batch(batch, file_dict)
+        else:
+            batches.append(create_batch(file_dict, retrieval_start_time, retrieval_end_time))
+    return batches
+
+
+def same_batches(batches, reference):
+    """batches are identical apart from their creation time and rounding of the summed lengths"""
+    ignore = {'batch_creation_time', 'batch_length_sec'}
+    return len(batches) == len(reference) and all(
+        {key: value for key, value in batch.items() if key not in ignore}
+        == {key: value for key, value in ref.items() if key not in ignore}
+        and abs(batch['batch_length_sec'] - ref['batch_length_sec']) < 1e-6 for batch, ref in zip(batches, reference))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark plan_batches against grouping files one by one')
+    parser.add_argument('--files', type=int, default=100000, help='number of files')
+    parser.add_argument('--instruments', type=int, nargs='+', default=[50, 300], help='numbers of instruments')
+    args = parser.parse_args()
+
+    retrieval_start_time, retrieval_end_time = pd.Timestamp('2023-01-01 00:00'), pd.Timestamp('2023-01-01 01:00')
+    for n_instruments in args.instruments:
+        file_dicts = make_file_dicts(args.files, n_instruments)
+        start = time.perf_counter()
+        reference = loop_batches(file_dicts, retrieval_start_time, retrieval_end_time)
+        loop_sec = time.perf_counter() - start
+        start = time.perf_counter()
+        batches = plan_batches(files_to_table(file_dicts), retrieval_start_time=retrieval_start_time,
+                               retrieval_end_time=retrieval_end_time)
+        table_sec = time.perf_counter() - start
+        print(f'{args.files} files, {n_instruments} instruments ({len(batches)} batches): '
+              f'{loop_sec:.2f} s -> {table_sec:.2f} s, identical: {same_batches(batches, reference)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import unittest
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from dl_toolbox_runner.aggregate import DailyAggregator
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+
+outdir = abs_file_path('tests/tmp_test_aggregate')
+prefix = 'DWL_L1_'
+
+
+def write_window(start, value=1., freq='1min'):
+    """write a window output file with 10 profiles starting at start"""
+    start = pd.Timestamp(start)
+    times = pd.date_range(start, periods=10, freq=freq)
+    ds = xr.Dataset({'wspeed': (('time', 'height'), np.full((10, 3), value))},
+                    coords={'time': times, 'height': [100., 200., 300.]})
+    ds['station_altitude'] = 500.
+    file = os.path.join(outdir, f'{prefix}PAYWL_{start:%Y%m%d%H%M}.nc')
+    ds.to_netcdf(file)
+    return file
+
+
+class TestDailyAggregator(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+        self.daily_dir = os.path.join(outdir, 'daily')
+        self.aggregator = DailyAggregator(self.daily_dir, prefix)
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def read_daily(self, date='20230101'):
+        with xr.open_dataset(os.path.join(self.daily_dir, f'{prefix}PAYWL_{date}.nc')) as ds:
+            return ds.load()
+
+    def test_append(self):
+        """windows end up sorted by time in one file per day"""
+        self.aggregator.submit([write_window('2023-01-01 00:10'), write_window('2023-01-01 00:00')])
+        self.aggregator.close()
+        self.aggregator.submit([write_window('2023-01-01 00:20'), write_window('2023-01-02 00:00')])
+        self.aggregator.close()
+        ds = self.read_daily()
+        self.assertEqual(len(ds.time), 30)
+        self.assertTrue(ds.get_index('time').is_monotonic_increasing)
+        self.assertEqual(float(ds.station_altitude), 500.)
+        self.assertEqual(len(self.read_daily('20230102').time), 10)
+        self.assertFalse([f for f in os.listdir(self.daily_dir) if f.endswith('.part') or f.endswith('.nc.lock')])
+
+    def test_append_in_place(self):
+        """later windows are appended to the daily file without rewriting it, keeping the precision of their times"""
+        self.aggregator.submit([write_window('2023-01-01 00:00')])
+        self.aggregator.close()
+        daily_file = os.path.join(self.daily_dir, f'{prefix}PAYWL_20230101.nc')
+        inode = os.stat(daily_file).st_ino
+        self.aggregator.submit([write_window('2023-01-01 00:10:30', value=2., freq='1500ms')])
+        self.aggregator.close()
+        self.assertEqual(os.stat(daily_file).st_ino, inode)
+        ds = self.read_daily()
+        self.assertEqual(len(ds.time), 20)
+        self.assertEqual(ds.time.values[-1], np.datetime64('2023-01-01 00:10:43.500'))
+        self.assertEqual(float(ds.wspeed[-1, 0]), 2.)
+
+    def test_replace(self):
+        """reprocessed windows replace the data of earlier runs"""
+        self.aggregator.submit([write_window('2023-01-01 00:00')])
+        self.aggregator.close()
+        self.aggregator.submit([write_window('2023-01-01 00:00', value=2.)])
+        self.aggregator.close()
+        ds = self.read_daily()
+        self.assertEqual(len(ds.time), 10)
+        self.assertTrue((ds.wspeed == 2.).all())
+
+    def test_daily_file(self):
+        self.assertIsNone(self.aggregator.daily_file('DWL_L1_PAYWL_quicklook.png'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import datetime
+import gzip
+import os
+import shutil
+import unittest
+
+from dl_toolbox_runner.archive import Archiver, get_archiver
+from dl_toolbox_runner.errors import DLConfigError
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+
+outdir = abs_file_path('tests/tmp_test_archive')
+input_dir = os.path.join(outdir, 'input')
+archive_dir = os.path.join(outdir, 'archive')
+
+
+def make_batch(files, start, end):
+    return {'instrument_id': 'PAYWL', 'scan_type': 'DBS', 'scan_id': 0, 'files': files,
+            'retrieval_start_time': start, 'retrieval_end_time': end}
+
+
+class TestArchiver(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(input_dir, exist_ok=True)
+        self.files = []
+        for name in ['DWL_raw_PAYWL_20230101_2355.hpl', 'DWL_raw_PAYWL_20230102_0005.hpl']:
+            path = os.path.join(input_dir, name)
+            with open(path, 'w') as f:
+                f.write('data of ' + name)
+            self.files.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_archive_after_grace(self):
+        archiver = Archiver(archive_dir, grace_min=60)
+        archiver.record([make_batch(self.files, datetime.datetime(2023, 1, 1, 23, 50), datetime.datetime(2023, 1, 2, 0, 0))])
+        archiver.record([make_batch(self.files[1:], datetime.datetime(2023, 1, 2, 0, 0), datetime.datetime(2023, 1, 2, 0, 10))])
+        self.assertEqual(archiver.archive_due(now=datetime.datetime(2023, 1, 2, 0, 30)), 0)
+        self.assertEqual(archiver.archive_due(now=datetime.datetime(2023, 1, 2, 1, 5)), 1)  # later window of 2nd file
+        self.assertFalse(os.path.exists(self.files[0]))
+        self.assertTrue(os.path.exists(self.files[1]))
+        self.assertEqual(archiver.archive_due(now=datetime.datetime(2023, 1, 2, 1, 10)), 1)
+        self.assertEqual(os.listdir(input_dir), [])
+        # files are partitioned by the date of their first window
+        self.assertEqual(sorted(os.listdir(os.path.join(archive_dir, 'PAYWL', '2023', '01', '01'))),
+                         [os.path.basename(file) for file in self.files])
+
+    def test_link_and_compress(self):
+        inode = os.stat(self.files[0]).st_ino
+        target = Archiver(archive_dir, partition=None, mode='link').archive(self.files[0], 'PAYWL', datetime.datetime(2023, 1, 1))
+        self.assertEqual(os.stat(target).st_ino, inode)
+        self.assertFalse(os.path.exists(self.files[0]))
+
+        mtime = os.path.getmtime(self.files[1])
+        target = Archiver(archive_dir, partition=None, compress='.gz').archive(self.files[1], 'PAYWL', datetime.datetime(2023, 1, 2))
+        self.assertTrue(target.endswith('.hpl.gz'))
+        with gzip.open(target, 'rt') as f:
+            self.assertEqual(f.read(), 'data of DWL_raw_PAYWL_20230102_0005.hpl')
+        self.assertEqual(os.path.getmtime(target), mtime)
+        self.assertFalse(os.path.exists(self.files[1]))
+
+    def test_get_archiver(self):
+        self.assertIsNone(get_archiver({'input_dir': input_dir}))
+        self.assertIsInstance(get_archiver({'input_dir': input_dir, 'archive_dir': archive_dir}), Archiver)
+        with self.assertRaises(DLConfigError):
+            get_archiver({'input_dir': input_dir, 'archive_dir': os.path.join(input_dir, 'archive')})
+        with self.assertRaises(DLConfigError):
+            get_archiver({'input_dir': input_dir, 'archive_dir': archive_dir, 'archive_mode': 'copy'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import datetime
+import os
+import shutil
+import time
+import unittest
+from queue import Queue
+
+from dl_toolbox_runner.retrieval_manager import RealTimeWatcher
+from dl_toolbox_runner.simulate import write_halo_file
+from dl_toolbox_runner.utils.config_utils import get_main_config
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+
+outdir = abs_file_path('tests/tmp_test_backlog')
+input_dir = os.path.join(outdir, 'input')
+start = datetime.datetime(2023, 1, 1, 10, 0)
+
+
+class TestBacklog(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(os.path.join(input_dir, 'sub'), exist_ok=True)
+        conf = get_main_config(abs_file_path('dl_toolbox_runner/config/main_config.yaml'))
+        conf.update({'input_dir': input_dir, 'output_dir': os.path.join(outdir, 'output'), 'file_metadata_cache': None,
+                     'failure_ledger': None, 'backlog_workers': 2})
+        self.watcher = RealTimeWatcher(Queue(), 'DWL_raw_', conf=conf, now=lambda: datetime.datetime(2023, 1, 1, 10, 30))
+        self.files = []
+        for ind, directory in enumerate([input_dir, os.path.join(input_dir, 'sub')]):
+            file_start = start + datetime.timedelta(minutes=10*ind)
+            path = os.path.join(directory, f'DWL_raw_LINWL_Stare_142_{file_start:%Y%m%d_%H%M%S}.hpl')
+            write_halo_file(path, file_start, n_rays=10, ray_sec=60, n_gates=5)
+            self.files.append(path)
+        self.old_file = os.path.join(input_dir, 'DWL_raw_LINWL_Stare_142_20230101_090000.hpl')
+        write_halo_file(self.old_file, start - datetime.timedelta(hours=1), n_rays=10, ray_sec=60, n_gates=5)
+        os.utime(self.old_file, (time.time() - 3600, time.time() - 3600))
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_backlog(self):
+        """recent files are ingested once, complete windows dispatched and live events processed after the backlog"""
+        self.assertEqual(self.watcher.find_backlog(input_dir, time.time() - 40*60), sorted(self.files))
+        self.watcher.ingest_backlog(input_dir)
+        self.assertTrue(self.watcher.seeded.is_set())
+        self.assertEqual(self.watcher.counts['files_ingested'], 2)
+        self.assertEqual(self.watcher.queue.qsize(), 1)  # 10:00 - 10:10 ended more than 15 minutes ago
+        self.assertEqual(self.watcher.queue.get()['files'], self.files[:1])
+        self.assertEqual(len(self.watcher.retrieval_batches), 1)
+        self.assertEqual(self.watcher.retrieval_batches[0]['files'], self.files[1:])
+
+        self.watcher.ingest_file(self.files[1])  # reported again by an event, not counted twice
+        self.assertEqual(self.watcher.counts['files_ingested'], 2)
+        self.assertEqual(self.watcher.retrieval_batches[0]['files'], self.files[1:])
+
+    def test_retrieved_windows(self):
+        """windows with outputs written before the restart are not retrieved again"""
+        output_dir = os.path.join(outdir, 'output')
+        os.makedirs(output_dir)
+        open(os.path.join(output_dir, 'DWL_L1_LINWL_202301011020.nc'), 'w').close()
+        self.watcher.ingest_backlog(input_dir)
+        self.assertEqual(self.watcher.queue.qsize(), 1)
+        self.assertEqual(self.watcher.retrieval_batches, [])
+
+    def test_dispatched_windows(self):
+        """files arriving late for windows already dispatched do not open a new batch for them"""
+        self.watcher.ingest_backlog(input_dir)
+        self.watcher.now = lambda: datetime.datetime(2023, 1, 1, 10, 45)
+        self.watcher.check_and_process_batch(self.watcher.retrieval_batches[0], delay=15)  # 10:10 - 10:20 dispatched
+        self.assertEqual(self.watcher.retrieval_batches, [])
+        late_file = os.path.join(input_dir, 'DWL_raw_LINWL_Stare_142_20230101_100500.hpl')
+        write_halo_file(late_file, start + datetime.timedelta(minutes=5), n_rays=10, ray_sec=60, n_gates=5)
+        self.watcher.ingest_file(late_file)  # 10:05 - 10:14
+        self.assertEqual(self.watcher.counts['files_ingested'], 3)
+        self.assertEqual(self.watcher.retrieval_batches, [])
+
+    def test_disabled(self):
+        self.watcher.backlog_horizon = 0
+        self.watcher.ingest_backlog(input_dir)
+        self.assertTrue(self.watcher.seeded.is_set())
+        self.assertEqual(self.watcher.counts['files_ingested'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import datetime
+import unittest
+
+import pandas as pd
+
+from dl_toolbox_runner.errors import DLConfigError
+from dl_toolbox_runner.utils.batch_planner import coalesce_windows, files_to_table, iter_windows, plan_batches
+from dl_toolbox_runner.utils.config_utils import check_windows
+
+
+def make_file_dict(file, instrument_id, start, minutes, scan_type='DBS_TP', scan_id=303):
+    start = pd.Timestamp(start)
+    return {'file': file, 'instrument_id': instrument_id, 'scan_type': scan_type, 'scan_id': scan_id,
+            'scan_resolution': 50, 'file_start_time': start, 'file_end_time': start + pd.Timedelta(minutes=minutes)}
+
+
+class TestBatchPlanner(unittest.TestCase):
+
+    def setUp(self):
+        self.file_dicts = [make_file_dict('a1', 'PAYWL', '2023-01-01 00:01', 1),
+                           make_file_dict('b1', 'SHAWL', '2023-01-01 00:02', 1),
+                           make_file_dict('a2', 'PAYWL', '2023-01-01 00:08', 2),
+                           make_file_dict('a3', 'PAYWL', '2023-01-01 00:12', 1)]
+        self.date_start = datetime.datetime(2023, 1, 1, 0, 0)
+        self.date_end = datetime.datetime(2023, 1, 1, 0, 20)
+
+    def test_group_by_instrument_and_scan(self):
+        """files of the same instrument and scan end up in one batch, in order of appearance"""
+        batches = plan_batches(files_to_table(self.file_dicts), retrieval_start_time=self.date_start,
+                               retrieval_end_time=self.date_end)
+        self.assertEqual([b['files'] for b in batches], [['a1', 'a2', 'a3'], ['b1']])
+        self.assertEqual(batches[0]['batch_start_time'], pd.Timestamp('2023-01-01 00:01'))
+        self.assertEqual(batches[0]['batch_end_time'], pd.Timestamp('2023-01-01 00:13'))
+        self.assertEqual(batches[0]['batch_length_sec'], 240)
+        self.assertEqual(batches[0]['retrieval_end_time'], self.date_end)
+
+    def test_single_process(self):
+        """one batch per file"""
+        batches = plan_batches(files_to_table(self.file_dicts), single_process=True)
+        self.assertEqual([b['files'] for b in batches], [['a1'], ['b1'], ['a2'], ['a3']])
+
+    def test_long_file(self):
+        """a file reaching beyond the retrieval window only counts with its part within the window"""
+        file_dicts = [make_file_dict('stare', 'PAYWL', '2023-01-01 00:05', 20, scan_type='Stare'),
+                      make_file_dict('a1', 'PAYWL', '2023-01-01 00:12', 1, scan_type='Stare')]
+        batches = plan_batches(files_to_table(file_dicts), retrieval_start_time=pd.Timestamp('2023-01-01 00:10'),
+                               retrieval_end_time=pd.Timestamp('2023-01-01 00:20'))
+        self.assertEqual([b['files'] for b in batches], [['stare', 'a1']])
+        self.assertEqual(batches[0]['batch_length_sec'], 660)
+        self.assertEqual(batches[0]['file_end_times'], [pd.Timestamp('2023-01-01 00:25'), pd.Timestamp('2023-01-01 00:13')])
+
+    def test_common_window(self):
+        """files are clipped to a common retrieval window"""
+        batches = plan_batches(files_to_table(self.file_dicts), retrieval_start_time=self.date_start,
+                               retrieval_end_time=datetime.datetime(2023, 1, 1, 0, 9))
+        self.assertEqual(batches[0]['batch_length_sec'], 120)
+        self.assertEqual(batches[0]['file_end_times'][1], pd.Timestamp('2023-01-01 00:10'))
+
+    def test_empty(self):
+        self.assertEqual(plan_batches(files_to_table([])), [])
+
+
+class TestIterWindows(unittest.TestCase):
+
+    def windows(self, start, end, window_min, stride_min=None):
+        return [(str(s.time()), str(e.time())) for s, e in
+                iter_windows(pd.Timestamp(start), pd.Timestamp(end), window_min, stride_min)]
+
+    def test_adjacent(self):
+        self.assertEqual(self.windows('2023-01-01 00:05', '2023-01-01 00:25', 10),
+                         [('00:00:00', '00:10:00'), ('00:10:00', '00:20:00'), ('00:20:00', '00:30:00')])
+        self.assertEqual(self.windows('2023-01-01 00:10', '2023-01-01 00:20', 10), [('00:10:00', '00:20:00')])
+
+    def test_zero_length(self):
+        self.assertEqual(self.windows('2023-01-01 00:10', '2023-01-01 00:10', 10), [('00:10:00', '00:20:00')])
+
+    def test_stride(self):
+        self.assertEqual(self.windows('2023-01-01 00:12', '2023-01-01 00:13', 30, 10),
+                         [('23:50:00', '00:20:00'), ('00:00:00', '00:30:00'), ('00:10:00', '00:40:00')])
+
+    def test_check_windows(self):
+        """window length and stride must divide the hour, as windows are counted from midnight"""
+        check_windows({'retrieval_window_min': 30, 'retrieval_stride_min': 10})
+        check_windows({})
+        for conf in [{'retrieval_window_min': 7}, {'retrieval_window_min': 30, 'retrieval_stride_min': 25},
+                     {'retrieval_stride_min': 0}, {'retrieval_window_min': 7.5}]:
+            with self.assertRaises(DLConfigError):
+                check_windows(conf)
+
+
+class TestCoalesceWindows(unittest.TestCase):
+
+    def make_batch(self, instrument_id, start_minute, conf='a'):
+        start = pd.Timestamp('2023-01-01') + pd.Timedelta(minutes=start_minute)
+        return {'instrument_id': instrument_id, 'scan_type': 'DBS_TP', 'scan_id': 303, 'conf': conf,
+                'date': pd.Timestamp('2023-01-01'), 'retrieval_start_time': start,
+                'retrieval_end_time': start + pd.Timedelta(minutes=10)}
+
+    def test_coalesce(self):
+        batches = [self.make_batch('PAYWL', 10), self.make_batch('SHAWL', 0), self.make_batch('PAYWL', 0),
+                   self.make_batch('PAYWL', 30), self.make_batch('PAYWL', 20, conf='b')]
+        groups = coalesce_windows(batches, max_windows=6, conf_key=lambda batch: batch['conf'])
+        self.assertEqual([[batch['retrieval_start_time'].minute for batch in group] for group in groups],
+                         [[0, 10], [0], [30], [20]])
+        self.assertEqual(groups[1][0]['instrument_id'], 'SHAWL')
+
+    def test_max_windows(self):
+        batches = [self.make_batch('PAYWL', minute) for minute in range(0, 60, 10)]
+        self.assertEqual([len(group) for group in coalesce_windows(batches, max_windows=4)], [4, 2])
+        self.assertEqual(len(coalesce_windows(batches)), 6)
+
+    def test_overlapping_windows(self):
+        """30 minute windows every 10 minutes are consecutive with the stride, not with their end"""
+        batches = [self.make_batch('PAYWL', minute) for minute in [0, 10, 20, 40]]
+        for batch in batches:
+            batch['retrieval_end_time'] = batch['retrieval_start_time'] + pd.Timedelta(minutes=30)
+        self.assertEqual([len(group) for group in coalesce_windows(batches, max_windows=6)], [1, 1, 1, 1])
+        self.assertEqual([len(group) for group in coalesce_windows(batches, max_windows=6, stride_min=10)], [3, 1])
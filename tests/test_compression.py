@@ -0,0 +1,63 @@
+import gzip
+import lzma
+import os
+import shutil
+import unittest
+
+from dl_toolbox_runner.utils.compression import DecompressionCache, open_raw, split_compression_ext
+from dl_toolbox_runner.utils.file_utils import abs_file_path, find_file_time_halo, find_file_time_windcube, get_insttype
+from tests.test_input_backend import write_halo_file
+
+datafile = abs_file_path('dl_toolbox_runner/data/input/DWL_raw_PAYWL_2023-01-01_00-06-12_dbs_303_50mTP.nc')
+outdir = abs_file_path('tests/tmp_test_compression')
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+        self.file_gz = os.path.join(outdir, os.path.basename(datafile) + '.gz')
+        with open(datafile, 'rb') as f_in, gzip.open(self.file_gz, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_split_compression_ext(self):
+        self.assertEqual(split_compression_ext('a/b.hpl.xz'), ('a/b.hpl', '.xz'))
+        self.assertEqual(split_compression_ext('a/b.nc'), ('a/b.nc', None))
+
+    def test_get_insttype(self):
+        self.assertEqual(get_insttype(self.file_gz), 'windcube')
+        self.assertEqual(get_insttype('DWL_raw_LINWL_User1_142_20110108_160345.hpl.bz2'), 'halo')
+
+    def test_decompression_cache(self):
+        """files are decompressed once and give the same times as the original file"""
+        cache = DecompressionCache(os.path.join(outdir, 'cache'))
+        path = cache.path(self.file_gz)
+        self.assertEqual(os.path.basename(path), os.path.basename(datafile))
+        self.assertEqual(find_file_time_windcube(path), find_file_time_windcube(datafile))
+        mtime = os.stat(path).st_mtime_ns
+        self.assertEqual(cache.path(self.file_gz), path)
+        self.assertGreaterEqual(os.stat(path).st_mtime_ns, mtime)
+        self.assertEqual(cache.path(datafile), datafile)
+
+    def test_corrupt_archive(self):
+        """a file failing to decompress leaves neither copy nor temporary file behind"""
+        corrupt = os.path.join(outdir, 'DWL_raw_LINWL_Stare_142_20230101_100000.hpl.gz')
+        with open(corrupt, 'wb') as f:
+            f.write(b'no gzip data')
+        cache = DecompressionCache(os.path.join(outdir, 'cache'))
+        with self.assertRaises(OSError):
+            cache.path(corrupt)
+        self.assertEqual([files for _, _, files in os.walk(os.path.join(outdir, 'cache'))], [[], []])
+
+    def test_halo_streaming(self):
+        """times of compressed HALO files are the same as for the uncompressed file"""
+        file = os.path.join(outdir, 'DWL_raw_LINWL_Stare_142_20230101_100000.hpl')
+        write_halo_file(file, n_rays=50)
+        with open(file, 'rb') as f_in, lzma.open(file + '.xz', 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        self.assertEqual(find_file_time_halo(file + '.xz'), find_file_time_halo(file))
+        with open_raw(file + '.xz', 'rt') as f:
+            self.assertTrue(f.readline().startswith('Filename:'))
@@ -0,0 +1,129 @@
+import os
+import shutil
+import unittest
+
+import pandas as pd
+
+from dl_toolbox_runner.errors import ToolboxRunError
+from dl_toolbox_runner.main import Runner
+from dl_toolbox_runner.utils.config_utils import get_main_config
+from dl_toolbox_runner.utils.failure_ledger import FailureLedger, batch_fingerprint, batch_key, file_fingerprint
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+
+outdir = abs_file_path('tests/tmp_test_failure_ledger')
+
+
+class TestFailureLedger(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+        self.now = 1e9
+        self.ledger_file = os.path.join(outdir, 'ledger.json')
+        self.ledger = FailureLedger(self.ledger_file, backoff_min=10, max_backoff_min=30, quarantine_attempts=3,
+                                    clock=lambda: self.now)
+        self.file = os.path.join(outdir, 'DWL_raw_PAYWL_2023-01-01_00-06-12_dbs_303_50mTP.nc')
+        with open(self.file, 'w') as f:
+            f.write('corrupt')
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_backoff(self):
+        """failed files are skipped until their backoff, doubling with each attempt up to the maximum, expires"""
+        fingerprint = file_fingerprint(self.file)
+        self.assertFalse(self.ledger.skip(self.file, fingerprint))
+        for attempts, backoff_min in [(1, 10), (2, 20), (3, 30), (4, 30)]:
+            self.assertEqual(self.ledger.record_failure(self.file, OSError('bad'), fingerprint), attempts)
+            self.now += backoff_min*60 - 1
+            self.assertTrue(self.ledger.skip(self.file, fingerprint))
+            self.now += 1
+            self.assertFalse(self.ledger.skip(self.file, fingerprint))
+
+    def test_changed_file(self):
+        """a rewritten file is retried at once and its attempts start again"""
+        self.ledger.record_failure(self.file, OSError('bad'), file_fingerprint(self.file))
+        with open(self.file, 'a') as f:
+            f.write(' and fixed')
+        self.assertFalse(self.ledger.skip(self.file, file_fingerprint(self.file)))
+        self.assertEqual(self.ledger.record_failure(self.file, OSError('bad'), file_fingerprint(self.file)), 1)
+
+    def test_persistence_and_report(self):
+        for _ in range(3):
+            self.ledger.record_failure(self.file, ValueError('cannot decode'))
+        self.ledger.record_failure('batch:other', 'timeout')
+        ledger = FailureLedger(self.ledger_file, quarantine_attempts=3)
+        self.assertEqual(list(ledger.quarantined()), [self.file])
+        self.assertIn('ValueError: cannot decode', ledger.report())
+        self.assertIn('batch:other', ledger.report(all_entries=True))
+        ledger.record_success(self.file)
+        self.assertNotIn(self.file, FailureLedger(self.ledger_file))
+
+    def test_prune(self):
+        """entries of removed files and entries without failure for max_backoff_min are dropped when saving"""
+        removed = os.path.join(outdir, 'removed.nc')
+        with open(removed, 'w') as f:
+            f.write('corrupt')
+        self.ledger.record_failure(removed, OSError('bad'))
+        self.ledger.record_failure('batch:old', 'timeout')
+        self.ledger.record_failure('s3://bucket/file.nc', OSError('bad'))
+        os.remove(removed)
+        self.now += 30*60
+        self.ledger.record_failure(self.file, OSError('bad'))
+        self.assertEqual(set(FailureLedger(self.ledger_file).entries), {'batch:old', 's3://bucket/file.nc', self.file})
+        self.now += 1
+        self.ledger.record_failure('batch:new', 'timeout')
+        self.assertEqual(set(FailureLedger(self.ledger_file).entries), {'batch:new', self.file})
+        self.assertEqual([name for name in os.listdir(outdir) if name.endswith('.part')], [])
+
+    def test_batch(self):
+        batch = {'instrument_id': 'PAYWL', 'scan_type': 'DBS', 'scan_id': 303, 'files': [self.file],
+                 'retrieval_start_time': '2023-01-01 00:00:00', 'retrieval_end_time': '2023-01-01 00:10:00'}
+        fingerprint = batch_fingerprint(batch)
+        self.ledger.record_failure(batch_key(batch), 'timeout', fingerprint)
+        self.assertTrue(self.ledger.skip(batch_key(batch), fingerprint))
+        batch['files'].append(self.file + '.2')  # new files arrived for the window
+        self.assertFalse(self.ledger.skip(batch_key(batch), batch_fingerprint(batch)))
+
+
+class TestRunnerFailures(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+        conf = get_main_config(abs_file_path('dl_toolbox_runner/config/main_config.yaml'))
+        for key in ['aggregate_dir', 'archive_dir', 'notify_url', 'toolbox_failure_log', 'output_partition']:
+            conf.pop(key, None)
+        conf.update({'output_dir': os.path.join(outdir, 'output'), 'failure_ledger': os.path.join(outdir, 'ledger.json')})
+        self.runner = Runner(conf)
+        self.group = []
+        for minute in [0, 10, 20]:
+            start = pd.Timestamp('2023-01-01') + pd.Timedelta(minutes=minute)
+            self.group.append({'instrument_id': 'PAYWL', 'scan_type': 'DBS_TP', 'scan_id': 303, 'files': [],
+                               'date': pd.Timestamp('2023-01-01'), 'conf': f'conf_{minute}', 'retrieval_start_time': start,
+                               'retrieval_end_time': start + pd.Timedelta(minutes=10)})
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_partly_retrieved_group(self):
+        """windows of a group retrieved before the toolbox failed are not recorded as failed"""
+        def run_toolbox_limited(batches):
+            os.makedirs(conf['output_dir'], exist_ok=True)
+            open(os.path.join(conf['output_dir'], 'DWL_L1_PAYWL_202301010010.nc'), 'w').close()
+            raise ToolboxRunError('broken second window')
+
+        conf = self.runner.conf
+        self.runner.run_toolbox_limited = run_toolbox_limited
+        self.assertEqual(self.runner.retrieve_group(self.group), self.group[:1])
+        self.assertEqual(sorted(self.runner.failures.entries), sorted(batch_key(batch) for batch in self.group[1:]))
+
+    def test_failed_group(self):
+        def run_toolbox_limited(batches):
+            raise ToolboxRunError('timeout')
+
+        self.runner.run_toolbox_limited = run_toolbox_limited
+        with self.assertRaises(ToolboxRunError):
+            self.runner.retrieve_group(self.group)
+
+
+if __name__ == '__main__':
+    unittest.main()
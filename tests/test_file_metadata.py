@@ -0,0 +1,47 @@
+import os
+import shutil
+import unittest
+
+import pandas as pd
+
+from dl_toolbox_runner.utils.file_metadata import FileMetadataCache
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+
+outdir = abs_file_path('tests/tmp_test_file_metadata')
+
+
+class TestFileMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+        self.cache_file = os.path.join(outdir, 'file_metadata.json')
+        self.file = os.path.join(outdir, 'DWL_raw_PAYWL_2023-01-01_00-06-12_dbs_303_50mTP.nc')
+        with open(self.file, 'w') as f:
+            f.write('data')
+        self.times = (pd.Timestamp('2023-01-01 00:06:12'), pd.Timestamp('2023-01-01 00:07:18'))
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_reuse(self):
+        """times are reused by later runs until the file changes"""
+        cache = FileMetadataCache(self.cache_file)
+        self.assertIsNone(cache.get(self.file))
+        cache.put(self.file, *self.times)
+        cache.save()
+        self.assertEqual(FileMetadataCache(self.cache_file).get(self.file), self.times)
+        with open(self.file, 'a') as f:
+            f.write(' rewritten')
+        self.assertIsNone(FileMetadataCache(self.cache_file).get(self.file))
+
+    def test_max_entries(self):
+        cache = FileMetadataCache(self.cache_file, max_entries=2)
+        for name in ['a', 'b', 'c']:
+            cache.put(os.path.join(outdir, name), *self.times)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(os.path.join(outdir, 'a')))
+        self.assertEqual(cache.get(os.path.join(outdir, 'c')), self.times)
+
+
+if __name__ == '__main__':
+    unittest.main()
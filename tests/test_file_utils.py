@@ -1,10 +1,11 @@
+import datetime
 import unittest
 
 import pandas as pd
 import xarray as xr
 
 from dl_toolbox_runner.errors import FilenameError
-from dl_toolbox_runner.utils.file_utils import abs_file_path, get_insttype, rewrite_time_reference_units, read_system_data
+from dl_toolbox_runner.utils.file_utils import abs_file_path, add_to_batch, create_batch, get_insttype, rewrite_time_reference_units, read_system_data, update_in_batch
 
 
 class TestFileUtils(unittest.TestCase):
@@ -42,4 +43,29 @@ class TestFileUtils(unittest.TestCase):
         testfile_system_halo = 'dl_toolbox_runner/data/input/DWL_raw_IAOWL_system_parameters_142_202410.txt'
         df_halo = read_system_data(testfile_system_halo)
         self.assertIsInstance(df_halo, pd.DataFrame)
-        
\ No newline at end of file
+        
+    def test_batch_time_slices(self):
+        """batches only count the part of their files within the retrieval window"""
+        t0 = datetime.datetime(2024, 1, 1, 10)
+        minutes = lambda m: datetime.timedelta(minutes=m)
+        file_dict = {'file': 'stare', 'instrument_id': 'A', 'scan_type': 'Stare', 'scan_id': 0, 'scan_resolution': None,
+                     'file_start_time': t0 + minutes(5), 'file_end_time': t0 + minutes(25)}
+        batch = create_batch(file_dict, t0 + minutes(10), t0 + minutes(20))
+        self.assertEqual(batch['batch_length_sec'], 600)
+        add_to_batch(batch, file_dict | {'file': 'next', 'file_start_time': t0 + minutes(19), 'file_end_time': t0 + minutes(30)})
+        self.assertEqual(batch['files'], ['stare', 'next'])
+        self.assertEqual(batch['batch_length_sec'], 660)
+        self.assertEqual(batch['batch_end_time'], t0 + minutes(30))
+        self.assertEqual(batch['file_end_times'], [t0 + minutes(25), t0 + minutes(30)])
+
+    def test_update_in_batch(self):
+        """a growing file only adds its new part within the retrieval window"""
+        t0 = datetime.datetime(2024, 1, 1, 10)
+        minutes = lambda m: datetime.timedelta(minutes=m)
+        file_dict = {'file': 'stare', 'instrument_id': 'A', 'scan_type': 'Stare', 'scan_id': 0, 'scan_resolution': None,
+                     'file_start_time': t0 + minutes(5), 'file_end_time': t0 + minutes(12)}
+        batch = create_batch(file_dict, t0 + minutes(10), t0 + minutes(20))
+        self.assertEqual(batch['batch_length_sec'], 120)
+        update_in_batch(batch, file_dict | {'file_end_time': t0 + minutes(25)})
+        self.assertEqual(batch['batch_length_sec'], 600)
+        self.assertEqual(batch['file_end_times'], [t0 + minutes(25)])
@@ -0,0 +1,60 @@
+import os
+import shutil
+import unittest
+
+import numpy as np
+
+from dl_toolbox_runner.utils.file_utils import abs_file_path, parse_halo, read_halo
+from dl_toolbox_runner.utils.halo_cache import HaloCache
+from tests.test_input_backend import write_halo_file
+
+outdir = abs_file_path('tests/tmp_test_halo_cache')
+
+
+class TestHaloCache(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+        self.file = os.path.join(outdir, 'DWL_raw_LINWL_User1_142_20230101_100000.hpl')
+        write_halo_file(self.file)
+        self.cache = HaloCache(os.path.join(outdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_cached_read(self):
+        """the second read is loaded memory-mapped from the cache and gives the same result as parsing"""
+        mheader, time_ds = read_halo(self.file)
+        self.assertIsNone(self.cache.load(self.file))
+        read_halo(self.file, cache=self.cache)
+        cached = self.cache.load(self.file)
+        self.assertIsInstance(cached[2].base, np.memmap)
+        mheader_cached, time_cached = read_halo(self.file, cache=self.cache)
+        self.assertEqual(mheader_cached, mheader)
+        self.assertTrue(time_cached.equals(time_ds))
+        _, mbeam, mdata = parse_halo(self.file)
+        np.testing.assert_array_equal(cached[1], mbeam)
+        np.testing.assert_array_equal(cached[2], mdata)
+
+    def test_changed_file(self):
+        read_halo(self.file, cache=self.cache)
+        write_halo_file(self.file, n_rays=30)
+        os.utime(self.file, ns=(0, os.stat(self.file).st_mtime_ns + 10**9))
+        self.assertIsNone(self.cache.load(self.file))
+        self.assertEqual(len(read_halo(self.file, cache=self.cache)[1]), 30)
+
+    def test_eviction(self):
+        """entries beyond max_mb are removed, partly evicted entries count as not cached"""
+        read_halo(self.file, cache=self.cache)
+        entry = self.cache.entry_dir(self.file)
+        size = sum(path.stat().st_size for path in entry.iterdir())
+        other = os.path.join(outdir, 'DWL_raw_LINWL_User1_142_20230101_110000.hpl')
+        write_halo_file(other, start_hour=11.0)
+        os.utime(entry / 'data.npy', (0, 0))
+        HaloCache(self.cache.cache_dir, max_mb=1.5 * size / 2**20).store(other, *parse_halo(other))
+        self.assertIsNone(self.cache.load(self.file))
+        self.assertIsNotNone(self.cache.load(other))
+
+
+if __name__ == '__main__':
+    unittest.main()
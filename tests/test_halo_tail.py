@@ -0,0 +1,126 @@
+import datetime
+import os
+import shutil
+import unittest
+from queue import Queue
+
+from dl_toolbox_runner.retrieval_manager import RealTimeWatcher
+from dl_toolbox_runner.simulate import write_halo_file
+from dl_toolbox_runner.utils.file_utils import abs_file_path, find_file_time_halo
+from dl_toolbox_runner.utils.halo_tail import HaloTailReader
+
+outdir = abs_file_path('tests/tmp_test_halo_tail')
+start = datetime.datetime(2023, 1, 1, 10, 0)
+
+
+def append_rays(filename, first_ray, n_rays, ray_sec=60, n_gates=5, partial=False):
+    """append rays to a HALO file written by write_halo_file, the last one cut within a gate line if partial"""
+    text = ''
+    for ray in range(first_ray, first_ray + n_rays):
+        text += f'{10 + ray * ray_sec / 3600:9.6f}   0.00  75.00  -0.25  -0.34\n'
+        text += ''.join(f'{gate:4d} -0.1234 1.012345 1.234567E-6\n' for gate in range(n_gates))
+    with open(filename, 'a') as f:
+        f.write(text[:-20] if partial else text)
+
+
+class TestHaloTailReader(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+        self.file = os.path.join(outdir, 'DWL_raw_LINWL_Stare_142_20230101_100000.hpl')
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_incremental_read(self):
+        write_halo_file(self.file, start, n_rays=0, ray_sec=60, n_gates=5)
+        reader = HaloTailReader(self.file)
+        self.assertEqual(reader.read_new(), [])
+        self.assertEqual(reader.n_gates, 5)
+
+        append_rays(self.file, 0, 3, partial=True)
+        times = reader.read_new()
+        self.assertEqual(len(times), 2)  # third ray not complete yet
+        offset = reader.offset
+        self.assertEqual(reader.read_new(), [])
+        self.assertEqual(reader.offset, offset)
+
+        with open(self.file, 'a') as f:  # complete the cut gate line of the third ray
+            f.write(' 1.234567E-6\n')
+        times = reader.read_new()
+        self.assertEqual(len(times), 1)
+        self.assertAlmostEqual(times[0], start + datetime.timedelta(minutes=2), delta=datetime.timedelta(seconds=1))
+        append_rays(self.file, 3, 7)
+        self.assertEqual(len(reader.read_new()), 7)
+        self.assertEqual(reader.n_rays, 10)
+        self.assertEqual((reader.start_time, reader.end_time), find_file_time_halo(self.file))
+
+    def test_rewritten_file(self):
+        write_halo_file(self.file, start, n_rays=10, ray_sec=60, n_gates=5)
+        reader = HaloTailReader(self.file)
+        self.assertEqual(len(reader.read_new()), 10)
+        write_halo_file(self.file, start, n_rays=3, ray_sec=60, n_gates=5)
+        self.assertEqual(len(reader.read_new()), 3)
+        self.assertEqual(reader.n_rays, 3)
+
+
+class TestWatcherTail(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+        self.file = os.path.join(outdir, 'DWL_raw_LINWL_Stare_142_20230101_100000.hpl')
+        self.now = datetime.datetime(2023, 1, 1, 10, 13)
+        self.watcher = RealTimeWatcher(Queue(), 'DWL_raw_', now=lambda: self.now)
+        self.watcher.halo_tail = True
+        self.watcher.snapshot_dir = os.path.join(outdir, 'snapshots')
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_growing_file(self):
+        """rays are fed to the windows as they arrive and windows are dispatched once the file grew beyond them"""
+        self.assertTrue(self.watcher.is_tailed_file(self.file))
+        self.assertFalse(self.watcher.is_tailed_file(self.file + '.gz'))
+        write_halo_file(self.file, start, n_rays=0, ray_sec=60, n_gates=5)
+        append_rays(self.file, 0, 8)  # 10:00 - 10:07
+        self.watcher.tail_events.append(self.file)
+        self.watcher.tail_growing_files()
+        self.assertEqual(len(self.watcher.retrieval_batches), 1)
+        self.assertAlmostEqual(self.watcher.retrieval_batches[0]['batch_length_sec'], 420, delta=1)
+
+        append_rays(self.file, 8, 5, partial=True)  # 10:08 - 10:11, 10:12 still being written
+        self.watcher.tail_growing_files()
+        self.assertEqual(self.watcher.queue.qsize(), 1)  # window 10:00 - 10:10 complete, no need to wait
+        dispatched = self.watcher.queue.get()
+        self.assertEqual(dispatched['retrieval_start_time'], start)
+        self.assertEqual(dispatched['source_files'], [self.file])
+        self.assertAlmostEqual(dispatched['batch_length_sec'], 600, delta=1)
+        self.assertEqual(len(self.watcher.retrieval_batches), 1)
+        self.assertAlmostEqual(self.watcher.retrieval_batches[0]['batch_length_sec'], 60, delta=1)
+
+        # the retrieval gets a copy of the complete rays, not the file being written
+        snapshot = dispatched['files'][0]
+        self.assertNotEqual(snapshot, self.file)
+        self.assertEqual(os.path.basename(snapshot), os.path.basename(self.file))
+        self.assertEqual(len(HaloTailReader(snapshot).read_new()), 12)
+        with open(snapshot, 'rb') as f, open(self.file, 'rb') as original:
+            self.assertEqual(f.read(), original.read(os.path.getsize(snapshot)))
+        self.watcher.x.release_inputs([dispatched])
+        self.assertFalse(os.path.exists(os.path.dirname(snapshot)))
+
+        with open(self.file, 'a') as f:  # complete the cut gate line of ray 10:12
+            f.write(' 1.234567E-6\n')
+        append_rays(self.file, 13, 2)  # 10:12 - 10:14, only extends the open window
+        self.watcher.tail_growing_files()
+        self.assertEqual(len(self.watcher.retrieval_batches), 1)
+        self.assertAlmostEqual(self.watcher.retrieval_batches[0]['batch_length_sec'], 240, delta=1)
+        self.assertEqual(self.watcher.retrieval_batches[0]['files'], [self.file])
+        self.assertEqual(self.watcher.counts['rays_tailed'], 15)
+
+        self.watcher.tail_idle_sec = 0
+        self.watcher.tail_growing_files()
+        self.assertEqual(self.watcher.tailed, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
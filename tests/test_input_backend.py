@@ -0,0 +1,174 @@
+import os
+import shutil
+import time
+import unittest
+
+import pandas as pd
+
+from dl_toolbox_runner.utils.file_utils import abs_file_path, find_file_time_halo, find_file_time_windcube
+from dl_toolbox_runner.utils.input_backend import LocalBackend, S3Backend, StagingBackend, evict_lru
+
+try:
+    import boto3
+    import h5netcdf  # noqa F401, needed by xarray for reading from file objects
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+datafile = abs_file_path('dl_toolbox_runner/data/input/DWL_raw_PAYWL_2023-01-01_00-06-12_dbs_303_50mTP.nc')
+cache_dir = abs_file_path('tests/tmp_test_input_backend')
+bucket = 'eprofile-dl-raw'
+
+
+def write_halo_file(filename, n_rays=20, n_gates=100, start_hour=10.0, ray_sec=10):
+    """write a minimal HALO .hpl file with n_rays rays of n_gates gates each"""
+    header = ['Filename:\tDWL_raw_XXXWL_Stare_142_20230101_100000', 'System ID:\t142',
+              f'Number of gates:\t{n_gates}', 'Range gate length (m):\t30.0', 'Gate length (pts):\t10',
+              'Pulses/ray:\t10000', 'No. of rays in file:\t1', 'Scan type:\tStare', 'Focus range:\t65535',
+              'Start time:\t20230101 10:00:00.00', 'Resolution (m/s):\t0.0382',
+              'Altitude of measurement (center of gate) = (range gate + 0.5) * Gate length',
+              'Data line 1: Decimal time (hours)  Azimuth (degrees)  Elevation (degrees) Pitch (degrees) Roll (degrees)',
+              'f9.6,1x,f6.2,1x,f6.2',
+              'Data line 2: Range Gate  Doppler (m/s)  Intensity (SNR + 1)  Beta (m-1 sr-1)',
+              'i3,1x,f6.4,1x,f8.6,1x,e12.6 - repeat for no. gates', '****']
+    with open(filename, 'w') as f:
+        f.write('\n'.join(header) + '\n')
+        for ray in range(n_rays):
+            f.write(f'{start_hour + ray * ray_sec / 3600:9.6f}   0.00  90.00  -0.25  -0.34\n')
+            for gate in range(n_gates):
+                f.write(f'{gate:4d} -0.1234 1.012345 1.234567E-6\n')
+
+
+@unittest.skipIf(mock_aws is None, 'boto3, h5netcdf and moto are needed for testing the S3 backend')
+class TestS3Backend(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=bucket)
+        client.upload_file(str(datafile), bucket, 'raw/' + os.path.basename(datafile))
+        os.makedirs(cache_dir, exist_ok=True)
+        halo_file = os.path.join(cache_dir, 'DWL_raw_LINWL_Stare_142_20230101_100000.hpl')
+        write_halo_file(halo_file)
+        client.upload_file(halo_file, bucket, 'raw/' + os.path.basename(halo_file))
+        self.backend = S3Backend(cache_dir, client=client, block_size=2**12)
+
+    def tearDown(self):
+        self.mock.stop()
+        shutil.rmtree(cache_dir)
+
+    def test_list_files(self):
+        files = self.backend.list_files(f's3://{bucket}/raw/', 'DWL_raw_PAYWL*')
+        self.assertEqual(files, [f's3://{bucket}/raw/' + os.path.basename(datafile)])
+
+    def test_ranged_reads(self):
+        """times from remote files are the same as for local files but only need part of the file"""
+        url = f's3://{bucket}/raw/' + os.path.basename(datafile)
+        n_bytes = []
+        read_range = self.backend.read_range
+        self.backend.read_range = lambda *args: n_bytes.append(args[2]) or read_range(*args)
+        with self.backend.open(url) as fileobj:
+            times = find_file_time_windcube(fileobj)
+        self.assertEqual(times, find_file_time_windcube(datafile))
+        self.assertLess(sum(n_bytes), os.path.getsize(datafile))
+
+        halo_url = f's3://{bucket}/raw/DWL_raw_LINWL_Stare_142_20230101_100000.hpl'
+        with self.backend.open(halo_url) as fileobj:
+            start_time, end_time = find_file_time_halo(fileobj)
+        self.assertEqual(start_time, pd.Timestamp('2023-01-01 10:00:00'))
+        self.assertEqual(end_time.round('s'), pd.Timestamp('2023-01-01 10:03:10'))
+
+    def test_local_path(self):
+        """files are downloaded once to the cache"""
+        url = f's3://{bucket}/raw/' + os.path.basename(datafile)
+        path = self.backend.local_path(url)
+        self.assertEqual(os.path.getsize(path), os.path.getsize(datafile))
+        self.backend.client = None  # no further requests possible, must be served from cache
+        self.assertEqual(self.backend.local_path(url), path)
+
+    def test_rewritten_object(self):
+        """objects rewritten with the same size are downloaded again"""
+        url = f's3://{bucket}/raw/DWL_raw_LINWL_Stare_142_20230101_100000.hpl'
+        path = self.backend.local_path(url)
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.backend.client.put_object(Bucket=bucket, Key=url.split('/', 3)[3], Body=data.replace(b'-0.1234', b'-0.4321'))
+        self.backend._etags.clear()  # as for a new run
+        with open(self.backend.local_path(url), 'rb') as f:
+            self.assertEqual(f.read(), data.replace(b'-0.1234', b'-0.4321'))
+        self.assertEqual([name for name in os.listdir(os.path.dirname(path)) if name.endswith('.part')], [])
+
+
+class TestLocalBackend(unittest.TestCase):
+
+    def test_list_and_read(self):
+        backend = LocalBackend()
+        files = backend.list_files(os.path.dirname(datafile), os.path.basename(datafile))
+        self.assertEqual(files, [str(datafile)])
+        self.assertEqual(backend.read_range(datafile, 1, 3), b'HDF')
+
+    def test_evict_lru(self):
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            for ind in range(3):
+                with open(os.path.join(cache_dir, f'{ind}.bin'), 'wb') as f:
+                    f.write(b'0' * 100)
+                os.utime(os.path.join(cache_dir, f'{ind}.bin'), (ind, ind))
+            evict_lru(cache_dir, 200)
+            self.assertEqual(sorted(os.listdir(cache_dir)), ['1.bin', '2.bin'])
+            os.utime(os.path.join(cache_dir, '2.bin'))  # in use
+            evict_lru(cache_dir, 0, keep=[os.path.join(cache_dir, '1.bin')], min_age_sec=60)
+            self.assertEqual(sorted(os.listdir(cache_dir)), ['1.bin', '2.bin'])
+            evict_lru(cache_dir, 0, min_age_sec=60)
+            self.assertEqual(sorted(os.listdir(cache_dir)), ['2.bin'])
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+class TestStagingBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = os.path.join(cache_dir, 'nfs')
+        self.staging_dir = os.path.join(cache_dir, 'staging')
+        os.makedirs(self.input_dir)
+        shutil.copy(datafile, self.input_dir)
+        self.file = os.path.join(self.input_dir, os.path.basename(datafile))
+        self.backend = StagingBackend(self.input_dir, self.staging_dir, buffer_size=4096)
+
+    def tearDown(self):
+        shutil.rmtree(cache_dir)
+
+    def test_list_files(self):
+        self.assertEqual(self.backend.list_files(self.input_dir, 'DWL_raw_PAYWL_*'), [self.file])
+        self.assertEqual(self.backend.list_files(self.input_dir, 'DWL_raw_SHAWL_*'), [])
+
+    def test_stage_and_release(self):
+        """files are copied once and read from the staged copy until the original changes or the copy is released"""
+        staged = self.backend.local_path(self.file)
+        self.assertEqual(staged, os.path.join(self.staging_dir, os.path.basename(datafile)))
+        self.assertEqual(find_file_time_windcube(staged), find_file_time_windcube(datafile))
+        self.assertEqual(self.backend.local_path(self.file), staged)
+        self.assertEqual(self.backend.local_path(staged), staged)
+
+        with open(self.file, 'ab') as f:  # original rewritten, staged again
+            f.write(b'\0')
+        self.backend._stats.clear()
+        self.assertEqual(os.path.getsize(self.backend.local_path(self.file)), os.path.getsize(self.file))
+
+        self.backend.release(staged)
+        self.assertFalse(os.path.exists(staged))
+        self.backend.release(self.file)  # nothing staged any more
+
+    def test_evict_least_recently_used(self):
+        """copies used again are kept, the least recently used one is evicted"""
+        files = [self.file] + [shutil.copy(self.file, os.path.join(self.input_dir, name)) for name in ['b.nc', 'c.nc']]
+        a, b = self.backend.local_path(files[0]), self.backend.local_path(files[1])
+        inode = os.stat(a).st_ino
+        time.sleep(0.01)
+        self.assertEqual(self.backend.local_path(files[0]), a)  # used again, not copied again
+        self.assertEqual(os.stat(a).st_ino, inode)
+        self.backend.staging_max_mb = 2.5 * os.path.getsize(self.file) / 2**20
+        self.backend.local_path(files[2])
+        self.assertTrue(os.path.exists(a))
+        self.assertFalse(os.path.exists(b))
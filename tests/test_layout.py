@@ -0,0 +1,52 @@
+import datetime
+import os
+import shutil
+import unittest
+
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+from dl_toolbox_runner.utils.layout import migrate_layout, output_file_key, partition_dir, toolbox_conf_key
+
+outdir = abs_file_path('tests/tmp_test_layout')
+scheme = '{instrument_id}/{YYYY}/{MM}/{DD}'
+
+
+class TestLayout(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_partition_dir(self):
+        date = datetime.datetime(2023, 1, 2, 3, 4)
+        self.assertEqual(partition_dir(outdir, scheme, 'PAYWL', date), os.path.join(outdir, 'PAYWL', '2023', '01', '02'))
+        self.assertEqual(partition_dir(outdir, None, 'PAYWL', date), str(outdir))
+        partition_dir(outdir, '{YYYY}{MM}{DD}/{HH}', 'PAYWL', date, create=True)
+        self.assertTrue(os.path.isdir(os.path.join(outdir, '20230102', '03')))
+
+    def test_output_file_key(self):
+        self.assertEqual(output_file_key('/data/DWL_L1_PAYWL_202301020310.nc', 'DWL_L1_'),
+                         ('PAYWL', datetime.datetime(2023, 1, 2, 3, 10)))
+        self.assertIsNone(output_file_key('/data/DWL_L1_PAYWL_20230102.nc.lock', 'DWL_L1_'))
+
+    def test_migrate(self):
+        """flat files are moved to their partitions, unknown files are left in place"""
+        for name in ['DWL_L1_PAYWL_202301020310.nc', 'DWL_L1_SHAWL_202301030000.nc', 'notes.txt']:
+            open(os.path.join(outdir, name), 'w').close()
+        conf_file = os.path.join(outdir, 'tmp_config_012_03.conf')
+        with open(conf_file, 'w') as f:
+            f.write('NC_instrument_id=PAYWL\n')
+        conf_dir = partition_dir(outdir, scheme, 'PAYWL', datetime.datetime.fromtimestamp(os.path.getmtime(conf_file)))
+        key = lambda file: output_file_key(file, 'DWL_L1_') or toolbox_conf_key(file)
+        self.assertEqual(migrate_layout(outdir, scheme, key, dry_run=True), 3)
+        self.assertEqual(migrate_layout(outdir, scheme, key), 3)
+        self.assertTrue(os.path.isfile(os.path.join(outdir, 'PAYWL', '2023', '01', '02', 'DWL_L1_PAYWL_202301020310.nc')))
+        self.assertTrue(os.path.isfile(os.path.join(outdir, 'SHAWL', '2023', '01', '03', 'DWL_L1_SHAWL_202301030000.nc')))
+        self.assertTrue(os.path.isfile(os.path.join(conf_dir, 'tmp_config_012_03.conf')))  # by modification time
+        self.assertTrue(os.path.isfile(os.path.join(outdir, 'notes.txt')))
+        self.assertEqual(migrate_layout(outdir, scheme, key), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
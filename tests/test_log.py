@@ -0,0 +1,44 @@
+import logging
+import time
+import unittest
+
+from dl_toolbox_runner.log import RateLimitFilter, SuppressedCountFormatter
+
+
+def make_record(level=logging.INFO, lineno=1, msg='file processed'):
+    return logging.LogRecord('dl_toolbox_runner', level, 'main.py', lineno, msg, None, None)
+
+
+class TestRateLimitFilter(unittest.TestCase):
+
+    def test_burst(self):
+        """only 'burst' records per call site pass within an interval, other call sites are not affected"""
+        filt = RateLimitFilter(interval=60, burst=3)
+        passed = [filt.filter(make_record()) for _ in range(10)]
+        self.assertEqual(sum(passed), 3)
+        self.assertTrue(filt.filter(make_record(lineno=2)))
+
+    def test_warnings_pass(self):
+        filt = RateLimitFilter(interval=60, burst=1)
+        passed = [filt.filter(make_record(level=logging.WARNING)) for _ in range(5)]
+        self.assertTrue(all(passed))
+
+    def test_suppressed_count_reported(self):
+        filt = RateLimitFilter(interval=0.05, burst=1)
+        for _ in range(4):
+            filt.filter(make_record())
+        time.sleep(0.06)
+        record = make_record()
+        self.assertTrue(filt.filter(record))
+        self.assertEqual(record.suppressed, 3)
+        self.assertEqual(record.getMessage(), 'file processed')
+
+    def test_suppressed_count_formatted(self):
+        """the count is appended when formatting a copy, the record stays unchanged for other handlers"""
+        record = make_record(msg='file %s processed')
+        record.args = ('a',)
+        record.suppressed = 3
+        formatter = SuppressedCountFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        self.assertEqual(formatter.format(record), 'INFO file a processed [3 similar messages suppressed]')
+        self.assertEqual(record.getMessage(), 'file a processed')
+        self.assertEqual(logging.Formatter('%(message)s').format(make_record()), 'file processed')
@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+import socket
+import unittest
+
+from dl_toolbox_runner.notify import SINKS, get_notifier, register_sink
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+
+outdir = abs_file_path('tests/tmp_test_notify')
+event = {'event': 'retrieval_done', 'instrument_id': 'PAYWL', 'outputs': ['DWL_L1_PAYWL_202301010010.nc']}
+
+
+class TestNotify(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_file_sink(self):
+        path = os.path.join(outdir, 'outputs.jsonl')
+        notifier = get_notifier({'notify': [{'path': path}]})
+        notifier.publish(event)
+        notifier.publish(event)
+        with open(path) as f:
+            self.assertEqual([json.loads(line) for line in f], [event, event])
+
+    def test_unix_socket_sink(self):
+        path = os.path.join(outdir, 'outputs.sock')
+        notifier = get_notifier({'notify': [{'type': 'unix_socket', 'path': path}]})
+        notifier.publish(event)  # no consumer yet, dropped
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as consumer:
+            consumer.bind(path)
+            consumer.settimeout(5)
+            notifier.publish(event)
+            self.assertEqual(json.loads(consumer.recv(65536)), event)
+
+    def test_fifo_sink(self):
+        path = os.path.join(outdir, 'outputs.fifo')
+        notifier = get_notifier({'notify': [{'type': 'fifo', 'path': path}]})
+        notifier.publish(event)  # no consumer yet, dropped
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            notifier.publish(event)
+            self.assertEqual(json.loads(os.read(fd, 65536)), event)
+        finally:
+            os.close(fd)
+
+    def test_register_sink(self):
+        received = []
+
+        class ListSink(object):
+            def __init__(self, prefix):
+                self.prefix = prefix
+
+            def send(self, message):
+                received.append(self.prefix + message.decode())
+
+        register_sink('list', ListSink)
+        try:
+            get_notifier({'notify': [{'type': 'list', 'prefix': '> '}]}).publish(event)
+        finally:
+            SINKS.pop('list')
+        self.assertEqual(received, ['> ' + json.dumps(event) + '\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import threading
+import time
+import unittest
+
+from dl_toolbox_runner.utils.pipeline import StagedExecutor
+
+
+class TestStagedExecutor(unittest.TestCase):
+
+    def test_stages(self):
+        """items pass all stages, with fan-out and dropping"""
+        stages = [('split', lambda n: [n] * n, 2),  # n copies of n, 0 is dropped
+                  ('square', lambda n: [n * n], 3)]
+        results = StagedExecutor(stages, queue_size=2).run(range(4))
+        self.assertEqual(sorted(results), [1, 4, 4, 9, 9, 9])
+
+    def test_overlap(self):
+        """first items reach the last stage before the first stage has seen all items"""
+        seen = []
+        lock = threading.Lock()
+
+        def first(n):
+            with lock:
+                seen.append(('first', n))
+            time.sleep(0.01)
+            return [n]
+
+        def last(n):
+            with lock:
+                seen.append(('last', n))
+            return [n]
+
+        StagedExecutor([('first', first, 1), ('last', last, 1)], queue_size=1).run(range(10))
+        self.assertLess(seen.index(('last', 0)), seen.index(('first', 9)))
+
+    def test_bounded_queue(self):
+        """a slow stage makes the feeding stage wait instead of piling up items"""
+        done_first = []
+        max_ahead = []
+
+        def first(n):
+            done_first.append(n)
+            return [n]
+
+        def slow(n):
+            time.sleep(0.005)
+            max_ahead.append(len(done_first) - n)
+            return [n]
+
+        StagedExecutor([('first', first, 1), ('slow', slow, 1)], queue_size=2).run(range(30))
+        self.assertLessEqual(max(max_ahead), 5)  # queue_size plus items held by workers
+
+    def test_errors(self):
+        def fail_odd(n):
+            if n % 2:
+                raise ValueError(n)
+            return [n]
+
+        failed = []
+        results = StagedExecutor([('check', fail_odd, 2)], on_error=lambda stage, item, err: failed.append(item)).run(range(6))
+        self.assertEqual(sorted(results), [0, 2, 4])
+        self.assertEqual(sorted(failed), [1, 3, 5])
+        with self.assertRaises(ValueError):
+            StagedExecutor([('check', fail_odd, 2)]).run(range(6))
+
+    def test_fatal_errors(self):
+        """errors raised by on_error or BaseExceptions stop processing and are re-raised instead of blocking run()"""
+        def fail(stage, item, err):
+            raise RuntimeError(item)
+
+        stages = [('first', lambda n: [n], 1), ('check', lambda n: 1 / n and [n], 1), ('last', lambda n: [n], 1)]
+        with self.assertRaises(RuntimeError):
+            StagedExecutor(stages, queue_size=1, on_error=fail).run(range(20))
+
+        def stop(n):
+            raise SystemExit(n)
+
+        with self.assertRaises(SystemExit):
+            StagedExecutor([('first', lambda n: [n], 2), ('stop', stop, 1)], queue_size=1).run(range(20))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import pstats
+import shutil
+import threading
+import unittest
+
+from dl_toolbox_runner.errors import DLConfigError
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+from dl_toolbox_runner.utils.profiling import Profiler, get_profiler
+
+outdir = abs_file_path('tests/tmp_test_profiling')
+
+
+def work():
+    return sorted(str(i) for i in range(20000))
+
+
+class TestProfiler(unittest.TestCase):
+
+    def tearDown(self):
+        shutil.rmtree(outdir, ignore_errors=True)
+
+    def profiles(self, ext):
+        return sorted(file for file in os.listdir(outdir) if file.endswith(ext)) if os.path.exists(outdir) else []
+
+    def test_cprofile(self):
+        profiler = Profiler(outdir, stages=['toolbox'])
+        with profiler.profile('toolbox', 'PAYWL_DBS_0_202301010000'):
+            with profiler.profile('toolbox', 'nested'):  # skipped, would disturb the outer profile
+                work()
+        with profiler.profile('read', 'DWL_raw_PAYWL_20230101_0000.hpl'):  # stage not selected
+            work()
+        profiles = self.profiles('.prof')
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith('toolbox_PAYWL_DBS_0_202301010000_'))
+        stats = pstats.Stats(os.path.join(outdir, profiles[0]))
+        self.assertIn('work', [func[2] for func in stats.stats])
+        self.assertEqual(len(self.profiles('.txt')), 1)
+
+    def test_sample_rate(self):
+        draws = iter([0.5, 0.01, 0.2])
+        profiler = Profiler(outdir, sample_rate=0.1, rng=lambda: next(draws))
+        for ind in range(3):
+            with profiler.profile('configure', f'batch{ind}'):
+                work()
+        self.assertEqual([file.split('_')[1] for file in self.profiles('.prof')], ['batch1'])
+
+    def test_tracemalloc(self):
+        profiler = Profiler(outdir, mode='tracemalloc', top=5)
+        kept = []
+        with profiler.profile('ingest', 'file'):
+            kept.append(work())
+        profiles = self.profiles('.txt')
+        self.assertEqual(len(profiles), 1)
+        with open(os.path.join(outdir, profiles[0])) as f:
+            report = f.read()
+        self.assertIn('Peak traced memory', report)
+        self.assertIn('test_profiling.py', report)
+
+    def test_threads(self):
+        profiler = Profiler(outdir)
+
+        def run(ind):
+            with profiler.profile('read', f'file{ind}'):
+                work()
+        threads = [threading.Thread(target=run, args=(ind,)) for ind in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.profiles('.prof')), 3)
+
+    def test_get_profiler(self):
+        self.assertIsNone(get_profiler({}))
+        self.assertIsInstance(get_profiler({'profile_mode': 'cprofile', 'profile_dir': outdir}), Profiler)
+        with self.assertRaises(DLConfigError):
+            get_profiler({'profile_mode': 'perf'})
+        with self.assertRaises(DLConfigError):
+            get_profiler({'profile_mode': 'cprofile', 'profile_stages': ['scan']})
+
+
+if __name__ == '__main__':
+    unittest.main()
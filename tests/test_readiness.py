@@ -0,0 +1,76 @@
+import os
+import shutil
+import unittest
+
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+from dl_toolbox_runner.utils.readiness import ReadinessTracker, is_temp_name
+
+outdir = abs_file_path('tests/tmp_test_readiness')
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class TestReadiness(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+        self.clock = Clock()
+        self.tracker = ReadinessTracker(settle_sec=5, clock=self.clock)
+        self.file = os.path.join(outdir, 'DWL_raw_PAYWL_2023-01-01_00-06-12_dbs_303_50mTP.nc')
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def write(self, file, data, mode='ab'):
+        with open(file, mode) as f:
+            f.write(data)
+
+    def test_is_temp_name(self):
+        self.assertTrue(is_temp_name('/data/.DWL_raw_PAYWL_2023-01-01_00-06-12_dbs_303_50mTP.nc.Xy12Ab'))
+        self.assertTrue(is_temp_name('/data/DWL_raw_PAYWL_2023-01-01_00-06-12_dbs_303_50mTP.nc.part'))
+        self.assertFalse(is_temp_name(self.file))
+
+    def test_settle(self):
+        """files are ready once events stopped and size/mtime are stable for settle_sec"""
+        self.write(self.file, b'a')
+        self.tracker.touch(self.file)
+        self.clock.now = 3
+        self.write(self.file, b'b')
+        self.tracker.touch(self.file)  # modified event restarts the wait
+        self.clock.now = 6
+        self.assertEqual(self.tracker.ready(), [])
+        self.clock.now = 8
+        self.write(self.file, b'c')  # changed without event
+        os.utime(self.file, ns=(0, os.stat(self.file).st_mtime_ns + 10**9))
+        self.assertEqual(self.tracker.ready(), [])
+        self.clock.now = 14
+        self.assertEqual(self.tracker.ready(), [self.file])
+        self.assertEqual(self.tracker.ready(), [])  # returned once only
+
+    def test_rename_from_temp(self):
+        """temporary files are ignored, renaming them to the final name makes them ready at once"""
+        tmp_file = os.path.join(outdir, '.' + os.path.basename(self.file) + '.Xy12Ab')
+        self.write(tmp_file, b'abc')
+        self.tracker.touch(tmp_file)
+        self.assertEqual(len(self.tracker), 0)
+        os.rename(tmp_file, self.file)
+        self.tracker.moved(tmp_file, self.file)
+        self.assertEqual(self.tracker.ready(), [self.file])
+
+    def test_removed(self):
+        self.write(self.file, b'a')
+        self.tracker.touch(self.file)
+        os.remove(self.file)
+        self.clock.now = 10
+        self.assertEqual(self.tracker.ready(), [])
+        self.assertNotIn(self.file, self.tracker)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import datetime
+import os
+import shutil
+import time
+import unittest
+from queue import Queue
+
+from dl_toolbox_runner.retrieval_manager import RealTimeWatcher
+from dl_toolbox_runner.simulate import write_halo_file, write_windcube_file
+from dl_toolbox_runner.utils.config_utils import get_main_config
+from dl_toolbox_runner.utils.file_utils import abs_file_path, open_sweep_group
+from dl_toolbox_runner.utils.resources import process_rss, resource_usage, run_with_limits
+
+watch_dir = abs_file_path('tests/tmp_test_resources')
+
+
+def sleep(sec):
+    time.sleep(sec)
+
+
+def allocate(n_mb):
+    data = bytearray(n_mb * 2**20)  # noqa F841
+    time.sleep(2)
+
+
+def fail():
+    raise ValueError('broken input')
+
+
+class TestRunWithLimits(unittest.TestCase):
+
+    def test_ok(self):
+        status, duration, error = run_with_limits(sleep, (0.1,), timeout=10)
+        self.assertEqual(status, 'ok')
+        self.assertIsNone(error)
+
+    def test_timeout(self):
+        status, duration, _ = run_with_limits(sleep, (30,), timeout=0.5, poll_interval=0.1)
+        self.assertEqual(status, 'timeout')
+        self.assertLess(duration, 10)
+
+    def test_error(self):
+        status, _, error = run_with_limits(fail, timeout=10)
+        self.assertEqual(status, 'error')
+        self.assertTrue(error.startswith("ValueError('broken input')"))
+        self.assertIn('Traceback', error)
+
+    def test_forkserver(self):
+        status, _, error = run_with_limits(fail, timeout=30, start_method='forkserver')
+        self.assertEqual(status, 'error')
+        self.assertIn('broken input', error)
+
+    def test_memory(self):
+        """a child exceeding its rss budget is killed"""
+        rss_mb = process_rss() / 2**20
+        status, _, _ = run_with_limits(allocate, (200,), max_rss_mb=rss_mb + 100, poll_interval=0.1)
+        self.assertEqual(status, 'memory')
+
+
+class TestResourceUsage(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(watch_dir, exist_ok=True)
+        conf = get_main_config(abs_file_path('dl_toolbox_runner/config/main_config.yaml'))
+        for key in ['halo_cache_dir', 'system_data_store_dir']:
+            conf.pop(key, None)
+        conf['input_dir'] = str(watch_dir)
+        self.watcher = RealTimeWatcher(Queue(), conf['input_file_prefix'], conf=conf)
+
+    def tearDown(self):
+        shutil.rmtree(watch_dir)
+
+    def ingest(self, n_files, first=0):
+        """write and ingest n_files windcube and n_files halo files of consecutive scans"""
+        for ind in range(first, first + n_files):
+            start = datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=76 * ind)
+            file = os.path.join(watch_dir, f'DWL_raw_000WL_{start:%Y-%m-%d_%H-%M-%S}_dbs_303_50mTP.nc')
+            write_windcube_file(file, start, start + datetime.timedelta(seconds=66), 25)
+            self.watcher.ingest_file(file)
+            file = os.path.join(watch_dir, f'DWL_raw_001WL_VAD_142_{start:%Y%m%d_%H%M%S}.hpl')
+            write_halo_file(file, start, 18, 3, n_gates=20)
+            self.watcher.ingest_file(file)
+
+    def test_flat_resource_usage(self):
+        """ingesting thousands of files does not leave files open or datasets cached"""
+        self.ingest(100)
+        before = resource_usage()
+        self.ingest(500, first=100)
+        after = resource_usage()
+        self.assertLessEqual(after['open_fds'], before['open_fds'])
+        self.assertEqual(after['cached_datasets'], 0)
+        self.assertLess(after['rss_mb'] - before['rss_mb'], 100)
+
+    def test_closed_after_reading(self):
+        """datasets returned by the readers are loaded and their files closed, even while still referenced"""
+        write_windcube_file(os.path.join(watch_dir, 'a.nc'), datetime.datetime(2024, 1, 1),
+                            datetime.datetime(2024, 1, 1, 0, 1), 5)
+        ds_sweep = open_sweep_group(os.path.join(watch_dir, 'a.nc'), 'sweep_1')
+        self.assertEqual(resource_usage()['cached_datasets'], 0)
+        self.assertEqual(len(ds_sweep.time), 5)
@@ -0,0 +1,73 @@
+import datetime
+import unittest
+
+from dl_toolbox_runner.utils.scan_schedule import ScanSchedule
+
+key = ('PAYWL', 'DBS_TP', 303)
+t0 = datetime.datetime(2023, 1, 1, 0, 0, 12)
+
+
+def file_times(ind, period=75, duration=68):
+    start = t0 + datetime.timedelta(seconds=ind * period)
+    return start, start + datetime.timedelta(seconds=duration)
+
+
+def make_batch(n_files, window_start=datetime.datetime(2023, 1, 1, 0, 0), inds=None):
+    inds = range(n_files) if inds is None else inds
+    return {'files': [f'file_{ind}' for ind in inds], 'batch_end_time': file_times(max(inds))[1],
+            'retrieval_start_time': window_start, 'retrieval_end_time': window_start + datetime.timedelta(minutes=10)}
+
+
+class TestScanSchedule(unittest.TestCase):
+
+    def test_regular(self):
+        schedule = ScanSchedule()
+        for ind in range(6):
+            schedule.add_file(key, *file_times(ind))
+        period, duration = schedule.cadence(key)
+        self.assertEqual(period, 75)
+        self.assertEqual(duration, 68)
+
+    def test_irregular(self):
+        """no cadence for too few files or unevenly spaced files"""
+        schedule = ScanSchedule()
+        for ind in [0, 1, 2]:
+            schedule.add_file(key, *file_times(ind))
+        self.assertIsNone(schedule.cadence(key))
+        schedule.add_file(key, *file_times(5))
+        self.assertIsNone(schedule.cadence(key))
+
+    def test_window_complete(self):
+        """file 8 (starting at 00:10:12) belongs to the next window only, hence the window is complete with 8 files"""
+        schedule = ScanSchedule()
+        for ind in range(8):
+            schedule.add_file(key, *file_times(ind))
+        window_start = datetime.datetime(2023, 1, 1, 0, 0, 10)
+        self.assertFalse(schedule.window_complete(key, make_batch(7, window_start)))
+        self.assertTrue(schedule.window_complete(key, make_batch(8, window_start)))
+        self.assertFalse(schedule.window_complete(('SHAWL', 'DBS', 34), make_batch(8, window_start)))
+
+    def test_previous_file_overlapping(self):
+        """the file before file 0 ends at 00:00:05 and is expected in a window starting at 00:00"""
+        schedule = ScanSchedule()
+        for ind in range(8):
+            schedule.add_file(key, *file_times(ind))
+        self.assertFalse(schedule.window_complete(key, make_batch(8)))
+        self.assertTrue(schedule.window_complete(key, make_batch(9, inds=range(-1, 8))))
+
+    def test_next_file_overlapping(self):
+        """a window is not complete while the next file still overlaps it, even if most of that file is beyond it"""
+        schedule = ScanSchedule()
+        for ind in range(8):
+            schedule.add_file(key, *file_times(ind))
+        batch = make_batch(8, window_start=datetime.datetime(2023, 1, 1, 0, 0, 22))  # file 8 starts at 00:10:12
+        self.assertFalse(schedule.window_complete(key, batch))
+
+    def test_missing_file(self):
+        """a window from 00:01 overlaps 9 files (0 to 8), it is not complete with 8 of them even if the last one arrived"""
+        schedule = ScanSchedule()
+        for ind in range(9):
+            schedule.add_file(key, *file_times(ind))
+        window_start = datetime.datetime(2023, 1, 1, 0, 1)
+        self.assertFalse(schedule.window_complete(key, make_batch(8, window_start, inds=[0, 1, 2, 3, 5, 6, 7, 8])))
+        self.assertTrue(schedule.window_complete(key, make_batch(9, window_start)))
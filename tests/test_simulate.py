@@ -0,0 +1,45 @@
+import datetime
+import os
+import shutil
+import unittest
+
+from dl_toolbox_runner.simulate import FleetSimulator, SimClock, write_halo_file, write_windcube_file
+from dl_toolbox_runner.utils.file_utils import abs_file_path, find_file_time_halo, find_file_time_windcube
+
+outdir = abs_file_path('tests/tmp_test_simulate')
+
+
+class TestSimulate(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def test_synthetic_files(self):
+        """generated files are read with the times they were generated for"""
+        start = datetime.datetime(2024, 1, 1, 10, 0, 5)
+        end = start + datetime.timedelta(seconds=66)
+        file = os.path.join(outdir, 'DWL_raw_000WL_2024-01-01_10-00-05_dbs_303_50mTP.nc')
+        write_windcube_file(file, start, end, 25)
+        self.assertEqual(find_file_time_windcube(file), (start, end))
+        file = os.path.join(outdir, 'DWL_raw_001WL_VAD_142_20240101_100005.hpl')
+        write_halo_file(file, start, 18, 10)
+        self.assertAlmostEqual(find_file_time_halo(file)[0], start, delta=datetime.timedelta(seconds=0.01))  # decimal hours
+
+    def test_clock(self):
+        clock = SimClock(speed=1000)
+        clock.start()
+        clock.sleep_until(clock.start_time + datetime.timedelta(seconds=100))
+        self.assertGreaterEqual(clock(), clock.start_time + datetime.timedelta(seconds=100))
+
+    def test_run(self):
+        report = FleetSimulator(2, duration_min=30, speed=1200, toolbox_latency_sec=10, halo_fraction=0.5).run()
+        self.assertEqual(report['n_instruments'], 2)
+        self.assertGreater(report['batches_dispatched'], 0)
+        self.assertIn('p90', report['event_to_dispatch_sec'])
+
+
+if __name__ == '__main__':
+    unittest.main()
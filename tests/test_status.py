@@ -0,0 +1,65 @@
+import datetime
+import json
+import unittest
+import urllib.error
+import urllib.request
+from queue import Queue
+
+from dl_toolbox_runner.retrieval_manager import RealTimeWatcher
+from dl_toolbox_runner.status import StatusServer
+
+
+class TestStatusServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StatusServer(lambda: {'ok': True}, port=0)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get(self, path):
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.server.port}{path}', timeout=5) as response:
+            return json.load(response)
+
+    def test_status(self):
+        self.assertEqual(self.get('/status'), {'ok': True})
+        self.assertEqual(self.get('/'), {'ok': True})
+
+    def test_unknown_path(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.get('/other')
+        self.assertEqual(context.exception.code, 404)
+
+
+class TestWatcherStatus(unittest.TestCase):
+
+    def test_watcher_status(self):
+        """open batches are reported per instrument with their fill ratio and the status is json serialisable"""
+        now = datetime.datetime(2024, 1, 1, 10, 30)
+        watcher = RealTimeWatcher(Queue(), 'DWL_raw_', now=lambda: now)
+        start = datetime.datetime(2024, 1, 1, 10, 10)
+        watcher.retrieval_batches.append({
+            'instrument_id': '0-20000-0-06610_A', 'scan_type': 'DBS', 'scan_id': 0, 'files': ['a', 'b'],
+            'retrieval_start_time': start, 'retrieval_end_time': start + datetime.timedelta(minutes=10),
+            'batch_length_sec': 420, 'batch_creation_time': now - datetime.timedelta(minutes=5)})
+        watcher.check_and_process_batch(watcher.retrieval_batches[0], delay=15)
+        watcher.check_and_process_batch(watcher.retrieval_batches[0], delay=5)
+
+        status = json.loads(json.dumps(watcher.status()))
+        self.assertEqual(status['queue_depth'], 1)
+        self.assertEqual(status['n_batches'], 0)
+        self.assertEqual(status['counts']['batches_dispatched'], 1)
+        self.assertEqual(status['dispatch_latency_sec']['recent'], [600.0])
+
+        watcher.retrieval_batches.append({
+            'instrument_id': '0-20000-0-06610_A', 'scan_type': 'DBS', 'scan_id': 0, 'files': ['c'],
+            'retrieval_start_time': start, 'retrieval_end_time': start + datetime.timedelta(minutes=10),
+            'batch_length_sec': 150, 'batch_creation_time': now})
+        batch = watcher.status()['batches']['0-20000-0-06610_A'][0]
+        self.assertEqual(batch['fill_ratio'], 0.25)
+        self.assertEqual(batch['n_files'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import gzip
+import os
+import shutil
+import unittest
+
+from dl_toolbox_runner.utils.file_utils import abs_file_path
+from dl_toolbox_runner.utils.system_data import SystemDataStore, system_data_id
+
+outdir = abs_file_path('tests/tmp_test_system_data')
+env_file = abs_file_path('dl_toolbox_runner/data/input/DWL_raw_CABWL_environmental_data_2024-10-07_10-00-00.csv')
+sys_file = abs_file_path('dl_toolbox_runner/data/input/DWL_raw_IAOWL_system_parameters_142_202410.txt')
+
+
+class TestSystemData(unittest.TestCase):
+
+    def setUp(self):
+        os.makedirs(outdir, exist_ok=True)
+        self.store_dir = os.path.join(outdir, 'store')
+        with open(env_file, 'rb') as f:
+            self.env_lines = f.read().splitlines(keepends=True)
+        with open(sys_file, 'rb') as f:
+            self.sys_lines = f.read().splitlines(keepends=True)
+        self.env = os.path.join(outdir, os.path.basename(env_file))
+        self.sys = os.path.join(outdir, os.path.basename(sys_file))
+
+    def tearDown(self):
+        shutil.rmtree(outdir)
+
+    def write(self, file, lines, mode='wb'):
+        with open(file, mode) as f:
+            f.write(b''.join(lines))
+
+    def test_system_data_id(self):
+        self.assertEqual(system_data_id(env_file, 'DWL_raw_'), ('CABWL', 'environmental_data'))
+        self.assertEqual(system_data_id(str(sys_file) + '.gz', 'DWL_raw_'), ('IAOWL', 'system_parameters'))
+
+    def test_incremental(self):
+        """only appended complete rows are parsed, also after restarting with the saved state"""
+        self.write(self.env, self.env_lines[:5])
+        self.write(self.env, [self.env_lines[5][:10]], mode='ab')  # incomplete line
+        rows = SystemDataStore(self.store_dir).ingest(self.env)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows.columns[0], 'Timestamp')
+
+        self.write(self.env, [self.env_lines[5][10:]] + self.env_lines[6:10], mode='ab')
+        store = SystemDataStore(self.store_dir)  # state read from file
+        rows = store.ingest(self.env)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows['Name'].iloc[0], self.env_lines[5].decode().split(';')[1])
+        self.assertIsNone(store.ingest(self.env))
+
+        stored = store.read('CABWL', 'environmental_data')
+        self.assertEqual(len(stored), 9)
+        self.assertEqual(list(stored.columns), list(rows.columns))
+
+    def test_truncated(self):
+        self.write(self.sys, self.sys_lines[:10])
+        store = SystemDataStore(self.store_dir)
+        self.assertEqual(len(store.ingest(self.sys)), 10)
+        self.write(self.sys, self.sys_lines[:3])  # rotated file starting anew
+        self.assertEqual(len(store.ingest(self.sys)), 3)
+        self.assertEqual(len(store.read('IAOWL', 'system_parameters')), 13)
+
+    def test_local_copies(self):
+        """copies renewed with each change of the original (staged or from S3) continue at the offset of the original"""
+        store = SystemDataStore(self.store_dir)
+        copy = os.path.join(outdir, 'staged', os.path.basename(self.sys))
+        os.makedirs(os.path.dirname(copy))
+        for n_lines in [5, 12]:
+            self.write(self.sys, self.sys_lines[:n_lines])
+            shutil.copy(self.sys, copy + '.part')
+            os.replace(copy + '.part', copy)  # copied anew, with a new inode
+            rows = store.ingest(copy, source=self.sys)
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(len(store.read('IAOWL', 'system_parameters')), 12)
+        self.assertEqual(list(store.state), [self.sys])
+
+    def test_compressed(self):
+        file_gz = self.sys + '.gz'
+        with gzip.open(file_gz, 'wb') as f:
+            f.write(b''.join(self.sys_lines[:7]))
+        store = SystemDataStore(self.store_dir)
+        self.assertEqual(len(store.ingest(file_gz)), 7)
+        self.assertIsNone(store.ingest(file_gz))
+
+
+if __name__ == '__main__':
+    unittest.main()